@@ -0,0 +1,57 @@
+int num_agents = ...;
+int num_capabilities = ...;
+
+int crypto_size = ...;
+int trust_model_size = ...;
+int reputation_size = (num_agents-1) * num_capabilities * trust_model_size;
+int stereotype_size = trust_model_size;
+
+int total_memory_size_available = ...;
+ 
+int num_buffers = ...;
+range Buffers = 0..num_buffers-1;
+
+int buffer_weights[i in Buffers] = ...;
+
+int max_buffer_size = ...;
+range Sizes = 0..max_buffer_size;
+
+int max_buffer_sizes[i in Buffers] = ...;
+
+// Fraction of references to each buffer held by an LRU buffer of each size,
+// generated from simulation traces by stack_distances.py --dat
+float coverage[i in Buffers][s in Sizes] = ...;
+
+// Exactly one size is chosen for each buffer
+dvar boolean size_chosen[Buffers][Sizes];
+
+dexpr int buffer_sizes[i in Buffers] = sum(s in Sizes) s * size_chosen[i][s];
+
+dexpr float utility[i in Buffers] = sum(s in Sizes) coverage[i][s] * size_chosen[i][s];
+
+dexpr int memory_used =
+		crypto_size * buffer_sizes[0] +
+		trust_model_size * buffer_sizes[1] +
+		reputation_size * buffer_sizes[2] +
+		stereotype_size * buffer_sizes[3];
+
+maximize sum(i in Buffers) buffer_weights[i] * utility[i];
+
+subject to {
+	ct01:
+	memory_used <= total_memory_size_available;
+	
+	forall(i in Buffers) {
+		ct02:
+		sum(s in Sizes) size_chosen[i][s] == 1;
+		
+		ct03:
+		buffer_sizes[i] <= max_buffer_sizes[i];
+	}
+}
+
+execute {
+	for (var i in Buffers) {
+		writeln("buffer_sizes[", i, "] = ", buffer_sizes[i], " coverage = ", utility[i]);
+	}
+}
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks of the choose_* and use_* methods of every eviction strategy.
+
+Run from the root of the repository:
+
+    python -m benchmarks.eviction_strategies --sizes 4 16 64 256 --plot eviction-strategies.pdf
+
+The buffers of a single agent are filled with synthetic items about other agents.
+The fill level is the fraction of each buffer that is occupied, choose_* is only
+called by the simulation when a buffer is full, but the cost of strategies such as
+NotInOther also depends on how many of the other buffers hold the same agent.
+"""
+from __future__ import annotations
+
+import json
+import random
+import timeit
+
+from simulation.agent_buffers import AgentBuffers, CryptoItem, TrustItem, ReputationItem, StereotypeItem
+from simulation.capability import Capability
+from simulation import registry
+
+BUFFERS = AgentBuffers.buffers
+
+OPERATIONS = [f"{method}_{buffer}" for method in ("choose", "use") for buffer in BUFFERS]
+
+class SyntheticAgent:
+    def __init__(self, name: str, capabilities: List[Capability]):
+        self.name = name
+        self.capabilities = capabilities
+
+    def __repr__(self):
+        return f"SyntheticAgent({self.name})"
+
+class SyntheticSimulator:
+    """Just enough of a Simulator for the eviction strategies"""
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+        self.current_time = 0.0
+
+def all_eviction_strategies() -> list:
+    return [registry.EVICTION_STRATEGIES.get(name) for name in registry.EVICTION_STRATEGIES.names()]
+
+def fill_buffers(es: EvictionStrategy, sim: SyntheticSimulator, size: int, fill: float, num_capabilities: int, rng: random.Random):
+    """
+    Create an agent with buffers of the given size, each filled to the fill level.
+    Returns the buffers and a new item for each buffer that would need to be added.
+    """
+    capabilities = [Capability(f"C{n}", 1.0, n) for n in range(num_capabilities)]
+
+    owner = SyntheticAgent("owner", capabilities)
+
+    # Enough other agents that every buffer can be filled with different items
+    others = [SyntheticAgent(f"A{n}", capabilities) for n in range(max(size, 1) + 1)]
+
+    buffers = AgentBuffers(owner, size, size, size, size)
+
+    count = int(round(size * fill))
+
+    def trust_item(agent: SyntheticAgent, capability: Capability) -> TrustItem:
+        item = TrustItem(agent, capability)
+        item.correct_count = rng.randrange(20)
+        item.incorrect_count = rng.randrange(20)
+        return item
+
+    def reputation_item(agent: SyntheticAgent) -> ReputationItem:
+        trust_items = [
+            trust_item(rng.choice(others), rng.choice(capabilities))
+            for _ in range(min(size, 8))
+        ]
+        return ReputationItem(agent, trust_items)
+
+    def items(buffer: str, agents: list) -> list:
+        pairs = [(agent, capability) for agent in agents for capability in capabilities]
+
+        if buffer == "crypto":
+            return [CryptoItem(agent) for agent in agents]
+        elif buffer == "trust":
+            return [trust_item(agent, capability) for (agent, capability) in pairs]
+        elif buffer == "reputation":
+            return [reputation_item(agent) for agent in agents]
+        elif buffer == "stereotype":
+            return [StereotypeItem(agent, capability) for (agent, capability) in pairs]
+        else:
+            raise ValueError(buffer)
+
+    new_items = {}
+
+    for buffer in BUFFERS:
+        candidates = items(buffer, others)
+        rng.shuffle(candidates)
+
+        for item in candidates[:count]:
+            sim.current_time = rng.uniform(0, 100)
+            getattr(buffers, buffer).append(item)
+            getattr(es, f"add_{buffer}")(item)
+
+        new_items[buffer] = candidates[-1] if len(candidates) > count else items(buffer, [SyntheticAgent("new", capabilities)])[0]
+
+    sim.current_time = 100.0
+
+    return (buffers, new_items)
+
+def benchmark(cls, size: int, fill: float, num_capabilities: int, seed: int, repeat: int) -> dict:
+    """The best time in microseconds of each operation on a strategy"""
+    rng = random.Random(seed)
+    sim = SyntheticSimulator(seed)
+    es = cls(sim)
+
+    (buffers, new_items) = fill_buffers(es, sim, size, fill, num_capabilities, rng)
+
+    results = {}
+
+    for buffer in BUFFERS:
+        items = getattr(buffers, buffer)
+        new_item = new_items[buffer]
+
+        if not items:
+            continue
+
+        choose = getattr(es, f"choose_{buffer}")
+        use = getattr(es, f"use_{buffer}")
+
+        item = items[len(items) // 2]
+
+        for (operation, function) in ((f"choose_{buffer}", lambda: choose(items, buffers, new_item)),
+                                      (f"use_{buffer}", lambda: use(item))):
+            timer = timeit.Timer(function)
+            (number, _) = timer.autorange()
+            best = min(timer.repeat(repeat=repeat, number=number))
+            results[operation] = 1e6 * best / number
+
+    return results
+
+def print_table(results: dict, sizes: list):
+    for size in sizes:
+        print(f"Buffer size {size} (microseconds per call)")
+        print(f"{'Strategy':<14}" + "".join(f"{operation:>18}" for operation in OPERATIONS))
+
+        for (name, by_size) in results.items():
+            timings = by_size.get(size, {})
+            print(f"{name:<14}" + "".join(
+                f"{timings[operation]:>18.2f}" if operation in timings else f"{'-':>18}"
+                for operation in OPERATIONS
+            ))
+
+        print()
+
+def plot(results: dict, sizes: list, target: str):
+    import matplotlib.pyplot as plt
+
+    fig, axs = plt.subplots(nrows=2, ncols=len(BUFFERS), sharex=True, figsize=(20, 9))
+
+    for (row, method) in enumerate(("choose", "use")):
+        for (col, buffer) in enumerate(BUFFERS):
+            ax = axs[row][col]
+            operation = f"{method}_{buffer}"
+
+            for (name, by_size) in results.items():
+                xs = [size for size in sizes if operation in by_size.get(size, {})]
+                ax.plot(xs, [by_size[size][operation] for size in xs], marker="o", label=name)
+
+            ax.set_xscale("log", base=2)
+            ax.set_yscale("log")
+            ax.set_title(operation)
+
+            if col == 0:
+                ax.set_ylabel("Time per call ($\\mu$s)")
+            if row == 1:
+                ax.set_xlabel("Buffer size")
+
+    axs[0][-1].legend(loc="upper left", bbox_to_anchor=(1, 1))
+
+    fig.savefig(target, bbox_inches='tight')
+    plt.close(fig)
+
+    print("Produced:", target)
+
+def main(args):
+    escls = [cls for cls in all_eviction_strategies() if args.eviction_strategy is None or cls.short_name in args.eviction_strategy]
+
+    results = {
+        cls.short_name: {
+            size: benchmark(cls, size, args.fill, args.num_capabilities, args.seed, args.repeat)
+            for size in args.sizes
+        }
+        for cls in escls
+    }
+
+    print_table(results, args.sizes)
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.plot is not None:
+        plot(results, args.sizes, args.plot)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the choose and use methods of the eviction strategies')
+    parser.add_argument('--eviction-strategy', type=str, nargs='+', default=None,
+                        help='The eviction strategies to benchmark, defaults to all of them')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[4, 16, 64, 256],
+                        help='The buffer sizes to benchmark')
+    parser.add_argument('--fill', type=float, default=1.0,
+                        help='The fraction of each buffer that is occupied')
+    parser.add_argument('--num-capabilities', type=int, default=2,
+                        help='The number of capabilities that agents have')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='The seed used to generate the buffers')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='The number of times to repeat each timing, the best is reported')
+    parser.add_argument('--json', type=str, default=None,
+                        help='Save the results to this path')
+    parser.add_argument('--plot', type=str, default=None,
+                        help='Plot how the cost of each operation scales with the buffer size to this path')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Benchmarks run_simulation.main over a matrix of agent counts, buffer sizes,
+eviction strategies and agent choice behaviours, with fixed seeds and short
+durations, and compares the results against a baseline.
+
+Run from the root of the repository:
+
+    python -m benchmarks.scaling --save-baseline --repeat 5
+    python -m benchmarks.scaling
+
+Each case is run several times, each in a fresh process so that its peak RSS is not
+affected by the cases run before it, and the median of the runs is reported.
+
+Absolute events per second depend on the machine and on how busy it is, so they are
+compared as a throughput relative to a fixed calibration workload. The speed of the
+machine drifts while the benchmark runs, so the calibration is timed in its own fresh
+process immediately before and after each run of a case. The benchmark fails when the relative throughput of a
+case is lower, or its peak RSS is higher, than the baseline by more than the threshold.
+A case that appears to have regressed is run again as many times, and only fails if the
+median of all of its runs has also regressed.
+"""
+from __future__ import annotations
+
+import contextlib
+import fnmatch
+import io
+import json
+import math
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+SEED = 1
+
+# The duration of each agent count is chosen so that each case takes a few seconds.
+# Complete topologies are quadratic in the number of agents, so large numbers of agents use a sparse topology.
+# Agents start within the first quarter of the duration, so that they all take part.
+AGENTS = {
+    10: {"duration": 100, "topology": "complete"},
+    100: {"duration": 5, "topology": "complete"},
+    1000: {"duration": 4, "topology": "random"},
+    5000: {"duration": 1.6, "topology": "random"},
+}
+
+BUFFERS = {
+    "small": (4, 4, 4, 4),
+    "large": (40, 40, 40, 40),
+}
+
+ESs = ["LRU", "FIFO", "NotInOther", "Chen2016"]
+
+AGENT_CHOOSE = ["BRS", "Random"]
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+PHASES = ("setup", "simulate", "save")
+
+def case_name(num_agents: int, buffers: str, es: str, agent_choose: str) -> str:
+    return f"{num_agents}/{buffers}/{es}/{agent_choose}"
+
+def cases(args):
+    for num_agents in args.agents:
+        for buffers in args.buffers:
+            for es in args.eviction_strategy:
+                for agent_choose in args.agent_choose:
+                    name = case_name(num_agents, buffers, es, agent_choose)
+                    if args.filter is None or fnmatch.fnmatch(name, args.filter):
+                        yield (name, num_agents, buffers, es, agent_choose)
+
+def case_argv(num_agents: int, buffers: str, es: str, agent_choose: str, path_prefix: str) -> list:
+    num_bad_agents = num_agents // 5
+    (crypto, trust, reputation, stereotype) = BUFFERS[buffers]
+
+    return [
+        "--agents", str(num_agents - num_bad_agents), "GoodBehaviour", "--agents", str(num_bad_agents), "AlwaysBadBehaviour",
+        "--num-capabilities", "2", "--duration", str(AGENTS[num_agents]["duration"]),
+        "--max-start-delay", str(AGENTS[num_agents]["duration"] / 4),
+        "--topology", AGENTS[num_agents]["topology"],
+        "--max-crypto-buf", str(crypto), "--max-trust-buf", str(trust),
+        "--max-reputation-buf", str(reputation), "--max-stereotype-buf", str(stereotype),
+        "--eviction-strategy", es, "--agent-choose", agent_choose, "--utility-targets", "good",
+        "--seed", str(SEED), "--path-prefix", path_prefix, "--log-level", "0",
+    ]
+
+def run_case(case) -> dict:
+    (name, num_agents, buffers, es, agent_choose) = case
+
+    import run_simulation
+
+    timings = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        args = run_simulation.argument_parser().parse_args(case_argv(num_agents, buffers, es, agent_choose, f"{directory}/"))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_simulation.main(args, timings)
+
+    return {
+        "events": timings["events"],
+        "events_per_second": timings["events"] / timings["simulate"],
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "phases": {phase: timings[phase] for phase in PHASES},
+    }
+
+def calibrate(iterations: int=200000) -> float:
+    """
+    Operations per second of a fixed pure Python workload of the same kinds of
+    operations as the simulator: a priority queue, dictionaries and random numbers.
+    It does not use the simulator, so changes to the simulator do not change it.
+    """
+    import heapq
+
+    rng = random.Random(SEED)
+    queue = []
+    counts = {}
+
+    start = time.perf_counter()
+
+    for n in range(iterations):
+        heapq.heappush(queue, (rng.random(), n))
+        if len(queue) > 100:
+            (t, m) = heapq.heappop(queue)
+            key = m % 1000
+            counts[key] = counts.get(key, 0) + 1
+
+    return iterations / (time.perf_counter() - start)
+
+def run_in_process(ctx, function, *args):
+    # A fresh interpreter for every run
+    with ctx.Pool(1) as pool:
+        return pool.apply(function, args)
+
+def run_repeated(ctx, case, repeat: int) -> list:
+    # Each run is compared to the calibrations either side of it, the one after a run is also the one before the next
+    calibrations = [run_in_process(ctx, calibrate)]
+    results = []
+
+    for _ in range(repeat):
+        result = run_in_process(ctx, run_case, case)
+        calibrations.append(run_in_process(ctx, calibrate))
+
+        result["relative_throughput"] = result["events_per_second"] / math.sqrt(calibrations[-2] * calibrations[-1])
+        results.append(result)
+
+    return results
+
+def median_result(results: list) -> dict:
+    """The median of each measurement of the repeated runs of a case"""
+    events = {result["events"] for result in results}
+    if len(events) != 1:
+        raise RuntimeError(f"The runs of a case processed different numbers of events {events}")
+
+    return {
+        "events": results[0]["events"],
+        "events_per_second": statistics.median(result["events_per_second"] for result in results),
+        "relative_throughput": statistics.median(result["relative_throughput"] for result in results),
+        "peak_rss_kb": statistics.median(result["peak_rss_kb"] for result in results),
+        "phases": {phase: statistics.median(result["phases"][phase] for result in results) for phase in PHASES},
+    }
+
+def regressions(name: str, result: dict, baseline: dict, threshold: float) -> list:
+    if name not in baseline:
+        return []
+
+    base = baseline[name]
+    problems = []
+
+    if result["events"] != base["events"]:
+        problems.append(f"processed {result['events']} events rather than {base['events']}")
+
+    if result["relative_throughput"] < base["relative_throughput"] * (1 - threshold):
+        problems.append(f"{result['relative_throughput']:.4f} events per calibration operation is slower than {base['relative_throughput']:.4f}")
+
+    if result["peak_rss_kb"] > base["peak_rss_kb"] * (1 + threshold):
+        problems.append(f"{result['peak_rss_kb']} KB peak RSS is larger than {base['peak_rss_kb']}")
+
+    return problems
+
+def main(args) -> int:
+    try:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["cases"]
+    except FileNotFoundError:
+        baseline = {}
+
+    ctx = multiprocessing.get_context("spawn")
+
+    results = {}
+    failures = {}
+
+    print(f"{'Case':<32} {'Events':>8} {'Events/s':>10} {'Change':>8} {'RSS MB':>8} {'Setup':>7} {'Sim':>7} {'Save':>7}")
+
+    for case in cases(args):
+        name = case[0]
+
+        runs = run_repeated(ctx, case, args.repeat)
+        result = median_result(runs)
+
+        # Confirm a regression with more runs, so that a burst of load on the machine does not fail the case
+        if not args.save_baseline and regressions(name, result, baseline, args.threshold):
+            runs.extend(run_repeated(ctx, case, args.repeat))
+            result = median_result(runs)
+
+        results[name] = result
+
+        # The change in relative throughput, which allows for the speed of this machine
+        change = ""
+        if name in baseline:
+            change = f"{result['relative_throughput'] / baseline[name]['relative_throughput'] - 1:+.1%}"
+
+        phases = result["phases"]
+        print(f"{name:<32} {result['events']:>8} {result['events_per_second']:>10.0f} {change:>8} {result['peak_rss_kb'] / 1024:>8.1f} "
+              f"{phases['setup']:>7.2f} {phases['simulate']:>7.2f} {phases['save']:>7.2f}", flush=True)
+
+        problems = regressions(name, result, baseline, args.threshold)
+        if problems:
+            failures[name] = problems
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump({"cases": baseline}, f, indent=4, sort_keys=True)
+        print(f"Saved baseline of {len(results)} cases to {args.baseline}")
+        return 0
+
+    missing = [name for name in results if name not in baseline]
+    if missing:
+        print(f"{len(missing)} cases are not in the baseline {args.baseline}")
+
+    for (name, problems) in failures.items():
+        for problem in problems:
+            print(f"Regression in {name}: {problem}")
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark how the simulator scales')
+    parser.add_argument('--agents', type=int, nargs='+', default=list(AGENTS), choices=list(AGENTS),
+                        help='The numbers of agents to benchmark')
+    parser.add_argument('--buffers', type=str, nargs='+', default=list(BUFFERS), choices=list(BUFFERS),
+                        help='The buffer sizes to benchmark')
+    parser.add_argument('--eviction-strategy', type=str, nargs='+', default=ESs,
+                        help='The eviction strategies to benchmark')
+    parser.add_argument('--agent-choose', type=str, nargs='+', default=AGENT_CHOOSE,
+                        help='The agent choice behaviours to benchmark')
+    parser.add_argument('--filter', type=str, default=None,
+                        help='Only run the cases whose name matches this glob, names are agents/buffers/strategy/choose')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE,
+                        help='The baseline to compare against')
+    parser.add_argument('--save-baseline', action='store_true', default=False,
+                        help='Save the results as the baseline rather than comparing against it')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The number of times to run each case, the median of the runs is reported')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='The relative slowdown or increase in peak RSS that counts as a regression')
+
+    args = parser.parse_args()
+
+    sys.exit(main(args))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Measures how long it takes to start run_simulation.py, which adds up when
+running thousands of short simulations.
+
+Run from the root of the repository:
+
+    python -m benchmarks.startup
+
+Parsing the arguments, including listing the eviction strategies and behaviours,
+should not import numpy, hmmlearn or frozenlist. The benchmark fails when they are
+imported, or when starting takes longer than the target.
+
+It also fails when the registries that list the eviction strategies, behaviours
+and topologies without importing them differ from the classes that exist.
+"""
+from __future__ import annotations
+
+import statistics
+import subprocess
+import sys
+import time
+
+from simulation import registry
+
+HEAVY_MODULES = ("numpy", "hmmlearn", "sklearn", "scipy", "frozenlist")
+
+# Parse the arguments as run_simulation.py would and report which heavy modules were imported
+PARSE = f"""
+import sys
+import run_simulation
+run_simulation.argument_parser().parse_args(["--agents", "1", "GoodBehaviour", "--duration", "1",
+    "--max-crypto-buf", "1", "--max-trust-buf", "1", "--max-reputation-buf", "1", "--max-stereotype-buf", "1",
+    "--eviction-strategy", "LRU", "--agent-choose", "BRS", "--utility-targets", "good"])
+print(" ".join(sorted({{name.split(".")[0] for name in sys.modules}} & set({HEAVY_MODULES!r}))))
+"""
+
+COMMANDS = {
+    "python": [sys.executable, "-c", "pass"],
+    "parse arguments": [sys.executable, "-c", PARSE],
+    "run_simulation.py --help": [sys.executable, "run_simulation.py", "--help"],
+    "import simulation": [sys.executable, "-c", "import simulation.simulator, simulation.eviction_strategy, simulation.capability_behaviour"],
+}
+
+def measure(command: list, repeat: int) -> tuple:
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(command, check=True, capture_output=True, universal_newlines=True)
+        timings.append(time.perf_counter() - start)
+
+    return (statistics.median(timings), result.stdout)
+
+def main(args) -> int:
+    failed = False
+
+    print(f"{'Command':<28} {'Median (ms)':>12}")
+
+    for (name, command) in COMMANDS.items():
+        (median, stdout) = measure(command, args.repeat)
+        print(f"{name:<28} {1000 * median:>12.1f}")
+
+        if name == "parse arguments":
+            heavy = stdout.split()
+            if heavy:
+                print(f"Parsing the arguments imported {', '.join(heavy)}")
+                failed = True
+
+            if median > args.target:
+                print(f"Parsing the arguments took longer than the target of {1000 * args.target:.0f} ms")
+                failed = True
+
+    try:
+        registry.verify()
+    except RuntimeError as ex:
+        print(ex)
+        failed = True
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Measure how long run_simulation.py takes to start')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='The number of times to run each command')
+    parser.add_argument('--target', type=float, default=0.1,
+                        help='The most time in seconds that parsing the arguments should take')
+
+    args = parser.parse_args()
+
+    sys.exit(main(args))
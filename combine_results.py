@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
+import argparse
 import os
 import bz2
 import fnmatch
@@ -11,6 +12,10 @@ import pickle
 import tqdm
 
 import numpy as np
+from scipy.stats import t as student_t
+
+from simulation.metrics import load_metrics, load_summary
+from simulation.summary_statistics import KLLSketch, RunningMoments
 
 class ParametersDifferError(RuntimeError):
     def __init__(self, self_args, m_args):
@@ -21,64 +26,248 @@ class ParametersDifferError(RuntimeError):
         super().__init__(f"Parameters differ m_args={self.params_diff_m_args}, self_args={self.params_diff_self_args}")
 
 class CombinedMetrics:
-    def __init__(self):
-        self.normed_utilities = []
+    def __init__(self, keep_raw: bool=False):
+        # Every normalised utility is only kept when requested, as this
+        # grows with the number of seeds and interactions
+        self.normed_utilities = [] if keep_raw else None
+
+        self.utility_moments = RunningMoments()
+
+        # A fixed seed, along with adding the seeds in order, means that
+        # combining the same metrics always gives the same result
+        self.utility_sketch = KLLSketch(seed=0)
+
+        # Seeds are the independent replications, so confidence intervals
+        # are calculated from the mean normalised utility of each seed
+        self.seed_moments = RunningMoments()
+
         self.args = None
 
-    def update(self, m: Metrics):
+        # The seeds of the metrics that have been folded into this result,
+        # so that later runs only need to process new seeds
+        self.seeds = set()
+
+    def update(self, summary: MetricsSummary, m: Metrics=None):
+        """Add the summary of a seed, the seed's metrics are only needed when keeping raw utilities"""
         if self.args is None:
-            self.args = m.args
+            self.args = summary.args
             self.args.seed = None
         else:
-            m.args.seed = None
-            if self.args != m.args:
-                raise ParametersDifferError(self.args, m.args)
+            summary.args.seed = None
+            if self.args != summary.args:
+                raise ParametersDifferError(self.args, summary.args)
+
+        self.utility_moments.merge(summary.utility_moments)
+        self.utility_sketch.merge(summary.utility_sketch)
+
+        if summary.utility_moments.count > 0:
+            self.seed_moments.add(summary.utility_moments.mean)
 
-        self.normed_utilities.extend([b.utility / b.max_utility for b in m.buffers if not np.isnan(b.utility)])
+        if self.normed_utilities is not None:
+            if m is None:
+                raise ValueError("The metrics are needed to keep raw utilities")
+
+            self.normed_utilities.extend(b.utility / b.max_utility for b in m.buffers if not np.isnan(b.utility))
 
     def finish(self):
         pass
 
+    def keeps_raw(self) -> bool:
+        return self.normed_utilities is not None
+
+    def quantiles(self, qs) -> np.ndarray:
+        result = self.utility_sketch.quantiles(qs)
+
+        # The extremes are known exactly
+        qs = np.asarray(qs)
+        result[qs <= 0] = self.utility_moments.min
+        result[qs >= 1] = self.utility_moments.max
+
+        return result
+
+    def median(self) -> float:
+        return float(self.quantiles([0.5])[0])
+
+    def mean(self) -> float:
+        return self.utility_moments.mean
+
+    def confidence_interval(self, confidence: float=0.95) -> tuple:
+        return confidence_interval(self.seed_moments, confidence)
+
+    def box_plot_stats(self, label: str=None, whis: float=1.5) -> dict:
+        """
+        The statistics that matplotlib's boxplot would calculate from normed_utilities,
+        in the form accepted by Axes.bxp
+        """
+        (q1, med, q3) = self.quantiles([0.25, 0.5, 0.75])
+        iqr = q3 - q1
+
+        # Whiskers extend to the most extreme value within whis * IQR of the box
+        (items, _) = self.utility_sketch.weighted_items()
+        items = np.concatenate((items, [self.utility_moments.min, self.utility_moments.max]))
+
+        lower = items[items >= q1 - whis * iqr]
+        upper = items[items <= q3 + whis * iqr]
+
+        return {
+            "label": label,
+            "mean": self.mean(),
+            "med": med,
+            "q1": q1,
+            "q3": q3,
+            "iqr": iqr,
+            "whislo": lower.min() if len(lower) else q1,
+            "whishi": upper.max() if len(upper) else q3,
+            "fliers": [],
+        }
+
     def num_agents(self) -> int:
         return sum(num_agents for (num_agents, behaviour) in self.args.agents)
 
     def num_capabilities(self) -> int:
         return self.args.num_capabilities
 
-def fn(args):
-    (metrics_dir, prefix, files) = args
+    def summary(self) -> CombinedSummary:
+        return CombinedSummary(
+            self.args,
+            len(self.seeds),
+            {k: v for (k, v) in self.box_plot_stats().items() if k != "label"},
+            self.quantiles(CombinedSummary.levels),
+            self.seed_moments,
+        )
 
-    print(f"Processing {metrics_dir} {prefix} {len(files)} files...")
+def confidence_interval(seed_moments: RunningMoments, confidence: float=0.95) -> tuple:
+    """Student's t confidence interval of the mean normalised utility across seeds"""
+    if seed_moments.count < 2:
+        return (float("NaN"), float("NaN"))
 
-    m = CombinedMetrics()
+    half_width = student_t.ppf((1 + confidence) / 2, seed_moments.count - 1) * seed_moments.std() / np.sqrt(seed_moments.count)
 
-    for file in files:
-        path = os.path.join(metrics_dir, file)
-        with bz2.open(path, "rb") as f:
-            try:
-                m.update(pickle.load(f))
-            except EOFError as ex:
-                # Corrupted pickle
-                print(f"{ex} for {path}")
-                print("Skipping...")
-                continue
-            except ParametersDifferError as ex:
-                print(f"{ex} for {path}")
-                raise
+    return (seed_moments.mean - half_width, seed_moments.mean + half_width)
+
+@dataclass
+class CombinedSummary:
+    """
+    The small subset of CombinedMetrics that is needed to graph it
+    """
+    levels = np.linspace(0, 1, 101)
+
+    args: argparse.Namespace
+    num_seeds: int
+    stats: dict
+    percentiles: np.ndarray
+    seed_moments: RunningMoments = None
+
+    def quantiles(self, qs) -> np.ndarray:
+        return np.interp(qs, self.levels, self.percentiles)
+
+    def median(self) -> float:
+        return self.stats["med"]
+
+    def mean(self) -> float:
+        return self.stats["mean"]
+
+    def box_plot_stats(self, label: str=None) -> dict:
+        return {**self.stats, "label": label}
 
+    def confidence_interval(self, confidence: float=0.95) -> tuple:
+        if self.seed_moments is None:
+            return (float("NaN"), float("NaN"))
+        return confidence_interval(self.seed_moments, confidence)
+
+    def num_agents(self) -> int:
+        return sum(num_agents for (num_agents, behaviour) in self.args.agents)
+
+    def num_capabilities(self) -> int:
+        return self.args.num_capabilities
+
+def file_seed(file: str) -> int:
+    # Files are named <prefix>-metrics.<seed>.pickle.bz2
+    return int(file.split(".")[1])
+
+def combined_file(file: str) -> str:
     # Replace the seed number with combined
-    target_file = list(files[0].split("."))
+    target_file = list(file.split("."))
     target_file[1] = "combined"
-    target_file = ".".join(target_file)
+    return ".".join(target_file)
+
+def load_existing(target_path: str, keep_raw: bool):
+    try:
+        with bz2.open(target_path, "rb") as f:
+            m = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except EOFError as ex:
+        print(f"{ex} for {target_path}")
+        print("Rebuilding...")
+        return None
+
+    # Results combined before seeds and sketches were recorded cannot be extended
+    if not hasattr(m, "seeds") or not hasattr(m, "utility_sketch") or not hasattr(m, "seed_moments"):
+        print(f"{target_path} is in an old format, rebuilding...")
+        return None
+
+    if keep_raw and not m.keeps_raw():
+        print(f"{target_path} does not keep raw utilities, rebuilding...")
+        return None
+
+    return m
+
+def combine(metrics_dir: str, prefix: str, files: list, rebuild: bool=False, keep_raw: bool=False) -> CombinedMetrics:
+    """Combine the metrics files into the combined result for prefix, returning the combined result"""
+    target_path = os.path.join(metrics_dir, combined_file(files[0]))
+
+    m = None if rebuild else load_existing(target_path, keep_raw)
+
+    if m is None:
+        m = CombinedMetrics(keep_raw)
+    else:
+        files = [file for file in files if file_seed(file) not in m.seeds]
+
+        if not files:
+            print(f"{target_path} is up to date with {len(m.seeds)} seeds")
+            return m
+
+    print(f"Processing {metrics_dir} {prefix} {len(files)} files...")
+
+    for file in sorted(files, key=file_seed):
+        path = os.path.join(metrics_dir, file)
+        try:
+            if m.keeps_raw():
+                metrics = load_metrics(path)
+                m.update(metrics.summary if hasattr(metrics, "summary") else load_summary(path), metrics)
+            else:
+                m.update(load_summary(path))
+            m.seeds.add(file_seed(file))
+        except EOFError as ex:
+            # Corrupted pickle
+            print(f"{ex} for {path}")
+            print("Skipping...")
+            continue
+        except ParametersDifferError as ex:
+            print(f"{ex} for {path}")
+            raise
 
-    target_path = os.path.join(metrics_dir, target_file)
     print(f"Saving result to {target_path}")
 
     m.finish()
 
-    with bz2.open(target_path, "wb") as f:
+    # Write to a temporary file first, so an interrupted run does not
+    # lose the seeds that were previously combined
+    tmp_path = target_path + ".tmp"
+
+    with bz2.open(tmp_path, "wb") as f:
         pickle.dump(m, f)
 
+    os.replace(tmp_path, target_path)
+
+    return m
+
+def fn(args):
+    (metrics_dir, prefix, files, rebuild, keep_raw) = args
+
+    combine(metrics_dir, prefix, files, rebuild, keep_raw)
+
 def main(args):
     metrics_paths = {
         metrics_dir: [
@@ -103,8 +292,8 @@ def main(args):
 
             new_metrics_paths[metrics_dir][prefix] = selected_files
 
-    args = [
-        (metrics_dir, prefix, files)
+    fn_args = [
+        (metrics_dir, prefix, files, args.rebuild, args.keep_raw)
 
         for (metrics_dir, prefix_files) in new_metrics_paths.items()
         for (prefix, files) in prefix_files.items()
@@ -118,16 +307,19 @@ def main(args):
     print(f"Running with {usable_cpus} processes")
 
     with multiprocessing.Pool(usable_cpus) as pool:
-        for _ in tqdm.tqdm(pool.imap_unordered(fn, args), total=len(args)):
+        for _ in tqdm.tqdm(pool.imap_unordered(fn, fn_args), total=len(fn_args)):
             pass
 
 if __name__ == "__main__":
-    import argparse
-
     parser = argparse.ArgumentParser(description='Analyse')
     parser.add_argument('metrics_dirs', type=str, nargs="+",
                         help='The path to the directory of metrics to analyse')
 
+    parser.add_argument('--rebuild', action="store_true", default=False,
+                        help='Recombine all seeds instead of only adding new seeds to existing results')
+    parser.add_argument('--keep-raw', action="store_true", default=False,
+                        help='Also keep every normalised utility, rather than just their summary')
+
     args = parser.parse_args()
 
     main(args)
@@ -1,19 +1,19 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
-import pickle
 import subprocess
 import multiprocessing
 import functools
 from pprint import pprint
 import math
-import bz2
 import tqdm
 import os
+import hashlib
+import shutil
 
 from utils.graphing import savefig
 from simulation.capability_behaviour import InteractionObservation
-from simulation.metrics import Metrics
+from simulation.metrics import Metrics, load_metrics
 
 from pygraphviz import *
 
@@ -38,7 +38,7 @@ buffer_colours = {
     "stereotype": "#BCBD22", #"darkslategray2",
 }
 
-def graph_buffer_direct(metrics: Metrics, path_prefix: str, n: int, total_n: int, tb):
+def graph_buffer_direct(metrics: Metrics, output_file: str, tb):
     p = AGraph(
         label=f"({tb.source} {tb.capability}) generating task, utility={tb.utility}",
         margin="0",
@@ -171,10 +171,6 @@ def graph_buffer_direct(metrics: Metrics, path_prefix: str, n: int, total_n: int
                     if itema == itemb:
                         sp.add_edge(f"{name} {a}", f"{nameb} {b}", color=edge_colour(itema), penwidth=2) # label=f"{itema[0]} {itema[1]}", 
 
-    pad = math.ceil(math.log10(total_n))
-
-    output_file = f'{path_prefix}Topology-{str(n).zfill(pad)}-{tb.t}.pdf'
-
     p.layout("neato")
     #p.layout("dot")
     p.draw(output_file)
@@ -280,25 +276,83 @@ def graph_legend(metrics: Metrics, path_prefix: str):
 
     check_fonts(output_file)
 
-def call(fn):
-    fn()
+def buffer_state_key(tb) -> str:
+    # Everything that graph_buffer_direct draws, which excludes the time
+    state = (
+        tb.source,
+        tb.capability,
+        tb.utility,
+        sorted((agent, outcome.name) for (agent, outcome) in tb.outcomes.items()),
+        tb.buffers,
+    )
 
-def main(args):
-    with bz2.open(args.metrics_path, "rb") as f:
-        metrics = pickle.load(f)
+    return hashlib.sha1(repr(state).encode("utf-8")).hexdigest()
+
+def graph_buffer_state(task):
+    (n, output_files, existing_file) = task
+
+    # Only render this state when there is no up to date copy of it already
+    if existing_file is None:
+        existing_file = output_files[0]
+        output_files = output_files[1:]
+
+        graph_buffer_direct(_shared["metrics"], existing_file, _shared["metrics"].buffers[n])
+
+    for output_file in output_files:
+        shutil.copyfile(existing_file, output_file)
+
+def buffer_state_tasks(metrics: Metrics, metrics_mtime: float, path_prefix: str, specific, force: bool) -> list:
+    pad = math.ceil(math.log10(len(metrics.buffers)))
+
+    # Group the evaluations that would produce identical graphs
+    states = {}
+
+    for (n, tb) in enumerate(metrics.buffers):
+        if specific is not None and n not in specific:
+            continue
+
+        output_file = f'{path_prefix}Topology-{str(n).zfill(pad)}-{tb.t}.pdf'
 
-    fns = [
-        functools.partial(graph_buffer_direct, metrics, args.path_prefix, n, len(metrics.buffers), b)
-        for (n, b) in enumerate(metrics.buffers)
-        if args.specific is None or n in args.specific
+        up_to_date = not force and os.path.exists(output_file) and os.path.getmtime(output_file) >= metrics_mtime
+
+        state = states.setdefault(buffer_state_key(tb), {"n": n, "output_files": [], "existing_file": None})
+
+        if up_to_date:
+            state["existing_file"] = output_file
+        else:
+            state["output_files"].append(output_file)
+
+    return [
+        (state["n"], state["output_files"], state["existing_file"])
+        for state in states.values()
+        if state["output_files"]
     ]
 
+# Set before the worker pool is forked so that the workers inherit it,
+# instead of the metrics being pickled and sent to every worker
+_shared = {}
+
+def main(args):
+    metrics = load_metrics(args.metrics_path)
+
+    _shared["metrics"] = metrics
+
+    tasks = buffer_state_tasks(metrics, os.path.getmtime(args.metrics_path), args.path_prefix, args.specific, args.force)
+
+    total_outputs = sum(len(output_files) for (n, output_files, existing_file) in tasks)
+    to_render = sum(1 for (n, output_files, existing_file) in tasks if existing_file is None)
+
+    print(f"Rendering {to_render} unique buffer states for {total_outputs} out of date graphs")
+
     usable_cpus = len(os.sched_getaffinity(0))
 
     print(f"Running with {usable_cpus} processes")
 
-    with multiprocessing.Pool(usable_cpus) as pool:
-        for _ in tqdm.tqdm(pool.imap_unordered(call, fns), total=len(fns)):
+    # Amortise the cost of sending tasks to workers over several states
+    chunksize = max(1, len(tasks) // (usable_cpus * 4))
+
+    with multiprocessing.get_context("fork").Pool(usable_cpus) as pool:
+        for _ in tqdm.tqdm(pool.imap_unordered(graph_buffer_state, tasks, chunksize=chunksize), total=len(tasks)):
             pass
 
     if args.make_legend:
@@ -320,6 +374,9 @@ if __name__ == "__main__":
     parser.add_argument('--make-legend', action="store_true", default=False,
                         help='Create a legend')
 
+    parser.add_argument('--force', action="store_true", default=False,
+                        help='Recreate graphs even if they are already up to date')
+
     args = parser.parse_args()
     args.specific = None if args.specific is None else set(args.specific)
 
@@ -2,14 +2,13 @@
 from __future__ import annotations
 
 import os
-import pickle
 import subprocess
 import itertools
-from itertools import chain
 import multiprocessing
 import functools
 from pprint import pprint
-import bz2
+from collections import defaultdict
+from dataclasses import dataclass
 
 import numpy as np
 
@@ -21,31 +20,49 @@ import matplotlib.ticker as ticker
 import seaborn
 
 from utils.graphing import savefig
-from simulation.metrics import Metrics
+from simulation.metrics import Metrics, load_metrics
 from simulation.capability_behaviour import CapabilityBehaviourState, InteractionObservation
 
 plt.rcParams['text.usetex'] = True
 plt.rcParams['font.size'] = 12
 
-def graph_utility(metrics: Metrics, path_prefix: str):
-    fig = plt.figure()
-    ax = fig.gca()
+@dataclass
+class UtilitySeries:
+    t: np.ndarray
+    utility: np.ndarray
+    max_utility: np.ndarray
 
-    sources_utilities = {(b.source, b.capability) for b in metrics.buffers}
+    def normed_utility(self) -> np.ndarray:
+        return self.utility / self.max_utility
 
-    grouped_utility = {
-        (asrc, acap): [
-            (b.t, b.utility)
+class UtilityIndex:
+    """
+    The buffer evaluations of each (source, capability) grouped in a single pass
+    """
+    def __init__(self, metrics: Metrics):
+        grouped = defaultdict(list)
 
-            for b in metrics.buffers
-            if asrc == b.source and acap == b.capability
-        ]
-        for (asrc, acap) in sources_utilities
-    }
+        for b in metrics.buffers:
+            grouped[(b.source, b.capability)].append((b.t, b.utility, b.max_utility))
 
-    for ((src, cap), utilities) in sorted(grouped_utility.items(), key=lambda x: x[0]):
-        X, Y = zip(*utilities)
-        ax.plot(X, Y, label=f"{src} {cap}")
+        self.series = {
+            key: UtilitySeries(*np.array(rows, dtype=np.float64).T)
+            for (key, rows) in sorted(grouped.items(), key=lambda x: x[0])
+        }
+
+    def items(self):
+        return self.series.items()
+
+# Set before the worker pool is forked so that the workers inherit them,
+# instead of the metrics being pickled and sent to every worker
+_shared = {}
+
+def graph_utility(metrics: Metrics, index: UtilityIndex, path_prefix: str):
+    fig = plt.figure()
+    ax = fig.gca()
+
+    for ((src, cap), series) in index.items():
+        ax.plot(series.t, series.utility, label=f"{src} {cap}")
 
     ax.set_ylim(0, 1)
 
@@ -58,25 +75,12 @@ def graph_utility(metrics: Metrics, path_prefix: str):
 
     plt.close(fig)
 
-def graph_max_utility(metrics: Metrics, path_prefix: str):
+def graph_max_utility(metrics: Metrics, index: UtilityIndex, path_prefix: str):
     fig = plt.figure()
     ax = fig.gca()
 
-    sources_utilities = {(b.source, b.capability) for b in metrics.buffers}
-
-    grouped_utility = {
-        (asrc, acap): [
-            (b.t, b.max_utility)
-
-            for b in metrics.buffers
-            if asrc == b.source and acap == b.capability
-        ]
-        for (asrc, acap) in sources_utilities
-    }
-
-    for ((src, cap), utilities) in sorted(grouped_utility.items(), key=lambda x: x[0]):
-        X, Y = zip(*utilities)
-        ax.plot(X, Y, label=f"{src} {cap}")
+    for ((src, cap), series) in index.items():
+        ax.plot(series.t, series.max_utility, label=f"{src} {cap}")
 
     ax.set_ylim(0, 1)
 
@@ -89,25 +93,12 @@ def graph_max_utility(metrics: Metrics, path_prefix: str):
 
     plt.close(fig)
 
-def graph_utility_scaled(metrics: Metrics, path_prefix: str):
+def graph_utility_scaled(metrics: Metrics, index: UtilityIndex, path_prefix: str):
     fig = plt.figure()
     ax = fig.gca()
 
-    sources_utilities = {(b.source, b.capability) for b in metrics.buffers}
-
-    grouped_utility = {
-        (asrc, acap): [
-            (b.t, b.utility / b.max_utility)
-
-            for b in metrics.buffers
-            if asrc == b.source and acap == b.capability
-        ]
-        for (asrc, acap) in sources_utilities
-    }
-
-    for ((src, cap), utilities) in sorted(grouped_utility.items(), key=lambda x: x[0]):
-        X, Y = zip(*utilities)
-        ax.plot(X, Y, label=f"{src} {cap}")
+    for ((src, cap), series) in index.items():
+        ax.plot(series.t, series.normed_utility(), label=f"{src} {cap}")
 
     ax.set_ylim(0, 1)
 
@@ -121,31 +112,18 @@ def graph_utility_scaled(metrics: Metrics, path_prefix: str):
 
     plt.close(fig)
 
-def graph_utility_scaled_cap_colour(metrics: Metrics, path_prefix: str):
+def graph_utility_scaled_cap_colour(metrics: Metrics, index: UtilityIndex, path_prefix: str):
     fig = plt.figure()
     ax = fig.gca()
 
-    sources_utilities = {(b.source, b.capability) for b in metrics.buffers}
-
-    grouped_utility = {
-        (asrc, acap): [
-            (b.t, b.utility / b.max_utility)
-
-            for b in metrics.buffers
-            if asrc == b.source and acap == b.capability
-        ]
-        for (asrc, acap) in sources_utilities
-    }
-
     sequential_cmaps = [seaborn.mpl_palette(name, n_colors=len(metrics.agent_names)) for name in ("Greens", "Purples")]
     cmap_for_cap = {
         c: sequential_cmaps[c]
         for c in {int(c[1:]) for c in metrics.capability_names}
     }
 
-    for ((src, cap), utilities) in sorted(grouped_utility.items(), key=lambda x: x[0]):
-        X, Y = zip(*utilities)
-        ax.plot(X, Y, label=f"{src} {cap}", color=cmap_for_cap[int(cap[1:])][metrics.agent_names.index(src)])
+    for ((src, cap), series) in index.items():
+        ax.plot(series.t, series.normed_utility(), label=f"{src} {cap}", color=cmap_for_cap[int(cap[1:])][metrics.agent_names.index(src)])
 
     ax.set_ylim(0, 1)
 
@@ -159,25 +137,12 @@ def graph_utility_scaled_cap_colour(metrics: Metrics, path_prefix: str):
 
     plt.close(fig)
 
-def graph_utility_max_distance(metrics: Metrics, path_prefix: str):
+def graph_utility_max_distance(metrics: Metrics, index: UtilityIndex, path_prefix: str):
     fig = plt.figure()
     ax = fig.gca()
 
-    sources_utilities = {(b.source, b.capability) for b in metrics.buffers}
-
-    grouped_utility = {
-        (asrc, acap): [
-            (b.t, b.max_utility - b.utility)
-
-            for b in metrics.buffers
-            if asrc == b.source and acap == b.capability
-        ]
-        for (asrc, acap) in sources_utilities
-    }
-
-    for ((src, cap), utilities) in sorted(grouped_utility.items(), key=lambda x: x[0]):
-        X, Y = zip(*utilities)
-        ax.plot(X, Y, label=f"{src} {cap}")
+    for ((src, cap), series) in index.items():
+        ax.plot(series.t, series.max_utility - series.utility, label=f"{src} {cap}")
 
     ax.set_ylim(0, 1)
 
@@ -190,7 +155,7 @@ def graph_utility_max_distance(metrics: Metrics, path_prefix: str):
 
     plt.close(fig)
 
-def graph_behaviour_state(metrics: Metrics, path_prefix: str):
+def graph_behaviour_state(metrics: Metrics, index: UtilityIndex, path_prefix: str):
     agents, capabilities = zip(*metrics.behaviour_changes.keys())
     agents = list(sorted(set(agents)))
     capabilities = list(sorted(set(capabilities)))
@@ -230,7 +195,7 @@ def graph_behaviour_state(metrics: Metrics, path_prefix: str):
 
     plt.close(fig)
 
-def graph_interactions(metrics: Metrics, path_prefix: str):
+def graph_interactions(metrics: Metrics, index: UtilityIndex, path_prefix: str):
     keys = {(b.target, b.capability) for b in metrics.buffers}
 
     all_interactions = {
@@ -281,7 +246,7 @@ def graph_interactions(metrics: Metrics, path_prefix: str):
 
     plt.close(fig)
 
-def graph_interactions_utility_hist(metrics: Metrics, path_prefix: str):
+def graph_interactions_utility_hist(metrics: Metrics, index: UtilityIndex, path_prefix: str):
 
     correct = [
         b.utility
@@ -324,7 +289,7 @@ def graph_interactions_utility_hist(metrics: Metrics, path_prefix: str):
 
     plt.close(fig)
 
-def graph_evictions(metrics: Metrics, path_prefix: str):
+def graph_evictions(metrics: Metrics, index: UtilityIndex, path_prefix: str):
     columns = ["crypto", "trust", "reputation", "stereotype"]
     column_to_data = {
         "crypto": metrics.evicted_crypto,
@@ -333,23 +298,28 @@ def graph_evictions(metrics: Metrics, path_prefix: str):
         "stereotype": metrics.evicted_stereotype
     }
 
-    agents = set(chain.from_iterable(
-        {a for (t, a, i) in data}
-        for data in column_to_data.values()
-    ))
-    agents = list(sorted(agents))
+    agent_ids = np.unique(np.concatenate([data.column("agent") for data in column_to_data.values()]))
+    agents = [metrics.agent_names[agent_id] for agent_id in agent_ids]
 
-    def sanitise_i(column, i):
+    def sanitise_i(column, victim, capability):
         if column == "crypto" or column == "reputation":
-            return i[0]
+            return metrics.agent_names[victim]
         else:
-            return f"{i[0]}-{i[1]}"
+            return f"{metrics.agent_names[victim]}-{metrics.capability_names[capability]}"
+
+    def evictions_from(column, agent_id):
+        rows = column_to_data[column].array()
+        rows = rows[rows["agent"] == agent_id]
 
+        return list(sorted([
+            (t, sanitise_i(column, victim, capability))
+            for (t, victim, capability) in zip(rows["t"].tolist(), rows["victim"].tolist(), rows["capability"].tolist())
+        ], key=lambda x: x[1]))
 
     all_evictions = {
-        (agent, column): list(sorted([(t, sanitise_i(column, i)) for (t, a, i) in column_data if a == agent], key=lambda x: x[1]))
-        for agent in agents
-        for (column, column_data) in column_to_data.items()
+        (agent, column): evictions_from(column, agent_id)
+        for (agent_id, agent) in zip(agent_ids.tolist(), agents)
+        for column in column_to_data
     }
 
     fig, axs = plt.subplots(nrows=max(1, len(agents)), ncols=max(1, len(columns)), sharex=True, squeeze=False, figsize=(18,30))
@@ -381,12 +351,14 @@ def graph_evictions(metrics: Metrics, path_prefix: str):
 
     plt.close(fig)
 
-def graph_interactions_performed(metrics: Metrics, path_prefix: str):
+def graph_interactions_performed(metrics: Metrics, index: UtilityIndex, path_prefix: str):
+
+    rows = metrics.interaction_performed.array()
 
     all_interactions = {
-        (agent, capability): [t for (t, a, c) in metrics.interaction_performed if a == agent and c == capability]
-        for agent in metrics.agent_names
-        for capability in metrics.capability_names
+        (agent, capability): rows["t"][(rows["agent"] == agent_id) & (rows["capability"] == capability_id)].tolist()
+        for (agent_id, agent) in enumerate(metrics.agent_names)
+        for (capability_id, capability) in enumerate(metrics.capability_names)
     }
 
     fig, axs = plt.subplots(nrows=len(metrics.agent_names), ncols=len(metrics.capability_names), sharex=True, squeeze=False, figsize=(18,30))
@@ -419,21 +391,23 @@ def graph_interactions_performed(metrics: Metrics, path_prefix: str):
     plt.close(fig)
 
 def call(fn):
-    fn()
+    fn(_shared["metrics"], _shared["index"], _shared["path_prefix"])
 
 def main(args):
-    with bz2.open(args.metrics_path, "rb") as f:
-        metrics = pickle.load(f)
+    metrics = load_metrics(args.metrics_path)
+
+    _shared["metrics"] = metrics
+    _shared["index"] = UtilityIndex(metrics)
+    _shared["path_prefix"] = args.path_prefix
 
     fns = [graph_utility, graph_max_utility, graph_utility_scaled, graph_utility_scaled_cap_colour, graph_utility_max_distance,
            graph_behaviour_state, graph_interactions, graph_interactions_utility_hist,
            #graph_evictions,
            graph_interactions_performed]
-    fns = [functools.partial(fn, metrics, args.path_prefix) for fn in fns]
 
     usable_cpus = len(os.sched_getaffinity(0))
 
-    with multiprocessing.Pool(min(usable_cpus, len(fns))) as p:
+    with multiprocessing.get_context("fork").Pool(min(usable_cpus, len(fns))) as p:
         p.map(call, fns)
 
 if __name__ == "__main__":
@@ -9,7 +9,10 @@ import fnmatch
 from typing import Dict
 import gc
 from collections import defaultdict
+import hashlib
+import multiprocessing
 import pickle
+import tqdm
 
 import numpy as np
 from scipy.stats import describe
@@ -23,24 +26,24 @@ import matplotlib.ticker as ticker
 import seaborn
 
 from utils.graphing import savefig
-from combine_results import CombinedMetrics
+from combine_results import CombinedMetrics, CombinedSummary
 
 plt.rcParams['text.usetex'] = True
 plt.rcParams['font.size'] = 12
 
-def graph_utility_summary(all_metrics: Dict[str, CombinedMetrics], path_prefix: str):
+def graph_utility_summary(all_metrics: Dict[str, CombinedSummary], path_prefix: str):
 
-    all_utilities = {
-        path.split("-")[0]: metrics.normed_utilities
+    all_stats = {
+        path.split("-")[0]: metrics.box_plot_stats(path.split("-")[0])
         for (path, metrics) in all_metrics.items()
     }
 
-    labels, Xs = zip(*sorted(all_utilities.items(), key=lambda x: x[0]))
+    labels, stats = zip(*sorted(all_stats.items(), key=lambda x: x[0]))
 
     fig = plt.figure()
     ax = fig.gca()
 
-    ax.boxplot(Xs, labels=labels)
+    ax.bxp(stats, showmeans=False, showfliers=False)
 
     ax.set_ylim(0, 1)
     ax.set_ylabel('Utility (\\%)')
@@ -53,24 +56,23 @@ def graph_utility_summary(all_metrics: Dict[str, CombinedMetrics], path_prefix:
     plt.close(fig)
     gc.collect()
 
-# From: https://stackoverflow.com/a/61870668
-def get_box_plot_data(labels, bp):
+def get_box_plot_data(stats):
     rows_list = []
 
-    for i in range(len(labels)):
+    for stat in stats:
         dict1 = {}
-        dict1['label'] = labels[i]
-        dict1['lower_whisker'] = bp['whiskers'][i*2].get_ydata()[1]
-        dict1['lower_quartile'] = bp['boxes'][i].get_ydata()[1]
-        dict1['median'] = bp['medians'][i].get_ydata()[1]
-        dict1['upper_quartile'] = bp['boxes'][i].get_ydata()[2]
-        dict1['upper_whisker'] = bp['whiskers'][(i*2)+1].get_ydata()[1]
+        dict1['label'] = stat['label']
+        dict1['lower_whisker'] = stat['whislo']
+        dict1['lower_quartile'] = stat['q1']
+        dict1['median'] = stat['med']
+        dict1['upper_quartile'] = stat['q3']
+        dict1['upper_whisker'] = stat['whishi']
         dict1['iqr'] = dict1['upper_quartile'] - dict1['lower_quartile']
         rows_list.append(dict1)
 
     return pd.DataFrame(rows_list)
 
-def graph_utility_summary_grouped_es(all_metrics: Dict[str, CombinedMetrics], path_prefix: str):
+def graph_utility_summary_grouped_es(all_metrics: Dict[str, CombinedSummary], path_prefix: str):
 
     print(len(all_metrics))
 
@@ -86,32 +88,26 @@ def graph_utility_summary_grouped_es(all_metrics: Dict[str, CombinedMetrics], pa
     for behaviour, size in itertools.product(behaviours, sizes):
         print(behaviour, size)
 
-        all_utilities = {
-            path[1]: metrics.normed_utilities
+        all_stats = {
+            path[1]: metrics.box_plot_stats(path[1])
             for (path, metrics) in all_metrics.items()
             if path[0] == behaviour
             and path[-1] == size
         }
 
-        all_utilities_medians = {
-            k: np.median(v)
-            for (k, v) in all_utilities.items()
-        }
-
-        sorted_labels = list(sorted(all_utilities.keys()))
+        sorted_labels = list(sorted(all_stats.keys()))
 
-        labels, Xs = zip(*sorted(all_utilities.items(), key=lambda x: all_utilities_medians[x[0]], reverse=True))
+        labels, stats = zip(*sorted(all_stats.items(), key=lambda x: x[1]["med"], reverse=True))
 
         fig = plt.figure()
         ax = fig.gca()
 
-        bp = ax.boxplot(Xs,
-                        labels=labels,
-                        showmeans=True,
-                        showfliers=False,
-                        patch_artist=color,
-                        medianprops={"color": "dimgray"},
-                        meanprops={"marker":".", "markerfacecolor":"grey", "markeredgecolor":"grey"})
+        bp = ax.bxp(stats,
+                    showmeans=True,
+                    showfliers=False,
+                    patch_artist=color,
+                    medianprops={"color": "dimgray"},
+                    meanprops={"marker":".", "markerfacecolor":"grey", "markeredgecolor":"grey"})
 
         if color:
             cmap = seaborn.color_palette("husl", n_colors=len(bp['boxes']))
@@ -132,7 +128,7 @@ def graph_utility_summary_grouped_es(all_metrics: Dict[str, CombinedMetrics], pa
         if not color:
             with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'expand_frame_repr', False): 
                 with open(f"{path_prefix}utility-boxplot-{behaviour}-{size}.txt", "w") as f:
-                    df = get_box_plot_data(labels, bp)
+                    df = get_box_plot_data(stats)
                     print(df, file=f)
 
                     dfs[(behaviour, size)] = df
@@ -167,13 +163,13 @@ def graph_utility_summary_grouped_es(all_metrics: Dict[str, CombinedMetrics], pa
 
 
 
-def metrics_agents_capabilities(metrics: CombinedMetrics) -> tuple:
+def metrics_agents_capabilities(metrics: CombinedSummary) -> tuple:
     num_agents = sum(num_agents for (num_agents, behaviour) in args.agents)
     num_capabilities = metrics.args.num_capabilities
 
     return (num_agents, num_capabilities)
 
-def metrics_capacity(metrics: CombinedMetrics) -> float:
+def metrics_capacity(metrics: CombinedSummary) -> float:
     num_agents = metrics.num_agents()
     num_capabilities = metrics.num_capabilities()
 
@@ -190,7 +186,7 @@ def metrics_capacity(metrics: CombinedMetrics) -> float:
     return (crypto_capacity + trust_capacity + reputation_capacity + stereotype_capacity) / 4
 
 
-def graph_capacity_utility_es(all_metrics: Dict[str, CombinedMetrics], path_prefix: str):
+def graph_capacity_utility_es(all_metrics: Dict[str, CombinedSummary], path_prefix: str):
 
     print(len(all_metrics))
 
@@ -208,7 +204,7 @@ def graph_capacity_utility_es(all_metrics: Dict[str, CombinedMetrics], path_pref
         print(behaviour, size)
 
         data.extend(
-            (metrics_capacity(metrics), behaviour, path[1], np.median(metrics.normed_utilities))
+            (metrics_capacity(metrics), behaviour, path[1], metrics.median())
             for (path, metrics) in all_metrics.items()
             if path[0] == behaviour
             and path[-1] == size
@@ -240,7 +236,7 @@ def graph_capacity_utility_es(all_metrics: Dict[str, CombinedMetrics], path_pref
         plt.close(fig)
         gc.collect()
 
-def graph_size_utility_es(all_metrics: Dict[str, CombinedMetrics], path_prefix: str):
+def graph_size_utility_es(all_metrics: Dict[str, CombinedSummary], path_prefix: str):
     behaviours = list(sorted({path[0] for path in all_metrics.keys()}))
     sizes = list(sorted({path[-1] for path in all_metrics.keys()}))
 
@@ -258,7 +254,7 @@ def graph_size_utility_es(all_metrics: Dict[str, CombinedMetrics], path_prefix:
 
             data = [
                 #(path[1], np.quantile([b.utility / b.max_utility for b in metrics.buffers if not np.isnan(b.utility)], [0.25,0.5,0.75]))
-                (path[1], np.quantile(metrics.normed_utilities, [0.25,0.5,0.75]))
+                (path[1], metrics.quantiles([0.25,0.5,0.75]))
 
                 for (path, metrics) in all_metrics.items()
                 if path[0] == behaviour
@@ -304,6 +300,81 @@ def metrics_path_to_details(path):
 
     return tuple(spath)
 
+class SummaryCache:
+    """
+    Persistent cache of the summaries of combined metrics files, so they
+    do not need to be decompressed and unpickled again until they change
+    """
+    def __init__(self, cache_dir: str, use_hash: bool):
+        self.cache_dir = cache_dir
+        self.use_hash = use_hash
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_path(self, metrics_path: str) -> str:
+        name = hashlib.sha1(os.path.abspath(metrics_path).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{name}.pickle")
+
+    def key(self, metrics_path: str) -> tuple:
+        if self.use_hash:
+            with open(metrics_path, "rb") as f:
+                return ("sha256", hashlib.file_digest(f, "sha256").hexdigest())
+        else:
+            st = os.stat(metrics_path)
+            return ("mtime", st.st_mtime_ns, st.st_size)
+
+    def get(self, metrics_path: str, key: tuple):
+        try:
+            with open(self._entry_path(metrics_path), "rb") as f:
+                (entry_key, summary) = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError, AttributeError):
+            return None
+
+        return summary if entry_key == key else None
+
+    def put(self, metrics_path: str, key: tuple, summary: CombinedSummary):
+        entry_path = self._entry_path(metrics_path)
+
+        with open(entry_path + ".tmp", "wb") as f:
+            pickle.dump((key, summary), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(entry_path + ".tmp", entry_path)
+
+def load_summary(metrics_path: str):
+    with bz2.open(metrics_path, "rb") as f:
+        return (metrics_path, pickle.load(f).summary())
+
+def load_all_metrics(metrics_paths: list, cache: SummaryCache) -> Dict[tuple, CombinedSummary]:
+    summaries = {}
+    keys = {}
+
+    if cache is not None:
+        for metrics_path in metrics_paths:
+            keys[metrics_path] = cache.key(metrics_path)
+
+            summary = cache.get(metrics_path, keys[metrics_path])
+            if summary is not None:
+                summaries[metrics_path] = summary
+
+        print(f"Found {len(summaries)} cached metrics")
+
+    to_load = [metrics_path for metrics_path in metrics_paths if metrics_path not in summaries]
+
+    if to_load:
+        usable_cpus = len(os.sched_getaffinity(0))
+
+        with multiprocessing.Pool(min(usable_cpus, len(to_load))) as pool:
+            for (metrics_path, summary) in tqdm.tqdm(pool.imap_unordered(load_summary, to_load), total=len(to_load)):
+                summaries[metrics_path] = summary
+
+                if cache is not None:
+                    cache.put(metrics_path, keys[metrics_path], summary)
+
+    return {
+        metrics_path_to_details(metrics_path): summary
+        for (metrics_path, summary) in summaries.items()
+    }
+
 def main(args):
     metrics_paths = [
         f"{metrics_dir}/{file}"
@@ -312,13 +383,11 @@ def main(args):
         if fnmatch.fnmatch(f"{metrics_dir}/{file}", "*.combined.pickle.bz2")
     ]
 
-    all_metrics = {}
-
     print("Loading metrics...")
 
-    for metrics_path in metrics_paths:
-        with bz2.open(metrics_path, "rb") as f:
-            all_metrics[metrics_path_to_details(metrics_path)] = pickle.load(f)
+    cache = None if args.no_cache else SummaryCache(args.cache_dir, args.cache_hash)
+
+    all_metrics = load_all_metrics(metrics_paths, cache)
 
     print(f"Loaded {len(all_metrics)} metrics!")
 
@@ -340,6 +409,13 @@ if __name__ == "__main__":
     parser.add_argument('--path-prefix', type=str, default="",
                         help='The prefix to the location to output results')
 
+    parser.add_argument('--cache-dir', type=str, default=".summary-cache",
+                        help='The directory to cache the summaries of loaded metrics in')
+    parser.add_argument('--cache-hash', action="store_true", default=False,
+                        help='Identify changed metrics by their content hash instead of modification time')
+    parser.add_argument('--no-cache', action="store_true", default=False,
+                        help='Always load every metrics file')
+
     args = parser.parse_args()
 
     main(args)
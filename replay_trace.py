@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import time
+
+from run_simulation import get_eviction_strategy, eviction_strategies
+from simulation.replay import Replayer
+from simulation.trace import TraceReader
+
+def main(args):
+    trace = TraceReader(args.trace)
+
+    print(f"Trace of {trace.header['eviction_strategy']} with seed {trace.header['seed']} for {trace.header['duration']} seconds")
+
+    buffer_sizes = None
+    if args.buffer_sizes is not None:
+        buffer_sizes = tuple(args.buffer_sizes)
+
+    escls = [get_eviction_strategy(short_name) for short_name in args.eviction_strategy]
+
+    replayer = Replayer(trace, escls, buffer_sizes, args.log_level)
+
+    start = time.perf_counter()
+    replayer.run()
+    duration = time.perf_counter() - start
+
+    print(f"Replayed in {duration:.1f} seconds")
+    print()
+
+    print(f"{'Strategy':<14} {'Crypto':>8} {'Trust':>8} {'Rep':>8} {'Stereo':>8} {'Utility':>8} {'Normed':>8}")
+
+    for lane in replayer.lanes:
+        metrics = lane.metrics
+
+        # The mean of the utilities that are not NaN, and the summary only has normalised utilities that are not NaN
+        utility = replayer.utility_moments[lane.index].mean if replayer.utility_moments[lane.index].count else float("NaN")
+        normed = metrics.summary.utility_moments.mean if metrics.summary.utility_moments.count else float("NaN")
+
+        print(f"{lane.name:<14} {len(metrics.evicted_crypto):>8} {len(metrics.evicted_trust):>8} "
+              f"{len(metrics.evicted_reputation):>8} {len(metrics.evicted_stereotype):>8} "
+              f"{utility:>8.4f} {normed:>8.4f}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Evaluate eviction strategies against a recorded trace')
+    parser.add_argument('trace', type=str,
+                        help='The trace recorded by run_simulation.py --trace')
+    parser.add_argument('--eviction-strategy', type=str, nargs='+', default=eviction_strategies(), choices=eviction_strategies(),
+                        help='The eviction strategies to evaluate')
+    parser.add_argument('--buffer-sizes', type=int, nargs=4, default=None, metavar=('crypto', 'trust', 'reputation', 'stereotype'),
+                        help='Replay with different buffer sizes to those that were simulated')
+    parser.add_argument('--log-level', type=int, choices=(0, 1), required=False, default=0,
+                        help='The log level')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -1,24 +1,364 @@
 #!/usr/bin/env python3
+from __future__ import annotations
 
 import os
-from multiprocessing.pool import ThreadPool
+import fnmatch
+import functools
+import itertools
+import math
+import multiprocessing
 import random
-import subprocess
+import resource
+import signal
+import time
 
-new_nice = os.nice(10)
-print(f"Niceness set to {new_nice}")
+import tqdm
 
-def fn(seed):
-	print(f"Running {seed}")
-	subprocess.run(f"SEED={seed} nice -n 15 ./run.sh", shell=True, check=True)
+import run_simulation
+import combine_results
+from combine_results import CombinedMetrics
+from simulation.summary_statistics import RunningMoments
+from utils.work_queue import WorkQueue
 
-rng = random.SystemRandom()
+# The same configurations as run.sh
+BEHAVIOURS = ["VeryGoodBehaviour", "UnstableBehaviour", "GoodBehaviour", "AlwaysGoodBehaviour"]
 
-usable_cpus = len(os.sched_getaffinity(0))
+ESs = ["CapPri", "None", "LRU", "LRU2", "Random", "FIFO", "MRU", "Chen2016", "FiveBand", "NotInOther", "MinNotInOther"]
 
-print(f"Running with {usable_cpus} threads")
+# (crypto, trust, reputation, stereotype) buffer sizes
+SIZES = {
+	"complete": (10, 20, 10, 20),
+	"large": (10, 10, 10, 10),
+	"medium": (10, 5, 5, 5),
+	"medium2": (5, 10, 5, 5),
+	"medium4": (5, 5, 5, 10),
+	"small": (5, 5, 5, 5),
+}
 
-with ThreadPool(usable_cpus) as p:
-	seeds = [rng.getrandbits(31) for _ in range(1000)]
+NUM_AGENTS = 8
+NUM_BAD_AGENTS = 2
+NUM_CAPABILITIES = 2
+DURATION = 300
+AGENT_CHOOSE = "BRS"
+UTILITY_TARGETS = "good"
 
-	p.map(fn, seeds)
+def configurations(crn: bool=False):
+	# With common random numbers all eviction strategies are simulated together
+	ess = [ESs] if crn else [[es] for es in ESs]
+
+	for behaviour in BEHAVIOURS:
+		for (size, (crypto, trust, reputation, stereotype)) in SIZES.items():
+			for es in ess:
+				es_name = "{eviction_strategy}" if crn else es[0]
+
+				argv = [
+					"--agents", str(NUM_AGENTS), behaviour, "--agents", str(NUM_BAD_AGENTS), "AlwaysBadBehaviour",
+					"--num-capabilities", str(NUM_CAPABILITIES), "--duration", str(DURATION),
+					"--max-crypto-buf", str(crypto), "--max-trust-buf", str(trust),
+					"--max-reputation-buf", str(reputation), "--max-stereotype-buf", str(stereotype),
+					"--eviction-strategy", *es, "--agent-choose", AGENT_CHOOSE, "--utility-targets", UTILITY_TARGETS,
+					"--path-prefix", f"{behaviour}/{es_name}/{size}-", "--log-level", "0",
+				]
+
+				yield (f"{behaviour}/{'CRN' if crn else es_name}/{size}", argv)
+
+def estimated_cost(args) -> float:
+	# Every agent disseminates trust to and evaluates utility over every other agent,
+	# and larger buffers make both eviction and utility evaluation more expensive
+	num_agents = sum(num_agents for (num_agents, behaviour) in args.agents)
+	buffer_size = args.max_crypto_buf + args.max_trust_buf + args.max_reputation_buf + args.max_stereotype_buf
+
+	return args.duration * num_agents**2 * args.num_capabilities * buffer_size * len(args.eviction_strategy)
+
+class ResourceLimitExceeded(RuntimeError):
+	pass
+
+def _cpu_limit_exceeded(signum, frame):
+	raise ResourceLimitExceeded("CPU time limit exceeded")
+
+def apply_limits(limits: dict):
+	# Only applies to the current process, so needs a fresh worker for each job
+	if limits.get("memory") is not None:
+		# Allocations beyond this raise MemoryError
+		resource.setrlimit(resource.RLIMIT_AS, (limits["memory"], limits["memory"]))
+
+	if limits.get("cpu-time") is not None:
+		# The soft limit sends SIGXCPU, the hard limit kills the process
+		signal.signal(signal.SIGXCPU, _cpu_limit_exceeded)
+		resource.setrlimit(resource.RLIMIT_CPU, (limits["cpu-time"], limits["cpu-time"] + 10))
+
+def run_job(job):
+	(name, seed, argv) = job
+
+	args = run_simulation.argument_parser().parse_args(argv + ["--seed", str(seed)])
+
+	for path_prefix in run_simulation.path_prefixes(args).values():
+		os.makedirs(os.path.dirname(path_prefix) or ".", exist_ok=True)
+
+	start = time.perf_counter()
+	run_simulation.main(args)
+	return (name, seed, time.perf_counter() - start)
+
+def longest_first(jobs: list) -> list:
+	parser = run_simulation.argument_parser()
+
+	return sorted(jobs, key=lambda job: estimated_cost(parser.parse_args(job[2])), reverse=True)
+
+def try_job(job, limits: dict=None):
+	(name, seed, argv) = job
+
+	try:
+		if limits:
+			apply_limits(limits)
+
+		(name, seed, duration) = run_job(job)
+	except (Exception, SystemExit) as ex:
+		return (name, seed, None, repr(ex))
+
+	return (name, seed, duration, None)
+
+def run_jobs(jobs: list, processes: int, limits: dict=None) -> list:
+	# Workers are long lived and forked from a server that has already imported
+	# the simulation, so each run does not pay for interpreter startup and imports
+	ctx = multiprocessing.get_context("forkserver")
+	ctx.set_forkserver_preload(["run_simulation", "simulation.simulator", "simulation.eviction_strategy", "numpy"])
+
+	results = []
+
+	# Resource limits stay with a process, so each limited job needs a new worker
+	with ctx.Pool(processes, maxtasksperchild=1 if limits else None) as pool:
+		for result in tqdm.tqdm(pool.imap_unordered(functools.partial(try_job, limits=limits), longest_first(jobs)), total=len(jobs)):
+			(name, seed, duration, error) = result
+
+			if error is None:
+				tqdm.tqdm.write(f"Finished {name} {seed} in {duration:.1f} seconds")
+			else:
+				tqdm.tqdm.write(f"Failed {name} {seed} with {error}")
+
+			results.append(result)
+
+	return results
+
+def queue_worker(queue_path: str) -> int:
+	queue = WorkQueue(queue_path)
+
+	completed = 0
+
+	while (job := queue.claim()) is not None:
+		(name, seed, argv) = job
+
+		try:
+			(name, seed, duration) = run_job(job)
+		except (Exception, SystemExit) as ex:
+			print(f"Failed {name} {seed} with {ex!r}", flush=True)
+			queue.failed(name, seed, repr(ex))
+		else:
+			print(f"Finished {name} {seed} in {duration:.1f} seconds", flush=True)
+			queue.done(name, seed)
+			completed += 1
+
+	queue.close()
+
+	return completed
+
+def run_queue(queue_path: str, processes: int):
+	ctx = multiprocessing.get_context("forkserver")
+	ctx.set_forkserver_preload(["run_simulation", "simulation.simulator", "simulation.eviction_strategy", "numpy"])
+
+	# Each worker claims jobs from the queue itself, so that runners on
+	# other hosts sharing the queue get an even share of the jobs
+	with ctx.Pool(processes) as pool:
+		completed = sum(pool.map(queue_worker, [queue_path] * processes, chunksize=1))
+
+	print(f"Completed {completed} simulations")
+
+def random_seeds(num_seeds: int) -> list:
+	rng = random.SystemRandom()
+	return [rng.getrandbits(31) for _ in range(num_seeds)]
+
+def seed_status(path_prefix: str):
+	"""Combine the results of a configuration and return the seeds run and the moments of the mean utility of each seed"""
+	metrics_dir = os.path.dirname(path_prefix) or "."
+	prefix = os.path.basename(path_prefix).rstrip("-")
+
+	try:
+		files = [
+			file
+			for file in os.listdir(metrics_dir)
+			if fnmatch.fnmatch(file, f"{prefix}-metrics.*.pickle.bz2")
+			and "combined" not in file
+		]
+	except FileNotFoundError:
+		files = []
+
+	if not files:
+		return (path_prefix, set(), RunningMoments())
+
+	m = combine_results.combine(metrics_dir, prefix, files)
+
+	return (path_prefix, m.seeds, m.seed_moments)
+
+def seeds_needed(seeds: set, seed_moments: RunningMoments, args) -> int:
+	# Seeds without any finite utility are not in the moments, but still count towards the limit
+	run = len(seeds)
+
+	remaining = args.num_seeds - run
+	if remaining <= 0:
+		return 0
+
+	if run < args.min_seeds:
+		return min(args.min_seeds - run, remaining)
+
+	n = seed_moments.count
+
+	# Not enough seeds with a utility to estimate the interval
+	if n < 2:
+		return min(args.max_batch, remaining)
+
+	(low, high) = combine_results.confidence_interval(seed_moments, args.confidence)
+	half_width = (high - low) / 2
+
+	if half_width <= args.target_half_width:
+		return 0
+
+	# The interval narrows with the square root of the number of seeds
+	estimate = math.ceil(n * (half_width / args.target_half_width)**2)
+
+	return max(1, min(estimate - n, args.max_batch, remaining))
+
+def run_adaptive(args, processes: int):
+	parser = run_simulation.argument_parser()
+
+	configs = [
+		(name, argv, list(run_simulation.path_prefixes(parser.parse_args(argv)).values()))
+		for (name, argv) in configurations(args.crn)
+	]
+
+	path_prefixes = [path_prefix for (name, argv, prefixes) in configs for path_prefix in prefixes]
+
+	rng = random.SystemRandom()
+
+	# Configurations that have had a simulation fail are not scheduled again,
+	# as they would most likely fail in the same way every round
+	failed = set()
+
+	for round_number in itertools.count(1):
+		with multiprocessing.Pool(processes) as pool:
+			status = {
+				path_prefix: (seeds, seed_moments)
+				for (path_prefix, seeds, seed_moments) in tqdm.tqdm(pool.imap_unordered(seed_status, path_prefixes), total=len(path_prefixes))
+			}
+
+		# Prefer seeds that other configurations have already run, so results stay paired
+		seed_pool = sorted(set().union(*(seeds for (seeds, seed_moments) in status.values())))
+
+		jobs = []
+
+		for (name, argv, prefixes) in configs:
+			if name in failed:
+				continue
+
+			needed = max(seeds_needed(*status[path_prefix], args) for path_prefix in prefixes)
+			if needed == 0:
+				continue
+
+			done = set.intersection(*(status[path_prefix][0] for path_prefix in prefixes))
+
+			candidates = [seed for seed in seed_pool if seed not in done]
+			while len(candidates) < needed:
+				seed = rng.getrandbits(31)
+				if seed not in done and seed not in seed_pool:
+					seed_pool.append(seed)
+					candidates.append(seed)
+
+			jobs.extend((name, seed, argv) for seed in candidates[:needed])
+
+		unconverged = len({name for (name, seed, argv) in jobs})
+
+		print(f"Round {round_number}: {unconverged} of {len(configs)} configurations need {len(jobs)} more simulations")
+
+		if not jobs:
+			break
+
+		newly_failed = {name for (name, seed, duration, error) in run_jobs(jobs, processes) if error is not None}
+		if newly_failed:
+			print(f"Not scheduling {len(newly_failed)} configurations that failed: {', '.join(sorted(newly_failed))}")
+			failed |= newly_failed
+
+	if failed:
+		print(f"{len(failed)} configurations did not finish because simulations failed")
+
+def main(args):
+	new_nice = os.nice(10)
+	print(f"Niceness set to {new_nice}")
+
+	processes = args.processes or len(os.sched_getaffinity(0))
+
+	if args.adaptive:
+		run_adaptive(args, processes)
+	elif args.queue is not None:
+		queue = WorkQueue(args.queue)
+
+		# Only draw new seeds for a new queue, otherwise resume the existing one
+		if args.seeds or not queue.counts():
+			jobs = [
+				(name, seed, argv)
+				for seed in (args.seeds or random_seeds(args.num_seeds))
+				for (name, argv) in configurations(args.crn)
+			]
+
+			added = queue.add(longest_first(jobs))
+			print(f"Added {added} simulations to {args.queue}")
+
+		if args.retry_failed:
+			print(f"Retrying {queue.retry_failed()} failed simulations")
+
+		print(f"Queue {args.queue} has {queue.counts()}")
+		queue.close()
+
+		run_queue(args.queue, processes)
+	else:
+		jobs = [
+			(name, seed, argv)
+			for seed in (args.seeds or random_seeds(args.num_seeds))
+			for (name, argv) in configurations(args.crn)
+		]
+
+		print(f"Running {len(jobs)} simulations with {processes} processes")
+
+		run_jobs(jobs, processes)
+
+if __name__ == "__main__":
+	import argparse
+
+	parser = argparse.ArgumentParser(description='Run the simulations in run.sh for many seeds')
+	parser.add_argument('--num-seeds', type=int, default=1000,
+						help='The number of random seeds to run, or the most to run per configuration with --adaptive')
+	parser.add_argument('--seeds', type=int, nargs="+", default=None,
+						help='Specific seeds to run instead of random seeds')
+	parser.add_argument('--processes', type=int, default=None,
+						help='The number of worker processes, defaults to the number of usable CPUs')
+	parser.add_argument('--queue', type=str, default=None,
+						help='A SQLite work queue to record and resume progress in, which can be shared between runners')
+	parser.add_argument('--retry-failed', action="store_true", default=False,
+						help='Give failed simulations in the queue another chance')
+	parser.add_argument('--crn', action="store_true", default=False,
+						help='Simulate all eviction strategies together using common random numbers')
+
+	parser.add_argument('--adaptive', action="store_true", default=False,
+						help='Keep running more seeds for the configurations whose confidence interval is too wide')
+	parser.add_argument('--target-half-width', type=float, default=0.01,
+						help='The half width of the confidence interval of the mean normalised utility to aim for with --adaptive')
+	parser.add_argument('--confidence', type=float, default=0.95,
+						help='The confidence level of the interval with --adaptive')
+	parser.add_argument('--min-seeds', type=int, default=10,
+						help='The number of seeds to run before the confidence interval is trusted with --adaptive')
+	parser.add_argument('--max-batch', type=int, default=100,
+						help='The most seeds to add to a configuration in each round with --adaptive')
+
+	args = parser.parse_args()
+
+	if args.adaptive and (args.queue is not None or args.seeds is not None):
+		parser.error("--adaptive chooses its own seeds and cannot be used with --queue or --seeds")
+
+	main(args)
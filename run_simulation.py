@@ -2,31 +2,61 @@
 from __future__ import annotations
 
 import argparse
+import copy
 from itertools import chain
+import os
+import random
 import secrets
+import time
 
-from simulation.agent import Agent
-from simulation.agent_choose_behaviour import AgentChooseBehaviour
-from simulation.capability import Capability
-from simulation.capability_behaviour import CapabilityBehaviour
-from simulation.eviction_strategy import EvictionStrategy
-from simulation.metrics import Metrics
-from simulation.simulator import Simulator
+# The simulation is only imported once it is needed, as it imports numpy
+# which are slow to import, while the arguments can be parsed without them
+from simulation import registry
 from simulation.utility_targets import UtilityTargets
 
 def get_eviction_strategy(short_name: str):
-    [cls] = [cls for cls in EvictionStrategy.__subclasses__() if cls.short_name == short_name]
-    return cls
+    return registry.EVICTION_STRATEGIES.get(short_name)
 
 def get_behaviour(name: str):
-    [cls] = [cls for cls in CapabilityBehaviour.__subclasses__() if cls.__name__ == name]
-    return cls
+    return registry.BEHAVIOURS.get(name)
 
 def get_agent_choose_behaviour(name: str):
-    [cls] = [cls for cls in AgentChooseBehaviour.__subclasses__() if cls.short_name == name]
-    return cls
+    return registry.AGENT_CHOOSE_BEHAVIOURS.get(name)
+
+def get_topology(short_name: str):
+    return registry.TOPOLOGIES.get(short_name)
+
+def path_prefixes(args) -> dict:
+    """The path prefix that the metrics of each eviction strategy will be saved to"""
+    if len(set(args.eviction_strategy)) != len(args.eviction_strategy):
+        raise ValueError("Each eviction strategy can only be simulated once")
+
+    if len(args.eviction_strategy) > 1 and "{eviction_strategy}" not in args.path_prefix:
+        raise ValueError("The path prefix needs to contain {eviction_strategy} when simulating multiple eviction strategies")
+
+    return {
+        es: args.path_prefix.replace("{eviction_strategy}", es)
+        for es in args.eviction_strategy
+    }
+
+# Arguments that can differ when resuming from a checkpoint
+RESUME_IGNORED_ARGS = ("resume", "checkpoint_path", "checkpoint_period", "log_level", "profile")
+
+def checkpoint_path(args, prefixes: dict) -> str:
+    if args.checkpoint_path is not None:
+        return args.checkpoint_path
+
+    if args.seed is None:
+        raise ValueError("Checkpoints need either --seed or --checkpoint-path to be set, so they can be found again")
+
+    return f"{prefixes[args.eviction_strategy[0]]}checkpoint.{args.seed}.pickle"
+
+def create_simulator(args, prefixes: dict) -> Simulator:
+    from simulation.agent import Agent
+    from simulation.capability import Capability
+    from simulation.simulator import Simulator
+    from simulation.trace import TraceWriter
 
-def main(args):
     seed = args.seed if args.seed is not None else secrets.randbits(32)
 
     capabilities = [Capability(f"C{n}", args.task_period, n) for n in range(args.num_capabilities)]
@@ -47,22 +77,102 @@ def main(args):
         for (n, behaviour) in enumerate(chain.from_iterable(agent_behaviours))
     ]
 
-    es = get_eviction_strategy(args.eviction_strategy)
+    es = [get_eviction_strategy(short_name) for short_name in args.eviction_strategy]
+
+    trace = TraceWriter(f"{prefixes[args.eviction_strategy[0]]}trace.{seed}.bin", args) if args.trace else None
+
+    # The topology has its own PRNG so that the events are the same for every topology
+    topology = get_topology(args.topology).create(agents, args.degree, random.Random(f"{seed}:topology"))
+
+    sim = Simulator(seed, agents, es, args.duration, args.utility_targets, args.log_level, trace, topology)
+
+    if args.converge_window is not None:
+        sim.enable_convergence_stop(args.converge_window, args.converge_tolerance)
+
+    sim.start(args.max_start_delay)
+
+    return sim
+
+def main(args, timings: dict=None):
+    """
+    Run the simulation and save the metrics of each eviction strategy.
+    If timings is given, the wall clock time of each phase is recorded in it.
+    """
+    start = time.perf_counter()
+
+    from simulation.simulator import Simulator
+
+    prefixes = path_prefixes(args)
+
+    checkpoint = None
+    if args.checkpoint_period is not None or args.resume:
+        checkpoint = checkpoint_path(args, prefixes)
+
+    if args.resume and os.path.exists(checkpoint):
+        sim = Simulator.restore(checkpoint)
+
+        saved_args = {k: v for (k, v) in vars(sim.checkpoint_extra).items() if k not in RESUME_IGNORED_ARGS}
+        current_args = {k: v for (k, v) in vars(args).items() if k not in RESUME_IGNORED_ARGS}
+        if saved_args != current_args:
+            raise ValueError(f"The checkpoint {checkpoint} was made with different arguments {saved_args}")
 
-    sim = Simulator(seed, agents, es, args.duration, args.utility_targets, args.log_level)
+        sim.log_level = args.log_level
 
-    sim.run(args.max_start_delay)
+        print(f"Resuming from {checkpoint} at {sim.current_time}")
+    else:
+        sim = create_simulator(args, prefixes)
 
-    sim.metrics.save(sim, args, args.path_prefix)
+    if args.checkpoint_period is not None:
+        sim.enable_checkpoints(checkpoint, args.checkpoint_period, args)
+
+    if args.profile:
+        sim.enable_profiling()
+
+    setup_done = time.perf_counter()
+
+    sim.loop()
+
+    loop_done = time.perf_counter()
+
+    sim.finish_checkpoints()
+
+    if sim.stop_time is not None:
+        print(f"Utility converged, stopped at {sim.stop_time}")
+
+    if sim.trace is not None:
+        sim.trace.close()
+
+    for lane in sim.lanes:
+        # Each lane chose which agents perform tasks with its own buffers,
+        # so save the arguments as if this strategy had been simulated on its own
+        lane_args = copy.copy(args)
+        lane_args.eviction_strategy = lane.name
+        lane_args.path_prefix = prefixes[lane.name]
+        if len(sim.lanes) > 1:
+            lane_args.common_random_numbers = list(args.eviction_strategy)
+
+        lane.metrics.save(sim, lane_args, lane_args.path_prefix)
+
+    if sim.profiler is not None:
+        sim.profiler.save(sim, prefixes[args.eviction_strategy[0]])
+
+    if timings is not None:
+        timings["setup"] = setup_done - start
+        timings["simulate"] = loop_done - setup_done
+        timings["save"] = time.perf_counter() - loop_done
+        timings["events"] = sim.events_processed
 
 def eviction_strategies():
-    return [cls.short_name for cls in EvictionStrategy.__subclasses__()]
+    return registry.EVICTION_STRATEGIES.names()
 
 def behaviours():
-    return [cls.__name__ for cls in CapabilityBehaviour.__subclasses__()]
+    return registry.BEHAVIOURS.names()
 
 def agent_choose_behaviours():
-    return [cls.short_name for cls in AgentChooseBehaviour.__subclasses__()]
+    return registry.AGENT_CHOOSE_BEHAVIOURS.names()
+
+def topologies():
+    return registry.TOPOLOGIES.names()
 
 # From: https://stackoverflow.com/questions/8526675/python-argparse-optional-append-argument-with-choices
 class AgentBehavioursAction(argparse.Action):
@@ -88,7 +198,7 @@ class AgentBehavioursAction(argparse.Action):
             else:
                 setattr(namespace, self.dest, attr + [(number, behaviour)])
 
-if __name__ == "__main__":
+def argument_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description='Simulate')
     parser.add_argument('--agents', required=True, nargs='+', metavar='num behaviour',
                         action=AgentBehavioursAction,
@@ -117,22 +227,51 @@ if __name__ == "__main__":
     parser.add_argument('--max-stereotype-buf', type=int, required=True,
                         help='The maximum length of the stereotype buffer')
 
-    parser.add_argument('--eviction-strategy', type=str, required=True, choices=eviction_strategies(),
-                        help='The eviction strategy')
+    parser.add_argument('--eviction-strategy', type=str, required=True, nargs='+', choices=eviction_strategies(),
+                        help='The eviction strategy. When several are given they are simulated together using common random numbers, '
+                             'with the first strategy deciding which agent performs a task. The path prefix should then include {eviction_strategy}.')
     parser.add_argument('--agent-choose', type=str, required=True, choices=agent_choose_behaviours(),
                         help='The behaviour to choose which agent to interact with to perform a task')
     parser.add_argument('--utility-targets', type=UtilityTargets, required=True, choices=list(UtilityTargets),
                         help='Which targets to evaluate utility against')
 
+    parser.add_argument('--topology', type=str, required=False, default="complete", choices=topologies(),
+                        help='Which agents are neighbours. Agents only disseminate trust to their neighbours and '
+                             'utility is only evaluated against the neighbours of the source.')
+    parser.add_argument('--degree', type=int, required=False, default=4,
+                        help='The average number of neighbours of each agent for sparse topologies')
+
     parser.add_argument('--path-prefix', type=str, required=False, default="./",
                         help='The path prefix for output files')
 
     parser.add_argument('--seed', type=int, required=False, default=None,
                         help='The simulation seed')
 
+    parser.add_argument('--trace', action='store_true', default=False,
+                        help='Record a trace of buffer operations that replay_trace.py can evaluate other eviction strategies against')
+
+    parser.add_argument('--converge-window', type=float, required=False, default=None,
+                        help='Stop early once the mean normalised utility of every (source, capability) changes by less than '
+                             'the tolerance between consecutive windows of this many seconds')
+    parser.add_argument('--converge-tolerance', type=float, required=False, default=0.05,
+                        help='The tolerance for --converge-window')
+
+    parser.add_argument('--checkpoint-period', type=float, required=False, default=None,
+                        help='Save a checkpoint of the simulation every this many seconds of wall clock time')
+    parser.add_argument('--checkpoint-path', type=str, required=False, default=None,
+                        help='Where to save the checkpoint, defaults to <path-prefix>checkpoint.<seed>.pickle')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='Continue from the checkpoint if there is one, otherwise start from the beginning')
+
+    parser.add_argument('--profile', action='store_true', default=False,
+                        help='Record the time spent on each class of event and in the hot paths to <path-prefix>profile.<seed>.json')
+
     parser.add_argument('--log-level', type=int, choices=(0, 1), required=False, default=1,
                         help='The log level')
 
-    args = parser.parse_args()
+    return parser
+
+if __name__ == "__main__":
+    args = argument_parser().parse_args()
 
     main(args)
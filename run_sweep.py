@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+A sweep is described by a JSON grid, for example:
+
+{
+    "base": {"num-capabilities": 2, "duration": 300, "utility-targets": "good", "log-level": 0},
+    "agents": {
+        "GoodBehaviour": [[8, "GoodBehaviour"], [2, "AlwaysBadBehaviour"]]
+    },
+    "eviction-strategy": ["LRU", "FIFO"],
+    "buffers": {
+        "small": {"max-crypto-buf": 5, "max-trust-buf": 5, "max-reputation-buf": 5, "max-stereotype-buf": 5}
+    },
+    "agent-choose": ["BRS"],
+    "layout": "{agents}/{eviction_strategy}/{buffers}-",
+    "num-seeds": 10,
+    "limits": {"memory": 4294967296, "cpu-time": 3600}
+}
+
+The named agents and buffers options are used to name the output directories,
+the layout is the --path-prefix of each configuration. Either "seeds" or
+"num-seeds" should be given.
+"""
+from __future__ import annotations
+
+import bz2
+import os
+import fnmatch
+import itertools
+import json
+import pickle
+import random
+
+import run_multiple
+
+DEFAULT_LAYOUT = "{agents}/{eviction_strategy}/{buffers}-"
+
+def configuration_argv(grid: dict, agents: list, eviction_strategy: str, buffers: dict, agent_choose: str) -> list:
+    argv = []
+
+    for (num_agents, behaviour) in agents:
+        argv.extend(["--agents", str(num_agents), behaviour])
+
+    options = {
+        **grid.get("base", {}),
+        **buffers,
+        "eviction-strategy": eviction_strategy,
+        "agent-choose": agent_choose,
+    }
+
+    for (name, value) in options.items():
+        argv.extend([f"--{name}", str(value)])
+
+    return argv
+
+def expand(grid: dict) -> dict:
+    """Expand the grid into a mapping of path prefix to simulation arguments"""
+    layout = grid.get("layout", DEFAULT_LAYOUT)
+
+    configurations = {}
+
+    for ((agents_name, agents), eviction_strategy, (buffers_name, buffers), agent_choose) in itertools.product(
+            grid["agents"].items(), grid["eviction-strategy"], grid["buffers"].items(), grid.get("agent-choose", ["BRS"])):
+
+        path_prefix = layout.format(
+            agents=agents_name,
+            eviction_strategy=eviction_strategy,
+            buffers=buffers_name,
+            agent_choose=agent_choose,
+        )
+
+        argv = configuration_argv(grid, agents, eviction_strategy, buffers, agent_choose)
+
+        if path_prefix in configurations and configurations[path_prefix] != argv:
+            raise ValueError(f"The layout {layout!r} gives different configurations the same path {path_prefix!r}")
+
+        configurations[path_prefix] = argv
+
+    return configurations
+
+def existing_seeds(path_prefix: str) -> set:
+    directory = os.path.dirname(path_prefix) or "."
+    prefix = os.path.basename(path_prefix)
+
+    try:
+        files = os.listdir(directory)
+    except FileNotFoundError:
+        return set()
+
+    return {
+        int(file.split(".")[1])
+        for file in files
+        if fnmatch.fnmatch(file, f"{prefix}metrics.*.pickle.bz2")
+        and "combined" not in file
+    }
+
+def plan(grid: dict, configurations: dict):
+    """
+    Work out which simulations still need to be run. Configurations with identical
+    arguments are only run once, with their results copied to the other paths.
+    """
+    rng = random.SystemRandom()
+
+    # Group together configurations that only differ in where they are saved
+    duplicates = {}
+    for (path_prefix, argv) in configurations.items():
+        duplicates.setdefault(tuple(argv), []).append(path_prefix)
+
+    jobs = []
+    copies = {}
+    existing_copies = []
+
+    for (argv, path_prefixes) in duplicates.items():
+        done = {path_prefix: existing_seeds(path_prefix) for path_prefix in path_prefixes}
+
+        if "seeds" in grid:
+            seeds = set(grid["seeds"])
+        else:
+            # Reuse seeds that have already been run for any copy of this configuration
+            seeds = set().union(*done.values())
+            seeds = set(sorted(seeds)[:grid["num-seeds"]])
+
+            while len(seeds) < grid["num-seeds"]:
+                seeds.add(rng.getrandbits(31))
+
+        for seed in sorted(seeds):
+            missing = [path_prefix for path_prefix in path_prefixes if seed not in done[path_prefix]]
+            if not missing:
+                continue
+
+            have = [path_prefix for path_prefix in path_prefixes if seed in done[path_prefix]]
+
+            if have:
+                # Another copy of this configuration has already run this seed
+                existing_copies.extend((have[0], path_prefix, seed) for path_prefix in missing)
+            else:
+                (first, *rest) = missing
+                jobs.append((first.rstrip("-"), seed, list(argv) + ["--path-prefix", first]))
+                copies[(first.rstrip("-"), seed)] = (first, rest)
+
+    return (jobs, copies, existing_copies)
+
+def copy_result(from_prefix: str, to_prefix: str, seed: int):
+    """
+    Copy the metrics of a seed to a configuration that only differs in where it is saved.
+    The path prefix recorded in the summary and the metrics is changed to the new one,
+    so that the copy can be combined with the other seeds of that configuration.
+    """
+    os.makedirs(os.path.dirname(to_prefix) or ".", exist_ok=True)
+
+    # The summary followed by the metrics, or only the metrics for older results
+    saved = []
+    with bz2.open(f"{from_prefix}metrics.{seed}.pickle.bz2", "rb") as f:
+        while True:
+            try:
+                saved.append(pickle.load(f))
+            except EOFError:
+                break
+
+    for item in saved:
+        if item.args is not None:
+            item.args.path_prefix = to_prefix
+
+    with bz2.open(f"{to_prefix}metrics.{seed}.pickle.bz2", "wb") as f:
+        for item in saved:
+            pickle.dump(item, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def main(args):
+    with open(args.grid, "r") as f:
+        grid = json.load(f)
+
+    if ("seeds" in grid) == ("num-seeds" in grid):
+        raise ValueError("The grid needs exactly one of seeds or num-seeds")
+
+    configurations = expand(grid)
+
+    (jobs, copies, existing_copies) = plan(grid, configurations)
+
+    print(f"Sweep has {len(configurations)} configurations, {len(jobs)} simulations need to be run")
+
+    if args.dry_run:
+        for (name, seed, argv) in jobs:
+            print(name, seed, " ".join(argv))
+        return
+
+    for (from_prefix, to_prefix, seed) in existing_copies:
+        copy_result(from_prefix, to_prefix, seed)
+
+    if not jobs:
+        return
+
+    new_nice = os.nice(10)
+    print(f"Niceness set to {new_nice}")
+
+    processes = args.processes or len(os.sched_getaffinity(0))
+
+    results = run_multiple.run_jobs(jobs, processes, grid.get("limits"))
+
+    failed = 0
+
+    for (name, seed, duration, error) in results:
+        if error is not None:
+            failed += 1
+            continue
+
+        (first, rest) = copies[(name, seed)]
+        for path_prefix in rest:
+            copy_result(first, path_prefix, seed)
+
+    print(f"Completed {len(results) - failed} simulations, {failed} failed")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a sweep of simulations over a grid of parameters')
+    parser.add_argument('grid', type=str,
+                        help='The path to the JSON description of the grid')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='The number of worker processes, defaults to the number of usable CPUs')
+    parser.add_argument('--dry-run', action="store_true", default=False,
+                        help='Only list the simulations that would be run')
+
+    args = parser.parse_args()
+
+    main(args)
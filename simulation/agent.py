@@ -21,7 +21,11 @@ class Agent:
 
         self.trust_dissem_period = trust_dissem_period
 
-        self.buffers = AgentBuffers(self, crypto_bux_max, trust_bux_max, reputation_bux_max, stereotype_bux_max)
+        self.buffer_sizes = (crypto_bux_max, trust_bux_max, reputation_bux_max, stereotype_bux_max)
+
+        # The buffers of the lane that makes decisions, see lane_buffers for the others
+        self.buffers = AgentBuffers(self, *self.buffer_sizes)
+        self.lane_buffers = [self.buffers]
 
         self.sim = None
         self.cCMS = None
@@ -32,6 +36,13 @@ class Agent:
         self.cCMS = sim.correct_sketch
         self.iCMS = sim.incorrect_sketch
 
+        # Each lane after the first needs its own buffers
+        self.lane_buffers = [self.buffers]
+        for lane in sim.lanes[1:]:
+            buffers = AgentBuffers(self, *self.buffer_sizes)
+            buffers.lane = lane.index
+            self.lane_buffers.append(buffers)
+
         # Give each behaviour their own random seed to prevent capabilities
         # all being good or bad simultaneously
         for (capability, behaviour) in sorted(self.capability_behaviour.items(), key=lambda x: x[0].name):
@@ -40,54 +51,69 @@ class Agent:
     def next_trust_dissemination_period(self, rng: random.Random) -> float:
         return rng.expovariate(1.0 / self.trust_dissem_period)
 
-    def request_stereotype(self, agent: Agent):
-        self.sim.add_event(AgentStereotypeRequest(self.sim.current_time + EPSILON, self, agent))
+    def request_stereotype(self, agent: Agent, lanes: List[Lane]):
+        self.sim.add_event(AgentStereotypeRequest(self.sim.current_time + EPSILON, self, agent, lanes))
 
-    def request_crypto(self, agent: Agent):
-        self.sim.add_event(AgentCryptoRequest(self.sim.current_time + EPSILON, self, agent))
+    def request_crypto(self, agent: Agent, lanes: List[Lane]):
+        self.sim.add_event(AgentCryptoRequest(self.sim.current_time + EPSILON, self, agent, lanes))
 
     def receive_trust_information(self, agent: Agent):
         # Don't record information from ourself
         if agent is self:
             return
 
-        crypto_item = self.buffers.find_crypto(agent)
+        # Lanes that need to request information
+        crypto_lanes = []
+        stereotype_lanes = []
 
-        # Can't decrypt or verify
-        if crypto_item is None:
-            self.request_crypto(agent)
-            return
+        for lane in self.sim.lanes:
+            buffers = self.lane_buffers[lane.index]
 
-        self.sim.es.use_crypto(crypto_item)
+            crypto_item = buffers.find_crypto(agent)
 
-        # Need to request sterotype information here, if missing any
-        if any(self.buffers.find_stereotype(agent, capability) is None for capability in self.capabilities):
-            self.request_stereotype(agent)
+            # Can't decrypt or verify
+            if crypto_item is None:
+                crypto_lanes.append(lane)
+                continue
 
-        trust_items = copy.deepcopy(agent.buffers.trust)
-        trust_items.freeze()
+            lane.es.use_crypto(crypto_item)
 
-        # Record reputation information
-        reputation_item = self.buffers.find_reputation(agent)
-        if reputation_item is None:
-            # Try to add this new item
-            new_reputation_item = ReputationItem(agent, trust_items)
+            # Need to request sterotype information here, if missing any
+            if any(buffers.find_stereotype(agent, capability) is None for capability in self.capabilities):
+                stereotype_lanes.append(lane)
 
-            self.buffers.add_reputation(self.sim.es, new_reputation_item)
-        else:
-            # Update the item
-            reputation_item.trust_items = trust_items
+            trust_items = copy.deepcopy(agent.lane_buffers[lane.index].trust)
+            trust_items.freeze()
 
-            # Record that we have used it
-            self.sim.es.use_reputation(reputation_item)
+            # Record reputation information
+            reputation_item = buffers.find_reputation(agent)
+            if reputation_item is None:
+                # Try to add this new item
+                new_reputation_item = ReputationItem(agent, trust_items)
+
+                buffers.add_reputation(lane.es, new_reputation_item)
+            else:
+                # Update the item
+                reputation_item.trust_items = trust_items
 
+                # Record that we have used it
+                lane.es.use_reputation(reputation_item)
 
-    def receive_crypto_information(self, agent: Agent):
+        if crypto_lanes:
+            self.request_crypto(agent, crypto_lanes)
+
+        if stereotype_lanes:
+            self.request_stereotype(agent, stereotype_lanes)
+
+
+    def receive_crypto_information(self, agent: Agent, lane: Lane):
         # Don't record information about ourself
         if agent is self:
             return
 
-        crypto_item = self.buffers.find_crypto(agent)
+        buffers = self.lane_buffers[lane.index]
+
+        crypto_item = buffers.find_crypto(agent)
 
         # Don't add items we already have
         if crypto_item is not None:
@@ -95,9 +121,9 @@ class Agent:
 
         new_crypto_item = CryptoItem(agent)
 
-        self.buffers.add_crypto(self.sim.es, new_crypto_item)
+        buffers.add_crypto(lane.es, new_crypto_item)
 
-    def receive_stereotype_information(self, agent: Agent, capability: Capability):
+    def receive_stereotype_information(self, agent: Agent, capability: Capability, lane: Lane):
         # Ignore stereotypes about ourself
         if agent is self:
             return
@@ -106,7 +132,9 @@ class Agent:
         if capability not in self.capabilities:
             return
 
-        stereotype_item = self.buffers.find_stereotype(agent, capability)
+        buffers = self.lane_buffers[lane.index]
+
+        stereotype_item = buffers.find_stereotype(agent, capability)
 
         # Don't add items we already have
         if stereotype_item is not None:
@@ -114,50 +142,75 @@ class Agent:
 
         new_stereotype_item = StereotypeItem(agent, capability)
 
-        self.buffers.add_stereotype(self.sim.es, new_stereotype_item)
+        buffers.add_stereotype(lane.es, new_stereotype_item)
+
+    def update_trust_history(self, agent: Agent, capability: Capability, outcome: InteractionObservation, lane: Lane):
+        buffers = self.lane_buffers[lane.index]
 
-    def update_trust_history(self, agent: Agent, capability: Capability, outcome: InteractionObservation):
-        trust_item = self.buffers.find_trust(agent, capability)
+        trust_item = buffers.find_trust(agent, capability)
 
         # Need to add item if not in buffer
         if trust_item is None:
             new_trust_item = TrustItem(agent, capability)
 
-            self.buffers.add_trust(self.sim.es, new_trust_item)
+            buffers.add_trust(lane.es, new_trust_item)
 
-            trust_item = self.buffers.find_trust(agent, capability)
+            trust_item = buffers.find_trust(agent, capability)
             assert trust_item is new_trust_item or trust_item is None
 
         if trust_item is not None:
-            trust_item.record(outcome)
+            # The interaction only happened once, so only count it once
+            trust_item.record(outcome, count=lane.index == 0)
 
             # Record that we have used it
-            self.sim.es.use_trust(trust_item)
+            lane.es.use_trust(trust_item)
+
+        # Only calculate the utility if it will be logged
+        if self.sim.log_level > 0:
+            self.log(f"Value of buffers after update {buffers.utility(self, capability, targets=[agent])} {capability}")
+
+    def choose_agent_for_task(self, capability: Capability) -> List[Optional[Agent]]:
+        """The agent each lane chooses to perform the task, using its own buffers"""
+        selected_agents = []
+
+        for lane in self.sim.lanes:
+            rng = lane.rng if lane.rng is not None else self.sim.rng
+
+            item = self.choose.choose_agent_for_task(self, capability, self.lane_buffers[lane.index], rng)
+            if item is None:
+                selected_agents.append(None)
+                continue
+
+            # The lane uses its items about the agent it chose
+            self.use_buffers_for_task(item.agent, capability, lane)
+
+            selected_agents.append(item.agent)
+
+        return selected_agents
 
-        self.log(f"Value of buffers after update {self.buffers.utility(self, capability, targets=[agent])} {capability}")
+    def use_buffers_for_task(self, agent: Agent, capability: Capability, lane: Lane):
+        buffers = self.lane_buffers[lane.index]
 
-    def choose_agent_for_task(self, capability: Capability):
-        item = self.choose.choose_agent_for_task(self, capability)
-        if item is None:
-            return None
+        crypto_item = buffers.find_crypto(agent)
 
-        self.sim.es.use_crypto(item)
+        lane.es.use_crypto(crypto_item)
 
-        self.sim.es.use_trust(self.buffers.find_trust(item.agent, capability))
+        lane.es.use_trust(buffers.find_trust(agent, capability))
 
-        for reputation_item in self.buffers.reputation:
-            if any(trust_item.agent is item and trust_item.capability is capability for trust_item in reputation_item.trust_items):
-                self.sim.es.use_reputation(reputation_item)
+        for reputation_item in buffers.reputation:
+            if any(trust_item.agent is crypto_item and trust_item.capability is capability for trust_item in reputation_item.trust_items):
+                lane.es.use_reputation(reputation_item)
 
-        self.sim.es.use_stereotype(self.buffers.find_stereotype(item.agent, capability))
+        lane.es.use_stereotype(buffers.find_stereotype(agent, capability))
 
-        return item.agent
+    def frozen_buffers(self) -> List[AgentBuffers]:
+        return [lane_buffers.frozen() for lane_buffers in self.lane_buffers]
 
-    def perform_interaction(self, selected_agent: Agent, capability: Capability):
+    def perform_interaction(self, selected_agents: List[Optional[Agent]], capability: Capability):
         # Record the values in the buffers at the time the interaction was initiated
-        buffers = self.buffers.frozen()
+        buffers = self.frozen_buffers()
 
-        self.sim.add_event(AgentTaskInteraction(self.sim.current_time + EPSILON, self, capability, selected_agent, buffers))
+        self.sim.add_event(AgentTaskInteraction(self.sim.current_time + EPSILON, self, capability, selected_agents, buffers))
 
 
     def log(self, message: str):
@@ -26,13 +26,15 @@ class TrustItem:
 
     eviction_data: Any = None
 
-    def record(self, outcome: str):
+    def record(self, outcome: str, count: bool=True):
         if outcome == InteractionObservation.Correct:
             self.correct_count += 1
-            self.agent.cCMS.add(self.agent.name)
+            if count:
+                self.agent.cCMS.add(self.agent.name)
         else:
             self.incorrect_count += 1
-            self.agent.iCMS.add(self.agent.name)
+            if count:
+                self.agent.iCMS.add(self.agent.name)
 
     def total_count(self) -> int:
         return self.correct_count + self.incorrect_count
@@ -76,6 +78,9 @@ class AgentBuffers:
     def __init__(self, agent: Agent, crypto_bux_max: int, trust_bux_max: int, reputation_bux_max: int, stereotype_bux_max: int):
         self.agent = agent
 
+        # Index of the simulation lane these buffers belong to
+        self.lane = 0
+
         self.crypto = BoundedList(length=crypto_bux_max)
         self.trust = BoundedList(length=trust_bux_max)
         self.reputation = BoundedList(length=reputation_bux_max)
@@ -94,6 +99,9 @@ class AgentBuffers:
             for b in self.buffers
         }
 
+    def utility_snapshot(self, capability: Capability) -> UtilitySnapshot:
+        return UtilitySnapshot(self, capability)
+
     def find_crypto(self, agent: Agent) -> CryptoItem:
         for item in self.crypto:
             if item.agent is agent:
@@ -209,8 +217,9 @@ class AgentBuffers:
             choice = es.choose_crypto(self.crypto, self, item)
             if choice is not None:
                 self.crypto.remove(choice)
-                self.log(f"Evicted {choice} from {[x.basic() for x in self.crypto]}")
-                self.agent.sim.metrics.add_evicted_crypto(self.agent.sim.current_time, self.agent, choice)
+                if self.agent.sim.log_level > 0:
+                    self.log(f"Evicted {choice} from {[x.basic() for x in self.crypto]}")
+                self.agent.sim.lanes[self.lane].metrics.add_evicted_crypto(self.agent.sim.current_time, self.agent, choice)
 
                 self.crypto.append(item)
             else:
@@ -225,8 +234,9 @@ class AgentBuffers:
             choice = es.choose_trust(self.trust, self, item)
             if choice is not None:
                 self.trust.remove(choice)
-                self.log(f"Evicted {choice} from {[x.basic() for x in self.trust]}")
-                self.agent.sim.metrics.add_evicted_trust(self.agent.sim.current_time, self.agent, choice)
+                if self.agent.sim.log_level > 0:
+                    self.log(f"Evicted {choice} from {[x.basic() for x in self.trust]}")
+                self.agent.sim.lanes[self.lane].metrics.add_evicted_trust(self.agent.sim.current_time, self.agent, choice)
 
                 self.trust.append(item)
             else:
@@ -241,8 +251,9 @@ class AgentBuffers:
             choice = es.choose_reputation(self.reputation, self, item)
             if choice is not None:
                 self.reputation.remove(choice)
-                self.log(f"Evicted {choice} from {[x.basic() for x in self.reputation]}")
-                self.agent.sim.metrics.add_evicted_reputation(self.agent.sim.current_time, self.agent, choice)
+                if self.agent.sim.log_level > 0:
+                    self.log(f"Evicted {choice} from {[x.basic() for x in self.reputation]}")
+                self.agent.sim.lanes[self.lane].metrics.add_evicted_reputation(self.agent.sim.current_time, self.agent, choice)
 
                 self.reputation.append(item)
             else:
@@ -257,8 +268,9 @@ class AgentBuffers:
             choice = es.choose_stereotype(self.stereotype, self, item)
             if choice is not None:
                 self.stereotype.remove(choice)
-                self.log(f"Evicted {choice} from {[x.basic() for x in self.stereotype]}")
-                self.agent.sim.metrics.add_evicted_stereotype(self.agent.sim.current_time, self.agent, choice)
+                if self.agent.sim.log_level > 0:
+                    self.log(f"Evicted {choice} from {[x.basic() for x in self.stereotype]}")
+                self.agent.sim.lanes[self.lane].metrics.add_evicted_stereotype(self.agent.sim.current_time, self.agent, choice)
 
                 self.stereotype.append(item)
             else:
@@ -353,3 +365,56 @@ class AgentBuffers:
 
     def log(self, message: str):
         self.agent.log(message)
+
+class UtilitySnapshot:
+    """
+    The contents of an agent's buffers that their utility for a capability depends on.
+
+    Gives the same utility and max_utility as the buffers would have at the time the
+    snapshot was taken, but is much cheaper to take than a frozen copy of the buffers.
+    """
+    __slots__ = ("buffers", "capability", "crypto", "trust", "reputation", "stereotype")
+
+    def __init__(self, buffers: AgentBuffers, capability: Capability):
+        # The maximum utility only depends on the lengths of the buffers, which do not change
+        self.buffers = buffers
+        self.capability = capability
+
+        self.crypto = frozenset(item.agent for item in buffers.crypto)
+
+        # The first trust item about an agent is the one that find_trust would use
+        trust = {}
+        for item in buffers.trust:
+            if item.capability is capability:
+                trust.setdefault(item.agent, item.total_count() > 0)
+        self.trust = frozenset(agent for (agent, used) in trust.items() if used)
+
+        self.reputation = frozenset(
+            trust_item.agent
+            for item in buffers.reputation
+            if any(trust_item.total_count() > 0 for trust_item in item.trust_items)
+            for trust_item in item.trust_items
+            if trust_item.capability is capability
+        )
+
+        self.stereotype = frozenset(item.agent for item in buffers.stereotype if item.capability is capability)
+
+    def utility(self, agent: Agent, capability: Capability, targets: List=None):
+        assert capability is self.capability
+
+        if targets is None:
+            targets = agent.sim.agents
+
+        agents = [
+            a for a in targets
+            if a is not agent and capability in a.capabilities
+        ]
+
+        if not agents:
+            return float("NaN")
+        else:
+            return sum((a in self.crypto) * (1 + (a in self.trust) + (a in self.reputation) + (a in self.stereotype)) * (1.0/4.0)
+                       for a in agents) / len(agents)
+
+    def max_utility(self, agent: Agent, capability: Capability, targets: List=None):
+        return self.buffers.max_utility(agent, capability, targets=targets)
@@ -1,15 +1,16 @@
 from __future__ import annotations
 
 class AgentChooseBehaviour:
-    def choose_agent_for_task(self, agent: Agent, capability: Capability) -> Optional[Agent]:
+    def choose_agent_for_task(self, agent: Agent, capability: Capability, buffers: AgentBuffers, rng: random.Random) -> Optional[CryptoItem]:
+        """Choose the crypto item of the agent to perform a task, using the buffers of one lane"""
         raise NotImplementedError
 
 class RandomAgentChooseBehaviour(AgentChooseBehaviour):
     short_name = "Random"
 
-    def choose_agent_for_task(self, agent: Agent, capability: Capability) -> Optional[Agent]:
+    def choose_agent_for_task(self, agent: Agent, capability: Capability, buffers: AgentBuffers, rng: random.Random) -> Optional[CryptoItem]:
         try:
-            return agent.sim.rng.choice([item for item in agent.buffers.crypto if capability in item.agent.capabilities])
+            return rng.choice([item for item in buffers.crypto if capability in item.agent.capabilities])
         except IndexError:
             return None
 
@@ -48,17 +49,17 @@ class BRSAgentChooseBehaviour(AgentChooseBehaviour):
         except ZeroDivisionError:
             return 0
 
-    def choose_agent_for_task(self, agent: Agent, capability: Capability) -> Optional[Agent]:
-        options = [item for item in agent.buffers.crypto if capability in item.agent.capabilities]
+    def choose_agent_for_task(self, agent: Agent, capability: Capability, buffers: AgentBuffers, rng: random.Random) -> Optional[CryptoItem]:
+        options = [item for item in buffers.crypto if capability in item.agent.capabilities]
         if not options:
             return None
 
         trust_values = {
-            option.agent: self.trust_value(agent.buffers, option.agent, capability) for option in options
+            option.agent: self.trust_value(buffers, option.agent, capability) for option in options
         }
         max_trust_value = max(trust_values.values())
 
         try:
-            return agent.sim.rng.choice([item for item in options if trust_values[item.agent] >= max_trust_value - 0.1])
+            return rng.choice([item for item in options if trust_values[item.agent] >= max_trust_value - 0.1])
         except IndexError:
             return None
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+from typing import List, Sequence
+
+import numpy as np
+
+from simulation.capability_behaviour import CapabilityBehaviour, StateHistory, _first_above, _uniforms
+
+# Below this many samples it is faster to reseed a RandomState for each one
+# than to pay the fixed cost of seeding 400 words of every generator at once
+VECTORISE_THRESHOLD = 1024
+
+def mt19937_uniforms(seeds: np.ndarray) -> tuple:
+    """
+    The first two uniform variates from a RandomState seeded with each of the seeds.
+
+    Only the words of the Mersenne Twister state needed to generate the first four
+    outputs are kept, so this is much cheaper than seeding a generator for each seed.
+    """
+    mt = np.asarray(seeds, dtype=np.uint32)
+
+    # init_genrand, keeping words 0-4 and 397-400
+    key = {0: mt}
+    for i in range(1, 401):
+        mt = np.uint32(1812433253) * (mt ^ (mt >> np.uint32(30))) + np.uint32(i)
+        if i <= 4 or i >= 397:
+            key[i] = mt
+
+    # The twist and tempering of the first four outputs
+    outputs = []
+    for k in range(4):
+        y = (key[k] & np.uint32(0x80000000)) | (key[k+1] & np.uint32(0x7fffffff))
+        v = key[k+397] ^ (y >> np.uint32(1)) ^ np.where(y & np.uint32(1), np.uint32(0x9908b0df), np.uint32(0))
+        v ^= v >> np.uint32(11)
+        v ^= (v << np.uint32(7)) & np.uint32(0x9d2c5680)
+        v ^= (v << np.uint32(15)) & np.uint32(0xefc60000)
+        v ^= v >> np.uint32(18)
+        outputs.append(v)
+
+    # random_sample combines two outputs into each double
+    def double(a, b):
+        return ((a >> np.uint32(5)).astype(np.float64) * 67108864.0 + (b >> np.uint32(6))) / 9007199254740992.0
+
+    return (double(outputs[0], outputs[1]), double(outputs[2], outputs[3]))
+
+class BehaviourStore:
+    """
+    The state of every capability behaviour in the population, held in arrays with
+    one row per behaviour so that many behaviours can be sampled at once.
+
+    Sampling a row gives exactly the same results as the CapabilityBehaviour would
+    on its own. The state history is run-length encoded, with the runs of every row
+    appended to the same arrays, which grow as needed.
+    """
+    def __init__(self, behaviours: Sequence[CapabilityBehaviour]):
+        tables = list(dict.fromkeys(behaviour.table for behaviour in behaviours))
+        table_index = {table: n for (n, table) in enumerate(tables)}
+
+        self.tables = tables
+
+        self.start_cdfs = np.array([table.start_cdf for table in tables])
+        self.transition_cdfs = np.array([table.transition_cdfs for table in tables])
+        self.emission_cdfs = np.array([table.emission_cdfs for table in tables])
+
+        self.table_index = np.array([table_index[behaviour.table] for behaviour in behaviours], dtype=np.uint16)
+        self.individual_seed = np.array([behaviour.individual_seed for behaviour in behaviours], dtype=np.uint32)
+
+        # Sampling a single row is faster using plain Python objects
+        self._row_tables = [behaviour.table for behaviour in behaviours]
+        self._row_seeds = self.individual_seed.tolist()
+
+        # The index of the state each behaviour is in, or -1 before the first interaction
+        self.state = np.full(len(behaviours), -1, dtype=np.int8)
+
+        # The run each row is currently in, or -1 before the first interaction
+        self.current_run = np.full(len(behaviours), -1, dtype=np.intp)
+
+        self.num_runs = 0
+        self.run_row = np.empty(1024, dtype=np.uint32)
+        self.run_first_t = np.empty(1024, dtype=np.float64)
+        self.run_last_t = np.empty(1024, dtype=np.float64)
+        self.run_state = np.empty(1024, dtype=np.int8)
+        self.run_count = np.empty(1024, dtype=np.uint32)
+
+        # The runs sorted by row, rebuilt when runs have been added since it was last needed
+        self._run_order = None
+
+        for (row, behaviour) in enumerate(behaviours):
+            behaviour.attach(self, row)
+
+    def __len__(self) -> int:
+        return len(self.state)
+
+    def _reserve_runs(self, count: int) -> int:
+        """Make space for count more runs, returning the index of the first"""
+        start = self.num_runs
+        end = start + count
+
+        if end > len(self.run_row):
+            capacity = max(end, 2 * len(self.run_row))
+            for name in ("run_row", "run_first_t", "run_last_t", "run_state", "run_count"):
+                array = getattr(self, name)
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:start] = array[:start]
+                setattr(self, name, grown)
+
+        self.num_runs = end
+        self._run_order = None
+
+        return start
+
+    def add_run(self, row: int, first_t: float, last_t: float, state: int, count: int):
+        n = self._reserve_runs(1)
+
+        self.run_row[n] = row
+        self.run_first_t[n] = first_t
+        self.run_last_t[n] = last_t
+        self.run_state[n] = state
+        self.run_count[n] = count
+
+        self.current_run[row] = n
+
+    def _record_one(self, row: int, t: float, state: int):
+        n = self.current_run.item(row)
+
+        if n >= 0 and self.run_state.item(n) == state:
+            self.run_last_t[n] = t
+            self.run_count[n] += 1
+        else:
+            self.add_run(row, t, t, state, 1)
+
+    def _record(self, rows: np.ndarray, t: float, states: np.ndarray):
+        runs = self.current_run[rows]
+
+        # The rows are distinct, so are the runs they are in
+        same = (runs >= 0) & (self.run_state[np.maximum(runs, 0)] == states)
+        self.run_last_t[runs[same]] = t
+        self.run_count[runs[same]] += 1
+
+        new = ~same
+        count = int(new.sum())
+        start = self._reserve_runs(count)
+        end = start + count
+
+        self.run_row[start:end] = rows[new]
+        self.run_first_t[start:end] = t
+        self.run_last_t[start:end] = t
+        self.run_state[start:end] = states[new]
+        self.run_count[start:end] = 1
+
+        self.current_run[rows[new]] = np.arange(start, end)
+
+    def _sample_one(self, row: int, seed: int) -> tuple:
+        (u_state, u_observation) = _uniforms(seed ^ self._row_seeds[row])
+
+        table = self._row_tables[row]
+        state = self.state.item(row)
+
+        cdf = table.start_cdf if state < 0 else table.transition_cdfs[state]
+        state = _first_above(cdf, u_state)
+
+        observation = _first_above(table.emission_cdfs[state], u_observation)
+
+        return (state, observation)
+
+    def _sample(self, rows: np.ndarray, seeds: np.ndarray) -> tuple:
+        (u_state, u_observation) = mt19937_uniforms(seeds ^ self.individual_seed[rows])
+
+        tables = self.table_index[rows]
+        current = self.state[rows]
+
+        cdfs = np.where((current < 0)[:, None],
+                        self.start_cdfs[tables],
+                        self.transition_cdfs[tables, np.maximum(current, 0)])
+        # argmax is 0 when nothing is above u, the same as _first_above
+        states = (cdfs > u_state[:, None]).argmax(axis=1)
+
+        observations = (self.emission_cdfs[tables, states] > u_observation[:, None]).argmax(axis=1)
+
+        return (states.astype(np.int8), observations.astype(np.int8))
+
+    def peek(self, rows: Sequence[int], seeds) -> List[int]:
+        """
+        The indexes of the observations the behaviours at rows would make, without changing their state.
+        seeds is either one seed for every row or a seed for each row.
+        """
+        if len(rows) < VECTORISE_THRESHOLD:
+            if isinstance(seeds, int):
+                return [self.peek_one(row, seeds) for row in rows]
+            return [self.peek_one(row, seed) for (row, seed) in zip(rows, seeds)]
+
+        rows = np.asarray(rows, dtype=np.intp)
+        seeds = np.broadcast_to(np.asarray(seeds, dtype=np.uint32), rows.shape)
+
+        (states, observations) = self._sample(rows, seeds)
+
+        return observations.tolist()
+
+    def step(self, rows: Sequence[int], seeds, t: float) -> List[int]:
+        """Perform an interaction at time t with each of the behaviours at rows, returning the indexes of the observations"""
+        if len(set(rows)) != len(rows):
+            raise ValueError("Each behaviour can only be stepped once at a time")
+
+        if len(rows) < VECTORISE_THRESHOLD:
+            if isinstance(seeds, int):
+                return [self.step_one(row, seeds, t) for row in rows]
+            return [self.step_one(row, seed, t) for (row, seed) in zip(rows, seeds)]
+
+        rows = np.asarray(rows, dtype=np.intp)
+        seeds = np.broadcast_to(np.asarray(seeds, dtype=np.uint32), rows.shape)
+
+        (states, observations) = self._sample(rows, seeds)
+
+        self.state[rows] = states
+        self._record(rows, t, states)
+
+        return observations.tolist()
+
+    def peek_one(self, row: int, seed: int) -> int:
+        (state, observation) = self._sample_one(row, seed)
+        return observation
+
+    def step_one(self, row: int, seed: int, t: float) -> int:
+        (state, observation) = self._sample_one(row, seed)
+
+        self.state[row] = state
+        self._record_one(row, t, state)
+
+        return observation
+
+    def history(self, row: int) -> StateHistory:
+        """The runs of states the behaviour at row has been in"""
+        if self._run_order is None:
+            # Runs are added in time order, which a stable sort keeps for each row
+            order = np.argsort(self.run_row[:self.num_runs], kind="stable")
+            offsets = np.searchsorted(self.run_row[order], np.arange(len(self) + 1))
+            self._run_order = (order, offsets)
+
+        (order, offsets) = self._run_order
+        runs = order[offsets[row]:offsets[row+1]]
+
+        return StateHistory(self.run_first_t[runs], self.run_last_t[runs], self.run_state[runs], self.run_count[runs])
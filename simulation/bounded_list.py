@@ -1,53 +1,141 @@
+class BoundExceedError(RuntimeError):
+    pass
 
-from frozenlist import FrozenList
+class BoundedList:
+    """
+    A list that holds at most length items, or any number when length is falsy.
 
-# from: https://stackoverflow.com/questions/17526659/how-to-set-a-max-length-for-a-python-list-set
+    Items are kept in slots that never move and the slots of removed items are reused,
+    so removing an item, either by the handle that append returns or by the item itself,
+    does not need to search or shift the other items. Iterating gives the items in the
+    order they were appended, the same as a list that had the items removed from it.
 
-class BoundExceedError(RuntimeError):
-    pass
+    Items are compared by identity and can only be in the list once.
+    Once frozen the list cannot be modified.
+    """
+    def __init__(self, items=(), length: int=None):
+        self.length = length
+        self.frozen = False
 
-class BoundedList(FrozenList):
-    def __init__(self, *args, **kwargs):
-        self.length = kwargs.pop('length', None)
-        super().__init__(*args, **kwargs)
+        # Item in each slot, or None if the slot is free
+        self._slots = []
+        self._free = []
 
-    def _check_item_bound(self):
-        if self.length and len(self) >= self.length:
-            raise BoundExceedError()
+        # The occupied slots in the order they were filled
+        self._order = {}
+
+        # id of each item to its slot
+        self._slot_of = {}
+
+        # The items in order, which is much faster to iterate over than the slots
+        # and is only rebuilt when the list has changed since it was last needed
+        self._view = None
+
+        self.extend(items)
+
+    def _check_mutable(self):
+        if self.frozen:
+            raise RuntimeError("Cannot modify frozen list.")
 
-    def _check_list_bound(self, L):
-        if self.length and len(self) + len(L) > self.length:
+    def append(self, x) -> int:
+        """Add x to the end of the list, returning its handle"""
+        self._check_mutable()
+
+        if self.length and len(self._order) >= self.length:
             raise BoundExceedError()
 
-    def append(self, x):
-        self._check_item_bound()
-        return super().append(x)
+        if id(x) in self._slot_of:
+            raise ValueError(f"{x!r} is already in the list")
+
+        if self._free:
+            slot = self._free.pop()
+            self._slots[slot] = x
+        else:
+            slot = len(self._slots)
+            self._slots.append(x)
+
+        self._order[slot] = None
+        self._slot_of[id(x)] = slot
+        self._view = None
+
+        return slot
 
     def extend(self, L):
-        self._check_list_bound(L)
-        return super().extend(L)
-
-    def insert(self, i, x):
-        self._check_item_bound()
-        return super().insert(i, x)
-
-    def __add__(self, L):
-        self._check_list_bound(L)
-        return super().__add__(L)
-
-    def __iadd__(self, L):
-        self._check_list_bound(L)
-        return super().__iadd__(L)
-
-    def __setslice__(self, *args, **kwargs):
-        if len(args) > 2 and self.length:
-            left, right, L = args[0], args[1], args[2]
-            if right > self.length:
-                if left + len(L) > self.length:
-                    raise BoundExceedError()
-            else:
-                len_del = (right - left)
-                len_add = len(L)
-                if len(self) - len_del + len_add > self.length:
-                    raise BoundExceedError()
-        return super().__setslice__(*args, **kwargs)
+        L = list(L)
+
+        if self.length and len(self._order) + len(L) > self.length:
+            raise BoundExceedError()
+
+        for x in L:
+            self.append(x)
+
+    def handle(self, x) -> int:
+        try:
+            return self._slot_of[id(x)]
+        except KeyError:
+            raise ValueError(f"{x!r} is not in the list")
+
+    def get(self, handle: int):
+        if handle not in self._order:
+            raise KeyError(handle)
+
+        return self._slots[handle]
+
+    def remove_handle(self, handle: int):
+        self._check_mutable()
+
+        x = self.get(handle)
+
+        del self._order[handle]
+        del self._slot_of[id(x)]
+
+        self._slots[handle] = None
+        self._free.append(handle)
+        self._view = None
+
+    def remove(self, x):
+        self.remove_handle(self.handle(x))
+
+    def freeze(self):
+        self.frozen = True
+
+    def view(self) -> tuple:
+        """A read-only snapshot of the items, in order"""
+        view = self._view
+        if view is None:
+            view = self._view = tuple(map(self._slots.__getitem__, self._order))
+        return view
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __contains__(self, x) -> bool:
+        return id(x) in self._slot_of
+
+    def __getitem__(self, index):
+        # Indexing by position needs to find the position, use get with a handle instead where possible
+        return self.view()[index]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, BoundedList):
+            other = other.view()
+        try:
+            return self.view() == tuple(other)
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"<BoundedList(frozen={self.frozen}, length={self.length}, {list(self)!r})>"
+
+    def __getstate__(self):
+        # The slots are keyed by id, so need to be rebuilt for a copy
+        return {"length": self.length, "frozen": self.frozen, "items": list(self)}
+
+    def __setstate__(self, state):
+        self.__init__(state["items"], length=state["length"])
+        self.frozen = state["frozen"]
@@ -2,7 +2,6 @@ from __future__ import annotations
 
 from enum import Enum
 
-from hmmlearn.hmm import CategoricalHMM
 import numpy as np
 
 class CapabilityBehaviourState(Enum):
@@ -13,14 +12,141 @@ class InteractionObservation(Enum):
     Correct = 1
     Incorrect = 2
 
+class BehaviourTable:
+    """
+    The parameters of the hidden Markov model of a behaviour. They never change,
+    so one table is shared by every capability with the same behaviour.
+    """
+    def __init__(self, startprob: list, transmat: list, emissionprob: list):
+        self.startprob = np.array(startprob)
+        self.transmat = np.array(transmat)
+        self.emissionprob = np.array(emissionprob)
+
+        for array in (self.startprob, self.transmat, self.emissionprob):
+            array.setflags(write=False)
+
+        num_states = len(CapabilityBehaviourState)
+        num_observations = len(InteractionObservation)
+
+        if self.startprob.shape != (num_states,) or not np.allclose(self.startprob.sum(), 1.0):
+            raise ValueError(f"startprob must be {num_states} probabilities that sum to 1, got {self.startprob}")
+        if self.transmat.shape != (num_states, num_states) or not np.allclose(self.transmat.sum(axis=1), 1.0):
+            raise ValueError(f"Each row of transmat must be {num_states} probabilities that sum to 1, got {self.transmat}")
+        if self.emissionprob.shape != (num_states, num_observations) or not np.allclose(self.emissionprob.sum(axis=1), 1.0):
+            raise ValueError(f"Each row of emissionprob must be {num_observations} probabilities that sum to 1, got {self.emissionprob}")
+
+        # The cumulative distributions, as plain floats as they are faster to compare one at a time
+        self.start_cdf = tuple(np.cumsum(self.startprob).tolist())
+        self.transition_cdfs = tuple(tuple(row) for row in np.cumsum(self.transmat, axis=1).tolist())
+        self.emission_cdfs = tuple(tuple(row) for row in np.cumsum(self.emissionprob, axis=1).tolist())
+
+class StateHistory:
+    """
+    The state of a behaviour at each interaction, run-length encoded as the first and last
+    time, state and number of interactions of each run of interactions in the same state.
+
+    Iterating gives the (t, CapabilityBehaviourState) at the start and end of each run,
+    the times of the interactions in the middle of a run are not kept.
+    """
+    def __init__(self, first_t=(), last_t=(), state=(), count=()):
+        self.first_t = np.array(first_t, dtype=np.float64)
+        self.last_t = np.array(last_t, dtype=np.float64)
+        self.state = np.array(state, dtype=np.int8)
+        self.count = np.array(count, dtype=np.uint32)
+
+        # The arrays have spare capacity past the number of runs
+        self.length = len(self.state)
+
+    def append(self, t: float, state: int):
+        n = self.length
+
+        if n > 0 and self.state[n-1] == state:
+            self.last_t[n-1] = t
+            self.count[n-1] += 1
+            return
+
+        if n == len(self.state):
+            capacity = max(4, 2 * n)
+            for name in ("first_t", "last_t", "state", "count"):
+                array = getattr(self, name)
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:n] = array[:n]
+                setattr(self, name, grown)
+
+        self.first_t[n] = t
+        self.last_t[n] = t
+        self.state[n] = state
+        self.count[n] = 1
+        self.length = n + 1
+
+    def runs(self):
+        """The (first t, last t, state index, count) of each run"""
+        n = self.length
+        return zip(self.first_t[:n].tolist(), self.last_t[:n].tolist(), self.state[:n].tolist(), self.count[:n].tolist())
+
+    def interactions(self) -> int:
+        return int(self.count[:self.length].sum())
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self):
+        states = CapabilityBehaviour.states
+        for (first_t, last_t, state, count) in self.runs():
+            yield (first_t, states[state])
+            if count > 1:
+                yield (last_t, states[state])
+
+    def __getstate__(self):
+        # Do not save the spare capacity
+        n = self.length
+        return {
+            "first_t": self.first_t[:n].copy(),
+            "last_t": self.last_t[:n].copy(),
+            "state": self.state[:n].copy(),
+            "count": self.count[:n].copy(),
+            "length": n,
+        }
+
+def _first_above(cdf: tuple, u: float) -> int:
+    # The same as (np.array(cdf) > u).argmax(), which is 0 when nothing is above u
+    for (n, c) in enumerate(cdf):
+        if c > u:
+            return n
+    return 0
+
+# Reseeded for every sample rather than creating a new RandomState each time
+_random_state = np.random.RandomState()
+
+def _uniforms(seed: int) -> list:
+    """The first two uniform variates from a RandomState seeded with seed"""
+    _random_state.seed(seed)
+    return _random_state.random_sample(2).tolist()
+
 class CapabilityBehaviour:
-    def __init__(self):
-        self.states = list(CapabilityBehaviourState)
-        self.observations = list(InteractionObservation)
+    """
+    The behaviour of one agent's capability.
+
+    The samples are the same as the single samples that hmmlearn's CategoricalHMM.sample
+    would draw with random_state set to the seed, where the start probabilities are
+    replaced by the transitions from the current state after each interaction.
+    Only the current state and seed are kept per capability, the model is in the table.
 
-        self.hmm = CategoricalHMM(n_components=len(self.states))
+    Once attached to a BehaviourStore, the state and its history are kept in the store instead.
+    """
+    __slots__ = ("state", "state_history", "individual_seed", "store", "row")
 
-        self.state_history = []
+    states = list(CapabilityBehaviourState)
+    observations = list(InteractionObservation)
+
+    table: BehaviourTable = None
+
+    def __init__(self):
+        # The index of the state the model is in, or None before the first interaction
+        self.state = None
+
+        # Created by the first interaction, as most behaviours are attached to a store before then
+        self.state_history = None
 
         # When many similar capabilities are being used, it is quite often
         # the case that they will be in the same state. This means agent
@@ -31,33 +157,62 @@ class CapabilityBehaviour:
         # different initial seed to mix with the seed provided for an interaction.
         self.individual_seed = 0
 
-    def next_interaction(self, seed: int, t: float):
-        (x, state_sequence) = self.hmm.sample(1, random_state=seed ^ self.individual_seed)
+        self.store = None
+        self.row = None
+
+    def attach(self, store: BehaviourStore, row: int):
+        """Move the state of this behaviour to the row of the store"""
+        if self.state is not None:
+            store.state[row] = self.state
+        if self.state_history is not None:
+            for run in self.state_history.runs():
+                store.add_run(row, *run)
+
+        self.store = store
+        self.row = row
+        self.state = None
+        self.state_history = None
+
+    def history(self) -> StateHistory:
+        """The runs of states this behaviour has been in"""
+        if self.store is not None:
+            return self.store.history(self.row)
+        return self.state_history if self.state_history is not None else StateHistory()
 
-        assert len(state_sequence) == 1
-        assert len(x) == 1
-        assert len(x[0]) == 1
+    def _sample(self, seed: int) -> tuple:
+        (u_state, u_observation) = _uniforms(seed ^ self.individual_seed)
 
-        chosen_state = np.array([
-            1 if state_sequence[0] == n else 0
-            for n in range(len(self.states))
-        ])
+        table = self.table
+
+        cdf = table.start_cdf if self.state is None else table.transition_cdfs[self.state]
+        state = _first_above(cdf, u_state)
+
+        observation = _first_above(table.emission_cdfs[state], u_observation)
+
+        return (state, observation)
+
+    def next_interaction(self, seed: int, t: float):
+        if self.store is not None:
+            return self.observations[self.store.step_one(self.row, seed, t)]
+
+        (state, observation) = self._sample(seed)
 
         # Update the state of where the HMM is
-        self.hmm.startprob_ = chosen_state @ self.hmm.transmat_
+        self.state = state
 
-        self.state_history.append((t, self.states[state_sequence[0]]))
+        if self.state_history is None:
+            self.state_history = StateHistory()
+        self.state_history.append(t, state)
 
-        return self.observations[x[0][0]]
+        return self.observations[observation]
 
     def peek_interaction(self, seed: int):
-        (x, state_sequence) = self.hmm.sample(1, random_state=seed ^ self.individual_seed)
+        if self.store is not None:
+            return self.observations[self.store.peek_one(self.row, seed)]
 
-        assert len(state_sequence) == 1
-        assert len(x) == 1
-        assert len(x[0]) == 1
+        (state, observation) = self._sample(seed)
 
-        return self.observations[x[0][0]]
+        return self.observations[observation]
 
 """
 Numpy is row-major
@@ -79,22 +234,21 @@ The observation behaviour is: A : CapabilityBehaviourState x InteractionObservat
 """
 
 class AlwaysGoodBehaviour(CapabilityBehaviour):
-    brs_stereotype = (20, 0)
+    __slots__ = ()
 
-    def __init__(self):
-        super().__init__()
-
-        self.hmm.startprob_ = np.array([1, 0])
+    brs_stereotype = (20, 0)
 
-        self.hmm.transmat_ = np.array([
+    table = BehaviourTable(
+        startprob=[1, 0],
+        transmat=[
             [1, 0],
             [0, 1]
-        ])
-
-        self.hmm.emissionprob_ = np.array([
+        ],
+        emissionprob=[
             [1, 0],
             [0, 1]
-        ])
+        ],
+    )
 
     def next_interaction(self, seed: int, t: float):
         result = super().next_interaction(seed, t)
@@ -107,22 +261,21 @@ class AlwaysGoodBehaviour(CapabilityBehaviour):
         return result
 
 class AlwaysBadBehaviour(CapabilityBehaviour):
-    brs_stereotype = (0, 20)
-
-    def __init__(self):
-        super().__init__()
+    __slots__ = ()
 
-        self.hmm.startprob_ = np.array([0, 1])
+    brs_stereotype = (0, 20)
 
-        self.hmm.transmat_ = np.array([
+    table = BehaviourTable(
+        startprob=[0, 1],
+        transmat=[
             [1, 0],
             [0, 1]
-        ])
-
-        self.hmm.emissionprob_ = np.array([
+        ],
+        emissionprob=[
             [1, 0],
             [0, 1]
-        ])
+        ],
+    )
 
     def next_interaction(self, seed: int, t: float):
         result = super().next_interaction(seed, t)
@@ -135,55 +288,52 @@ class AlwaysBadBehaviour(CapabilityBehaviour):
         return result
 
 class VeryGoodBehaviour(CapabilityBehaviour):
-    brs_stereotype = (19, 1)
-
-    def __init__(self):
-        super().__init__()
+    __slots__ = ()
 
-        self.hmm.startprob_ = np.array([0.99, 0.01])
+    brs_stereotype = (19, 1)
 
-        self.hmm.transmat_ = np.array([
+    table = BehaviourTable(
+        startprob=[0.99, 0.01],
+        transmat=[
             [0.99, 0.01],
             [0.80, 0.20]
-        ])
-
-        self.hmm.emissionprob_ = np.array([
+        ],
+        emissionprob=[
             [0.99, 0.01],
             [0, 1]
-        ])
+        ],
+    )
 
 class GoodBehaviour(CapabilityBehaviour):
-    brs_stereotype = (15, 5)
-
-    def __init__(self):
-        super().__init__()
+    __slots__ = ()
 
-        self.hmm.startprob_ = np.array([0.9, 0.1])
+    brs_stereotype = (15, 5)
 
-        self.hmm.transmat_ = np.array([
+    table = BehaviourTable(
+        startprob=[0.9, 0.1],
+        transmat=[
             [0.9, 0.1],
             [0.6, 0.4]
-        ])
-
-        self.hmm.emissionprob_ = np.array([
+        ],
+        emissionprob=[
             [0.9, 0.1],
             [0, 1]
-        ])
+        ],
+    )
 
 class UnstableBehaviour(CapabilityBehaviour):
-    brs_stereotype = (10, 10)
-
-    def __init__(self):
-        super().__init__()
+    __slots__ = ()
 
-        self.hmm.startprob_ = np.array([0.5, 0.5])
+    brs_stereotype = (10, 10)
 
-        self.hmm.transmat_ = np.array([
+    table = BehaviourTable(
+        startprob=[0.5, 0.5],
+        transmat=[
             [0.5, 0.5],
             [0.5, 0.5]
-        ])
-
-        self.hmm.emissionprob_ = np.array([
+        ],
+        emissionprob=[
             [0.9, 0.1],
             [0, 1]
-        ])
+        ],
+    )
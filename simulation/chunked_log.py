@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from typing import List, Tuple
+
+import numpy as np
+
+class ChunkedLog:
+    """
+    An append only log of rows with typed columns.
+
+    Rows are written into fixed size numpy chunks, so appending never copies
+    the rows already logged, and each row takes only the size of its columns.
+    """
+    def __init__(self, fields: List[Tuple[str, str]], chunk_size: int=4096):
+        self.dtype = np.dtype(fields)
+        self.chunk_size = chunk_size
+
+        self._chunks = [np.empty(0, dtype=self.dtype)]
+        self._fill = 0
+        self._length = 0
+
+        # The rows in one array, rebuilt when rows have been appended since it was last needed
+        self._array = None
+
+    def append(self, *row):
+        chunk = self._chunks[-1]
+        if self._fill == len(chunk):
+            chunk = np.empty(self.chunk_size, dtype=self.dtype)
+            self._chunks.append(chunk)
+            self._fill = 0
+
+        chunk[self._fill] = row
+        self._fill += 1
+        self._length += 1
+        self._array = None
+
+    def _filled_chunks(self) -> List[np.ndarray]:
+        return self._chunks[:-1] + [self._chunks[-1][:self._fill]]
+
+    def array(self) -> np.ndarray:
+        """All of the rows as a read-only structured array"""
+        if self._array is None:
+            chunks = self._filled_chunks()
+            self._array = np.concatenate(chunks) if len(chunks) > 1 else chunks[0].copy()
+            self._array.setflags(write=False)
+
+        return self._array
+
+    def column(self, name: str) -> np.ndarray:
+        return self.array()[name]
+
+    def remap(self, name: str, mapping: np.ndarray):
+        """Replace each non-negative value v in the column with mapping[v]"""
+        for chunk in self._filled_chunks():
+            values = chunk[name]
+            valid = values >= 0
+            values[valid] = mapping[values[valid]]
+
+        self._array = None
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self):
+        return iter(self.array().tolist())
+
+    def __getstate__(self):
+        return {"dtype": self.dtype, "chunk_size": self.chunk_size, "rows": self.array()}
+
+    def __setstate__(self, state):
+        self.dtype = state["dtype"]
+        self.chunk_size = state["chunk_size"]
+
+        rows = state["rows"].copy()
+        self._chunks = [rows]
+        self._fill = len(rows)
+        self._length = len(rows)
+        self._array = None
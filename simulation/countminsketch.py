@@ -29,3 +29,17 @@ class CountMinSketch(object):
 
     def get_matrix(self):
         return self.M
+
+    def __getstate__(self):
+        # The matrix is large and mostly empty, so only store the non-zero counts
+        state = self.__dict__.copy()
+        (rows, columns) = np.nonzero(self.M)
+        state["M"] = (self.M.shape, self.M.dtype, rows, columns, self.M[rows, columns])
+        return state
+
+    def __setstate__(self, state):
+        (shape, dtype, rows, columns, values) = state["M"]
+        M = np.zeros(shape, dtype=dtype)
+        M[rows, columns] = values
+        state["M"] = M
+        self.__dict__.update(state)
@@ -4,7 +4,7 @@ from dataclasses import dataclass
 from functools import total_ordering
 
 from simulation.constants import EPSILON
-from simulation.capability_behaviour import InteractionObservation
+from simulation.capability_behaviour import CapabilityBehaviour, InteractionObservation
 from simulation.utility_targets import UtilityTargets
 
 @total_ordering
@@ -49,12 +49,17 @@ class AgentCapabilityTask(BaseEvent):
     def action(self, sim: Simulation):
         super().action(sim)
 
-        sim.metrics.add_interaction_performed(self.event_time, self.agent, self.capability)
+        for lane in sim.lanes:
+            lane.metrics.add_interaction_performed(self.event_time, self.agent, self.capability)
 
-        selected_agent = self.agent.choose_agent_for_task(self.capability)
+        # The agent chosen by each lane
+        selected_agents = self.agent.choose_agent_for_task(self.capability)
 
-        if selected_agent is not None:
-            self.agent.perform_interaction(selected_agent, self.capability)
+        if sim.trace is not None:
+            sim.trace.task(self.event_time, self.agent, self.capability, selected_agents[0])
+
+        if any(selected_agent is not None for selected_agent in selected_agents):
+            self.agent.perform_interaction(selected_agents, self.capability)
         else:
             self.log(sim, "Unable to select agent to perform task")
 
@@ -65,67 +70,128 @@ class AgentCapabilityTask(BaseEvent):
         return f"{type(self).__name__}({self.agent!s}, {self.capability!s})"
 
 class AgentTaskInteraction(BaseEvent):
-    def __init__(self, event_time: float, source: Agent, capability: Capability, target: Agent, buffers: AgentBuffers):
+    def __init__(self, event_time: float, source: Agent, capability: Capability, targets: List[Optional[Agent]], buffers: List[AgentBuffers]):
         super().__init__(event_time)
         self.source = source
         self.capability = capability
-        self.target = target
+        # The agent each lane chose, or None if it could not choose one
+        self.targets = targets
+        # The source's buffers in each lane
         self.buffers = buffers
 
-    def _ensure_crypto_exists(self, sim: Simulation, agent: Agent, other: Agent):
-        crypto = agent.buffers.find_crypto(other)
+    @property
+    def target(self) -> Optional[Agent]:
+        """The agent chosen by the first lane, which is the one that performs the interaction"""
+        return self.targets[0]
+
+    def _ensure_crypto_exists(self, sim: Simulation, lane: Lane, agent: Agent, other: Agent):
+        buffers = agent.lane_buffers[lane.index]
+
+        crypto = buffers.find_crypto(other)
         if crypto is None:
-            agent.receive_crypto_information(other)
-            crypto = agent.buffers.find_crypto(other)
+            agent.receive_crypto_information(other, lane)
+            crypto = buffers.find_crypto(other)
         if crypto is not None:
-            sim.es.use_crypto(crypto)
+            lane.es.use_crypto(crypto)
         return crypto is not None
 
+    def exchange_crypto(self, sim: Simulation):
+        # Source needs target's crypto information to process response
+        our_crypto = [
+            target is not None and self._ensure_crypto_exists(sim, lane, self.source, target)
+            for (lane, target) in zip(sim.lanes, self.targets)
+        ]
+
+        # Target also needs sources's crypto information to process response
+        their_crypto = [
+            target is not None and self._ensure_crypto_exists(sim, lane, target, self.source)
+            for (lane, target) in zip(sim.lanes, self.targets)
+        ]
+
+        return (our_crypto, their_crypto)
+
     def action(self, sim: Simulation):
         super().action(sim)
 
-        # Source needs target's crypto information to process response
-        our_crypto = self._ensure_crypto_exists(sim, self.source, self.target)
-        assert our_crypto
+        (our_crypto, their_crypto) = self.exchange_crypto(sim)
 
-        # Target also needs sources's crypto information to process response
-        their_crypto = self._ensure_crypto_exists(sim, self.target, self.source)
+        # The first lane has the keys of the agent it chose
+        assert self.target is None or our_crypto[0]
 
-        # Want to use the same seed for the interaction that does occur and the potential interactions
-        seed = sim.rng.getrandbits(32)
+        # Want to use the same seed for the interaction that does occur and the potential interactions.
+        # If the first lane did not choose an agent, it would not have drawn a seed on its own.
+        if self.target is not None:
+            seed = sim.rng.getrandbits(32)
+        else:
+            seed = next(lane.rng for (lane, target) in zip(sim.lanes, self.targets) if target is not None).getrandbits(32)
 
         # Did the target perform the interaction well?
-        outcome = self.target.capability_behaviour[self.capability].next_interaction(seed, sim.current_time)
+        # Only the first lane's interaction changes the state of the behaviour.
+        actual_outcome = None
+        if self.target is not None:
+            actual_outcome = self.target.capability_behaviour[self.capability].next_interaction(seed, sim.current_time)
+
+        # How would the source's other neighbours, and the agents other lanes chose, have performed?
+        others = [agent for agent in sim.topology.neighbours(self.source) if agent is not self.target]
+        for target in self.targets[1:]:
+            if target is not None and target is not self.target and target not in others:
+                others.append(target)
+        observations = sim.behaviours.peek([agent.capability_behaviour[self.capability].row for agent in others], seed)
+        potential_outcomes = {
+            agent: CapabilityBehaviour.observations[observation]
+            for (agent, observation) in zip(others, observations)
+        }
 
-        # Override interaction result if the target doesn't have our keys
-        if not their_crypto:
-            outcome = InteractionObservation.Incorrect
+        if sim.trace is not None and self.target is not None:
+            sim.trace.interaction(sim.current_time, self.source, self.capability, self.target, actual_outcome, potential_outcomes)
 
-        # How would the other capabilities have performed?
-        outcomes = {
-            agent: agent.capability_behaviour[self.capability].peek_interaction(seed) if agent is not self.target else outcome
-            for agent in sim.agents
-            if agent is not self.source
-        }
-        self.log(sim, f"Outcomes|{outcomes}")
+        self.evaluate(sim, our_crypto, their_crypto, actual_outcome, potential_outcomes)
 
-        # Who are we interested in evaluating the utility of the buffers for?
-        if sim.utility_targets == UtilityTargets.All:
-            utility_targets = outcomes.keys()
-        elif sim.utility_targets == UtilityTargets.Good:
-            utility_targets = [a for (a, o) in outcomes.items() if o == InteractionObservation.Correct]
-        else:
-            raise NotImplementedError()
+    def evaluate(self, sim: Simulation, our_crypto: List[bool], their_crypto: List[bool],
+                 actual_outcome: Optional[InteractionObservation], potential_outcomes: Dict[Agent, InteractionObservation]):
+        neighbours = sim.topology.neighbours(self.source)
+
+        # The outcome of every agent, whichever lane chose them
+        all_outcomes = dict(potential_outcomes)
+        if self.target is not None:
+            all_outcomes[self.target] = actual_outcome
+
+        for (lane, target) in zip(sim.lanes, self.targets):
+            # This lane did not choose an agent to perform the task
+            if target is None:
+                continue
+
+            outcome = all_outcomes[target]
+
+            # Override interaction result if either side doesn't have the other's keys
+            if not our_crypto[lane.index] or not their_crypto[lane.index]:
+                outcome = InteractionObservation.Incorrect
 
-        utility = self.buffers.utility(self.source, self.capability, targets=utility_targets)
-        max_utility = self.buffers.max_utility(self.source, self.capability, targets=utility_targets)
-        self.log(sim, f"Value of buffers {utility} (max={max_utility}) {self.capability}")
+            outcomes = {
+                agent: all_outcomes[agent] if agent is not target else outcome
+                for agent in neighbours
+            }
+            self.log(sim, f"Outcomes|{outcomes}")
 
-        sim.metrics.add_buffer_evaluation(sim.current_time, self.source, self.capability, outcomes,
-                                          self.buffers.basic(), utility, max_utility, self.target, outcome)
+            # Who are we interested in evaluating the utility of the buffers for?
+            if sim.utility_targets == UtilityTargets.All:
+                utility_targets = outcomes.keys()
+            elif sim.utility_targets == UtilityTargets.Good:
+                utility_targets = [a for (a, o) in outcomes.items() if o == InteractionObservation.Correct]
+            else:
+                raise NotImplementedError()
 
-        # Update source's interaction history
-        self.source.update_trust_history(self.target, self.capability, outcome)
+            buffers = self.buffers[lane.index]
+
+            utility = buffers.utility(self.source, self.capability, targets=utility_targets)
+            max_utility = buffers.max_utility(self.source, self.capability, targets=utility_targets)
+            self.log(sim, f"Value of buffers {utility} (max={max_utility}) {self.capability}")
+
+            lane.metrics.add_buffer_evaluation(sim.current_time, self.source, self.capability, outcomes,
+                                               buffers.basic(), utility, max_utility, target, outcome)
+
+            # Update source's interaction history
+            self.source.update_trust_history(target, self.capability, outcome, lane)
 
     def __repr__(self):
         return f"{type(self).__name__}(src={self.source!s}, cap={self.capability!s}, target={self.target!s})"
@@ -138,42 +204,53 @@ class AgentTrustDissemination(BaseEvent):
     def action(self, sim: Simulation):
         super().action(sim)
 
-        # Process trust reception at other agents
-        for agent in sim.agents:
-            if agent is not self.agent:
-                agent.receive_trust_information(self.agent)
+        if sim.trace is not None:
+            sim.trace.dissemination(self.event_time, self.agent)
+
+        self.disseminate(sim)
 
         # Re-add this event
         sim.add_event(AgentTrustDissemination(self.event_time + self.agent.next_trust_dissemination_period(sim.rng), self.agent))
 
+    def disseminate(self, sim: Simulation):
+        # Process trust reception at neighbouring agents
+        for agent in sim.topology.neighbours(self.agent):
+            agent.receive_trust_information(self.agent)
+
     def __repr__(self):
         return f"{type(self).__name__}({self.agent!s})"
 
 class AgentCryptoRequest(BaseEvent):
-    def __init__(self, event_time: float, requester: Agent, agent: Agent):
+    def __init__(self, event_time: float, requester: Agent, agent: Agent, lanes: List[Lane]):
         super().__init__(event_time)
         self.requester = requester
         self.agent = agent
+        # The lanes in which the requester is missing this information
+        self.lanes = lanes
 
     def action(self, sim: Simulation):
         super().action(sim)
 
-        self.requester.receive_crypto_information(self.agent)
+        for lane in self.lanes:
+            self.requester.receive_crypto_information(self.agent, lane)
 
     def __repr__(self):
         return f"{type(self).__name__}(req={self.requester!s}, of={self.agent!s})"
 
 class AgentStereotypeRequest(BaseEvent):
-    def __init__(self, event_time: float, requester: Agent, agent: Agent):
+    def __init__(self, event_time: float, requester: Agent, agent: Agent, lanes: List[Lane]):
         super().__init__(event_time)
         self.requester = requester
         self.agent = agent
+        # The lanes in which the requester is missing this information
+        self.lanes = lanes
 
     def action(self, sim: Simulation):
         super().action(sim)
 
         for capability in self.agent.capabilities:
-            self.requester.receive_stereotype_information(self.agent, capability)
+            for lane in self.lanes:
+                self.requester.receive_stereotype_information(self.agent, capability, lane)
 
     def __repr__(self):
         return f"{type(self).__name__}(req={self.requester!s}, of={self.agent!s})"
@@ -5,8 +5,9 @@ import math
 import numpy as np
 
 class EvictionStrategy:
-    def __init__(self, sim: Simulation):
+    def __init__(self, sim: Simulation, rng: random.Random=None):
         self.sim = sim
+        self.rng = rng if rng is not None else sim.rng
 
     def add_common(self, item):
         pass
@@ -54,7 +55,7 @@ class RandomEvictionStrategy(EvictionStrategy):
     short_name = "Random"
 
     def choose_common(self, items: List, buffers: AgentBuffers, new_item):
-        return self.sim.rng.choice(items)
+        return self.rng.choice(items)
 
 class FIFOEvictionStrategy(EvictionStrategy):
     short_name = "FIFO"
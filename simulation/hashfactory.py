@@ -1,9 +1,24 @@
 import random
 import hashlib
+import zlib
 
 _memomask = {}
 
 
+class HashFunction(object):
+    """
+    A class rather than a closure so that it can be pickled. The string is
+    hashed with CRC32, as the built-in hash of strings changes between
+    processes, which would mix up a count-min sketch restored from a checkpoint.
+    """
+    def __init__(self, n, mask):
+        self.n = n
+        self.mask = mask
+
+    def __call__(self, x):
+        return zlib.crc32((str(x) + str(self.n)).encode()) ^ self.mask
+
+
 def hash_function(n):
     """
     :param n: the index of the hash function
@@ -15,10 +30,7 @@ def hash_function(n):
         random.seed(n)
         mask = _memomask[n] = random.getrandbits(32)
 
-    def my_hash(x):
-        return hash(str(x) + str(n)) ^ mask
-
-    return my_hash
+    return HashFunction(n, mask)
 
 
 def gpu_hash_function(j, rand):
@@ -3,12 +3,17 @@ from __future__ import annotations
 from simulation.agent import Agent
 from simulation.capability import Capability
 from simulation.capability_behaviour import InteractionObservation
+from simulation.chunked_log import ChunkedLog
+from simulation.summary_statistics import ConvergenceMonitor, KLLSketch, RunningMoments, StreamSummary
 
 import bz2
 from itertools import chain
 from dataclasses import dataclass
+import math
 import pickle
 
+import numpy as np
+
 @dataclass
 class BufferEvaluation:
     t: float
@@ -21,15 +26,116 @@ class BufferEvaluation:
     target: str
     outcome: InteractionObservation
 
+# The agent who performed an interaction and with which capability
+INTERACTION_FIELDS = [("t", "f8"), ("agent", "i4"), ("capability", "i2")]
+
+# The agent whose buffer an item was evicted from, the agent the item was about
+# and the item's capability, or -1 for crypto and reputation items
+EVICTION_FIELDS = [("t", "f8"), ("agent", "i4"), ("victim", "i4"), ("capability", "i2")]
+
+class MetricsSummary:
+    """
+    Aggregates of the normalised utility (utility / max_utility) of the buffer evaluations,
+    kept up to date as the simulation runs, so that analysing many runs does not need
+    to load every evaluation.
+
+    Each (source, capability) has its own StreamSummary, along with the moments and a
+    quantile sketch of all of the normalised utilities.
+    """
+    # How many values to collect before adding them to the sketch, which is slow to add to one at a time
+    BATCH_SIZE = 1024
+
+    def __init__(self, bucket_width: float, seed=None):
+        self.bucket_width = bucket_width
+
+        self.utilities = {}
+
+        # Seeded so that simulations with the same seed save the same summary
+        self.utility_moments = RunningMoments()
+        self.utility_sketch = KLLSketch(seed=seed)
+        self._pending = []
+
+        # Copied from the metrics when they are saved
+        self.args = None
+        self.seed = None
+        self.stop_time = None
+        self.converged = None
+        self.agent_names = None
+        self.capability_names = None
+
+    @classmethod
+    def from_metrics(cls, metrics: Metrics, bucket_width: float) -> MetricsSummary:
+        """Summarise metrics that were saved without a summary"""
+        summary = cls(bucket_width, seed=getattr(metrics.args, "seed", None))
+
+        for b in metrics.buffers:
+            summary.add_buffer_evaluation(b.t, b.source, b.capability, b.utility, b.max_utility)
+
+        summary.copy_header(metrics)
+        summary.flush()
+
+        return summary
+
+    def add_buffer_evaluation(self, t: float, source: str, capability: str, utility: float, max_utility: float):
+        if max_utility <= 0 or math.isnan(utility):
+            return
+
+        value = utility / max_utility
+
+        stream = self.utilities.get((source, capability))
+        if stream is None:
+            stream = self.utilities[(source, capability)] = StreamSummary(self.bucket_width)
+
+        stream.add(t, value)
+
+        self._pending.append(value)
+        if len(self._pending) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Add the values collected since the last batch to the moments and sketch of every value"""
+        self.utility_moments.update(self._pending)
+        self.utility_sketch.update(self._pending)
+        self._pending = []
+
+    def copy_header(self, metrics: Metrics):
+        self.args = metrics.args
+        self.seed = getattr(metrics.args, "seed", None)
+        # Older metrics did not record when they stopped
+        self.stop_time = getattr(metrics, "stop_time", None)
+        self.converged = getattr(metrics, "converged", None)
+        self.agent_names = metrics.agent_names
+        self.capability_names = metrics.capability_names
+
+    def __getstate__(self):
+        self.flush()
+        return self.__dict__.copy()
+
 class Metrics:
-    def __init__(self):
-        self.interaction_performed = []
+    # The width in seconds of the buckets of the mean normalised utility over time in the summary
+    SUMMARY_BUCKET_WIDTH = 10.0
+
+    def __init__(self, seed=None):
+        self.interaction_performed = ChunkedLog(INTERACTION_FIELDS)
         self.buffers = []
 
-        self.evicted_crypto = []
-        self.evicted_trust = []
-        self.evicted_reputation = []
-        self.evicted_stereotype = []
+        self.evicted_crypto = ChunkedLog(EVICTION_FIELDS)
+        self.evicted_trust = ChunkedLog(EVICTION_FIELDS)
+        self.evicted_reputation = ChunkedLog(EVICTION_FIELDS)
+        self.evicted_stereotype = ChunkedLog(EVICTION_FIELDS)
+
+        # The ids of agents and capabilities in the logs. Once saved these are
+        # the indexes of the names in agent_names and capability_names.
+        self.agent_ids = {}
+        self.capability_ids = {}
+
+        self.convergence = None
+
+        self.summary = MetricsSummary(self.SUMMARY_BUCKET_WIDTH, seed=seed)
+
+    def track_convergence(self, window: float, tolerance: float):
+        """Track the normalised utility of each (source, capability) to tell when it has converged"""
+        self.convergence = ConvergenceMonitor(window, tolerance)
 
     def add_buffer_evaluation(self, t: float,
                               source: Agent, capability: Capability,
@@ -40,36 +146,87 @@ class Metrics:
 
         self.buffers.append(BufferEvaluation(t, source.name, capability.name, pickleable_outcomes, buffers, utility, max_utility, target.name, outcome))
 
+        self.summary.add_buffer_evaluation(t, source.name, capability.name, utility, max_utility)
+
+        if self.convergence is not None and max_utility > 0:
+            self.convergence.add(t, (source.name, capability.name), utility / max_utility)
+
+    def _agent_id(self, agent: Agent) -> int:
+        agent_id = self.agent_ids.get(agent.name)
+        if agent_id is None:
+            agent_id = self.agent_ids[agent.name] = len(self.agent_ids)
+        return agent_id
+
+    def _capability_id(self, capability: Capability) -> int:
+        capability_id = self.capability_ids.get(capability.name)
+        if capability_id is None:
+            capability_id = self.capability_ids[capability.name] = len(self.capability_ids)
+        return capability_id
+
     def add_evicted_crypto(self, t: float, agent: Agent, choice):
-        self.evicted_crypto.append((t, agent.name, choice.basic()))
+        self.evicted_crypto.append(t, self._agent_id(agent), self._agent_id(choice.agent), -1)
     def add_evicted_trust(self, t: float, agent: Agent, choice):
-        self.evicted_trust.append((t, agent.name, choice.basic()))
+        self.evicted_trust.append(t, self._agent_id(agent), self._agent_id(choice.agent), self._capability_id(choice.capability))
     def add_evicted_reputation(self, t: float, agent: Agent, choice):
-        self.evicted_reputation.append((t, agent.name, choice.basic()))
+        self.evicted_reputation.append(t, self._agent_id(agent), self._agent_id(choice.agent), -1)
     def add_evicted_stereotype(self, t: float, agent: Agent, choice):
-        self.evicted_stereotype.append((t, agent.name, choice.basic()))
+        self.evicted_stereotype.append(t, self._agent_id(agent), self._agent_id(choice.agent), self._capability_id(choice.capability))
 
     def add_interaction_performed(self, t: float, agent: Agent, capability: Capability):
-        self.interaction_performed.append((t, agent.name, capability.name))
+        self.interaction_performed.append(t, self._agent_id(agent), self._capability_id(capability))
+
+    def _renumber_ids(self):
+        """Change the ids in the logs to be the indexes of the names in agent_names and capability_names"""
+        agent_index = {name: n for (n, name) in enumerate(self.agent_names)}
+        capability_index = {name: n for (n, name) in enumerate(self.capability_names)}
+
+        agent_mapping = np.zeros(len(self.agent_ids), dtype=np.int32)
+        for (name, agent_id) in self.agent_ids.items():
+            agent_mapping[agent_id] = agent_index[name]
+
+        capability_mapping = np.zeros(len(self.capability_ids), dtype=np.int16)
+        for (name, capability_id) in self.capability_ids.items():
+            capability_mapping[capability_id] = capability_index[name]
+
+        self.interaction_performed.remap("agent", agent_mapping)
+        self.interaction_performed.remap("capability", capability_mapping)
+
+        for log in (self.evicted_crypto, self.evicted_trust, self.evicted_reputation, self.evicted_stereotype):
+            log.remap("agent", agent_mapping)
+            log.remap("victim", agent_mapping)
+            log.remap("capability", capability_mapping)
+
+        self.agent_ids = agent_index
+        self.capability_ids = capability_index
 
     def save(self, sim, args, path_prefix: str="./"):
         # Save information from sim
 
         self.args = args
 
+        # When the simulation ended, which is earlier than the duration if it converged
+        self.stop_time = sim.stop_time if sim.stop_time is not None else sim.duration
+        self.converged = sim.stop_time is not None
+
         self.agent_names = list(sorted([agent.name for agent in sim.agents]))
         self.capability_names = list(sorted(set(chain.from_iterable(
             [capability.name for capability in agent.capabilities]
             for agent in sim.agents
         ))))
 
+        self._renumber_ids()
+
         self.behaviour_changes = {
-            (agent.name, capability.name): behaviour.state_history
+            (agent.name, capability.name): behaviour.history()
             for agent in sim.agents
             for (capability, behaviour) in agent.capability_behaviour.items()
         }
 
+        self.summary.copy_header(self)
+
+        # The summary is saved first, so it can be loaded without the rest of the metrics
         with bz2.open(f"{path_prefix}metrics.{sim.seed}.pickle.bz2", "wb") as f:
+            pickle.dump(self.summary, f, protocol=pickle.HIGHEST_PROTOCOL)
             pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
 
     def num_agents(self) -> int:
@@ -77,3 +234,27 @@ class Metrics:
 
     def num_capabilities(self) -> int:
         return self.args.num_capabilities
+
+def load_summary(path: str) -> MetricsSummary:
+    """Load only the summary of the metrics saved at path"""
+    with bz2.open(path, "rb") as f:
+        summary = pickle.load(f)
+
+    # Metrics saved before the summary was written first
+    if isinstance(summary, Metrics):
+        metrics = summary
+        summary = getattr(metrics, "summary", None)
+        if summary is None:
+            summary = MetricsSummary.from_metrics(metrics, Metrics.SUMMARY_BUCKET_WIDTH)
+
+    return summary
+
+def load_metrics(path: str) -> Metrics:
+    """Load all of the metrics saved at path"""
+    with bz2.open(path, "rb") as f:
+        metrics = pickle.load(f)
+
+        if isinstance(metrics, MetricsSummary):
+            metrics = pickle.load(f)
+
+    return metrics
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import functools
+import json
+import sys
+import time
+
+from simulation.agent_buffers import AgentBuffers
+
+class Profiler:
+    """
+    Records how much time is spent processing each class of event, along with
+    the change in the number of allocated memory blocks, and times calls to
+    the hot paths of the buffers and eviction strategies.
+
+    The hot paths are instrumented by wrapping methods on their classes while
+    the simulation is running, so nothing is wrapped when profiling is disabled.
+    """
+    BUFFER_METHODS = ("utility", "max_utility", "frozen")
+    EVICTION_STRATEGY_METHODS = ("choose_crypto", "choose_trust", "choose_reputation", "choose_stereotype")
+
+    def __init__(self):
+        # Event class name to [count, seconds, allocated blocks]
+        self.events = {}
+
+        # Method name to [count, seconds]
+        self.calls = {}
+
+        self.wall_time = 0.0
+
+        self.installed = []
+        self.started = None
+
+    def install(self, sim: Simulator):
+        targets = [(AgentBuffers, name) for name in self.BUFFER_METHODS]
+        for lane in sim.lanes:
+            targets.extend((type(lane.es), name) for name in self.EVICTION_STRATEGY_METHODS)
+
+        for (cls, name) in dict.fromkeys(targets):
+            original = cls.__dict__.get(name)
+            setattr(cls, name, self._timed(f"{cls.__name__}.{name}", getattr(cls, name)))
+            self.installed.append((cls, name, original))
+
+        self.started = time.perf_counter()
+
+    def uninstall(self):
+        for (cls, name, original) in reversed(self.installed):
+            if original is None:
+                # The method was inherited
+                delattr(cls, name)
+            else:
+                setattr(cls, name, original)
+
+        self.installed = []
+
+        if self.started is not None:
+            self.wall_time += time.perf_counter() - self.started
+            self.started = None
+
+    def _timed(self, key: str, function):
+        stats = self.calls.setdefault(key, [0, 0.0])
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats[0] += 1
+                stats[1] += time.perf_counter() - start
+
+        return wrapper
+
+    def action(self, item, sim: Simulator):
+        """Perform the event's action, recording how long it took"""
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+
+        item.action(sim)
+
+        elapsed = time.perf_counter() - start
+
+        stats = self.events.get(type(item).__name__)
+        if stats is None:
+            stats = self.events[type(item).__name__] = [0, 0.0, 0]
+
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] += sys.getallocatedblocks() - blocks
+
+    def report(self, sim: Simulator) -> dict:
+        return {
+            "seed": sim.seed,
+            "simulated_time": sim.current_time,
+            "wall_time": self.wall_time,
+            "events_per_second": sum(count for (count, seconds, blocks) in self.events.values()) / self.wall_time if self.wall_time > 0 else None,
+            "events": {
+                name: {
+                    "count": count,
+                    "seconds": seconds,
+                    "mean_microseconds": 1e6 * seconds / count,
+                    "allocated_blocks": blocks,
+                }
+                for (name, (count, seconds, blocks)) in sorted(self.events.items(), key=lambda x: x[1][1], reverse=True)
+            },
+            "calls": {
+                name: {
+                    "count": count,
+                    "seconds": seconds,
+                    "mean_microseconds": 1e6 * seconds / count if count else None,
+                }
+                for (name, (count, seconds)) in sorted(self.calls.items(), key=lambda x: x[1][1], reverse=True)
+            },
+        }
+
+    def save(self, sim: Simulator, path_prefix: str="./"):
+        with open(f"{path_prefix}profile.{sim.seed}.json", "w") as f:
+            json.dump(self.report(sim), f, indent=4)
+
+    def __getstate__(self):
+        # The wrapped methods belong to this process
+        state = self.__dict__.copy()
+        state["installed"] = []
+        if self.started is not None:
+            state["wall_time"] += time.perf_counter() - self.started
+        state["started"] = None
+        return state
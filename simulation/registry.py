@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import importlib
+
+class Registry:
+    """
+    The names of the implementations of something, along with where to find them.
+
+    Listing the names does not import the modules that implement them,
+    which can be slow as they import numpy.
+    """
+    def __init__(self, base: str, entries: dict):
+        self.base = base
+        self.entries = entries
+        self.loaded = {}
+
+    def names(self) -> list:
+        return list(self.entries)
+
+    def get(self, name: str):
+        cls = self.loaded.get(name)
+        if cls is None:
+            try:
+                (module, qualname) = self.entries[name].split(":")
+            except KeyError:
+                raise KeyError(f"Unknown {self.base} {name!r}, choose from {', '.join(self.entries)}")
+
+            cls = self.loaded[name] = getattr(importlib.import_module(module), qualname)
+
+        return cls
+
+    def verify(self, name_of=lambda cls: cls.short_name):
+        """Check that the registry lists every subclass of the base class, and nothing else"""
+        (module, qualname) = self.base.split(":")
+        base = getattr(importlib.import_module(module), qualname)
+
+        for entry in self.entries.values():
+            importlib.import_module(entry.split(":")[0])
+
+        def subclasses(cls):
+            for subcls in cls.__subclasses__():
+                yield subcls
+                yield from subclasses(subcls)
+
+        found = {name_of(cls): cls for cls in subclasses(base) if name_of(cls) is not None}
+        registered = {name: self.get(name) for name in self.entries}
+
+        if found != registered:
+            raise RuntimeError(f"The registry of {self.base} lists {registered} but the subclasses are {found}")
+
+EVICTION_STRATEGIES = Registry("simulation.eviction_strategy:EvictionStrategy", {
+    "None": "simulation.eviction_strategy:NoneEvictionStrategy",
+    "Random": "simulation.eviction_strategy:RandomEvictionStrategy",
+    "FIFO": "simulation.eviction_strategy:FIFOEvictionStrategy",
+    "LRU": "simulation.eviction_strategy:LRUEvictionStrategy",
+    "LRU2": "simulation.eviction_strategy:LRU2EvictionStrategy",
+    "MRU": "simulation.eviction_strategy:MRUEvictionStrategy",
+    "Chen2016": "simulation.eviction_strategy:Chen2016EvictionStrategy",
+    "FiveBand": "simulation.eviction_strategy:FiveBandEvictionStrategy",
+    "NotInOther": "simulation.eviction_strategy:NotInOtherEvictionStrategy",
+    "MinNotInOther": "simulation.eviction_strategy:MinNotInOtherEvictionStrategy",
+    "CapPri": "simulation.eviction_strategy:CapabilityPriorityEvictionStrategy",
+})
+
+BEHAVIOURS = Registry("simulation.capability_behaviour:CapabilityBehaviour", {
+    "AlwaysGoodBehaviour": "simulation.capability_behaviour:AlwaysGoodBehaviour",
+    "AlwaysBadBehaviour": "simulation.capability_behaviour:AlwaysBadBehaviour",
+    "VeryGoodBehaviour": "simulation.capability_behaviour:VeryGoodBehaviour",
+    "GoodBehaviour": "simulation.capability_behaviour:GoodBehaviour",
+    "UnstableBehaviour": "simulation.capability_behaviour:UnstableBehaviour",
+})
+
+AGENT_CHOOSE_BEHAVIOURS = Registry("simulation.agent_choose_behaviour:AgentChooseBehaviour", {
+    "Random": "simulation.agent_choose_behaviour:RandomAgentChooseBehaviour",
+    "BRS": "simulation.agent_choose_behaviour:BRSAgentChooseBehaviour",
+})
+
+TOPOLOGIES = Registry("simulation.topology:Topology", {
+    "complete": "simulation.topology:CompleteTopology",
+    "ring": "simulation.topology:RingTopology",
+    "random": "simulation.topology:RandomTopology",
+})
+
+def verify():
+    EVICTION_STRATEGIES.verify()
+    BEHAVIOURS.verify(name_of=lambda cls: cls.__name__)
+    AGENT_CHOOSE_BEHAVIOURS.verify()
+    TOPOLOGIES.verify()
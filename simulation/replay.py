@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+from collections import defaultdict, deque
+import heapq
+import math
+import random
+
+from simulation.agent import Agent
+from simulation.agent_choose_behaviour import AgentChooseBehaviour
+from simulation.capability import Capability
+from simulation.capability_behaviour import InteractionObservation
+from simulation.events import AgentTaskInteraction, AgentTrustDissemination
+from simulation.simulator import independent_lanes
+from simulation.summary_statistics import RunningMoments
+from simulation.topology import restore_topology
+from simulation.trace import TraceReader, DISSEMINATION, TASK, INTERACTION
+from simulation.utility_targets import UtilityTargets
+
+class ReplayBehaviour:
+    """Stands in for a CapabilityBehaviour, as the outcomes are taken from the trace"""
+    def __init__(self):
+        self.individual_seed = 0
+
+class NullSketch:
+    def add(self, x, delta=1):
+        pass
+
+class Replayer:
+    """
+    Replays a trace recorded by TraceWriter against one or more eviction strategies.
+
+    Every strategy gets its own set of buffers, in the same way as the lanes
+    of a simulation with common random numbers. Unlike those lanes, the agents
+    chosen to perform tasks are the ones chosen in the recorded simulation,
+    rather than chosen with each strategy's own buffers. A strategy may no
+    longer have the keys of that agent, in which case the interaction fails.
+
+    Rather than recording every buffer evaluation, only the number of evaluations,
+    the moments of the utility and each lane's metrics summary are kept.
+    """
+    def __init__(self, trace: TraceReader, escls, buffer_sizes: tuple=None, log_level: int=0):
+        header = trace.header
+
+        self.reader = trace
+
+        self.seed = header["seed"]
+        self.rng = random.Random(self.seed)
+
+        self.duration = header["duration"]
+        self.utility_targets = header["utility_targets"]
+
+        self.correct_sketch = NullSketch()
+        self.incorrect_sketch = NullSketch()
+
+        self.lanes = independent_lanes(self, escls, self.seed)
+
+        self.evaluations = [0 for lane in self.lanes]
+        self.utility_moments = [RunningMoments() for lane in self.lanes]
+
+        self.capabilities = [
+            Capability(name, task_period, priority)
+            for (name, task_period, priority) in header["capabilities"]
+        ]
+
+        self.agents = [
+            Agent(name, [self.capabilities[c] for c in capabilities], ReplayBehaviour, AgentChooseBehaviour, trust_dissem_period,
+                  *(buffer_sizes if buffer_sizes is not None else agent_buffer_sizes))
+            for (name, capabilities, trust_dissem_period, agent_buffer_sizes) in header["agents"]
+        ]
+        for agent in self.agents:
+            agent.set_sim(self)
+
+        self.topology = restore_topology(self.agents, header.get("topology"))
+
+        self.current_time = 0
+        self.queue = []
+
+        self.log_level = log_level
+
+        # No trace is recorded while replaying
+        self.trace = None
+
+    def add_event(self, event):
+        heapq.heappush(self.queue, event)
+
+    def _advance(self, t: float):
+        # Process the requests for information that occurred before t
+        while self.queue and self.queue[0].event_time < t:
+            item = heapq.heappop(self.queue)
+
+            if item.event_time > self.duration:
+                self.queue.clear()
+                break
+
+            self.current_time = item.event_time
+
+            item.action(self)
+
+        self.current_time = t
+
+    def run(self):
+        # Snapshots of the buffers when a task was started, waiting for the interaction to occur
+        pending = defaultdict(deque)
+
+        for (op, t, *arguments) in self.reader:
+            self._advance(t)
+
+            if op == DISSEMINATION:
+                (agent,) = arguments
+
+                AgentTrustDissemination(t, self.agents[agent]).disseminate(self)
+
+            elif op == TASK:
+                (agent, capability, selected_agent) = arguments
+                agent = self.agents[agent]
+                capability = self.capabilities[capability]
+
+                for lane in self.lanes:
+                    lane.metrics.add_interaction_performed(t, agent, capability)
+
+                if selected_agent is not None:
+                    for lane in self.lanes:
+                        agent.use_buffers_for_task(self.agents[selected_agent], capability, lane)
+
+                    pending[(agent, capability)].append([buffers.utility_snapshot(capability) for buffers in agent.lane_buffers])
+
+            elif op == INTERACTION:
+                (source, capability, target, outcome, correct) = arguments
+                source = self.agents[source]
+                capability = self.capabilities[capability]
+                target = self.agents[target]
+
+                potential_outcomes = {
+                    agent: InteractionObservation.Correct if correct & (1 << self.topology.agent_index[agent]) else InteractionObservation.Incorrect
+                    for agent in self.topology.neighbours(source)
+                    if agent is not target
+                }
+
+                # Every lane performs the task with the recorded agent
+                event = AgentTaskInteraction(t, source, capability, [target] * len(self.lanes), pending[(source, capability)].popleft())
+
+                (our_crypto, their_crypto) = event.exchange_crypto(self)
+
+                self.evaluate(event, our_crypto, their_crypto, outcome, potential_outcomes)
+
+        # Any remaining requests up to the end of the simulation
+        self._advance(float("inf"))
+
+        for lane in self.lanes:
+            lane.metrics.summary.flush()
+
+    def evaluate(self, event: AgentTaskInteraction, our_crypto: List[bool], their_crypto: List[bool],
+                 actual_outcome: InteractionObservation, potential_outcomes: Dict[Agent, InteractionObservation]):
+        """The same as AgentTaskInteraction.evaluate, but only records the aggregates of the utility"""
+        source = event.source
+        capability = event.capability
+        target = event.target
+
+        neighbours = self.topology.neighbours(source)
+
+        for lane in self.lanes:
+            outcome = actual_outcome
+
+            # Override interaction result if either side doesn't have the other's keys
+            if not our_crypto[lane.index] or not their_crypto[lane.index]:
+                outcome = InteractionObservation.Incorrect
+
+            if self.utility_targets == UtilityTargets.All:
+                utility_targets = neighbours
+            elif self.utility_targets == UtilityTargets.Good:
+                utility_targets = [
+                    agent for agent in neighbours
+                    if (outcome if agent is target else potential_outcomes[agent]) == InteractionObservation.Correct
+                ]
+            else:
+                raise NotImplementedError()
+
+            snapshot = event.buffers[lane.index]
+
+            utility = snapshot.utility(source, capability, targets=utility_targets)
+            max_utility = snapshot.max_utility(source, capability, targets=utility_targets)
+
+            self.evaluations[lane.index] += 1
+            if not math.isnan(utility):
+                self.utility_moments[lane.index].add(utility)
+
+            lane.metrics.summary.add_buffer_evaluation(event.event_time, source.name, capability.name, utility, max_utility)
+
+            # Update source's interaction history
+            source.update_trust_history(target, capability, outcome, lane)
+
+    def log(self, message: str):
+        if self.log_level > 0:
+            print(f"{self.current_time}|{message}")
@@ -1,61 +1,268 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
+import functools
+import os
+import pickle
 import random
 import heapq
+import time
+import traceback
 from typing import List
 
 from simulation.agent import Agent
+from simulation.behaviour_store import BehaviourStore
 from simulation.events import AgentInit
 from simulation.metrics import Metrics
+from simulation.profiling import Profiler
 from simulation.utility_targets import UtilityTargets
 from simulation.hashfactory import hash_function
+from simulation.topology import CompleteTopology
 from simulation.countminsketch import CountMinSketch
 
 
 DEPTH = 8
 WIDTH = 2**22
-HASH_FUNCTIONS = [hash_function(i) for i in range(DEPTH)]
+
+@functools.lru_cache(maxsize=None)
+def sketch_hash_functions() -> List[HashFunction]:
+    # Created when first needed rather than when imported
+    return [hash_function(i) for i in range(DEPTH)]
+
+class Lane:
+    """
+    One eviction strategy being evaluated. Every agent has a separate set of
+    buffers for each lane and each lane records its own metrics.
+
+    rng is used for the choices the lane makes with its buffers, other than those
+    made by its eviction strategy. It is None for a lane that uses the simulation's PRNG.
+    """
+    def __init__(self, index: int, es: EvictionStrategy, metrics: Metrics, rng: random.Random=None):
+        self.index = index
+        self.es = es
+        self.metrics = metrics
+        self.rng = rng
+
+    @property
+    def name(self) -> str:
+        return self.es.short_name
+
+    def __repr__(self):
+        return f"Lane({self.name})"
+
+def independent_lanes(sim, escls, seed: int) -> List[Lane]:
+    # Strategies need their own PRNG so that one strategy's random choices
+    # do not change the events that the other strategies see.
+    # The first lane chooses agents with the simulation's PRNG, as it would on its own.
+    return [
+        Lane(index, cls(sim, random.Random(f"{seed}:{cls.short_name}")), Metrics(seed),
+             random.Random(f"{seed}:{cls.short_name}:choose") if index > 0 else None)
+        for (index, cls) in enumerate(escls)
+    ]
 
 class Simulator:
-    def __init__(self, seed: int, agents: List[Agent], escls, duration: float, utility_targets: UtilityTargets, log_level: int):
+    def __init__(self, seed: int, agents: List[Agent], escls, duration: float, utility_targets: UtilityTargets, log_level: int,
+                 trace: TraceWriter=None, topology: Topology=None):
+        """
+        escls is either a single eviction strategy class or a list of them.
+        When several are given, they are evaluated with common random numbers:
+        the events and the behaviour of agents are shared, with the behaviours driven
+        by the interactions of the first strategy. Every strategy maintains its own
+        buffers and uses them to choose which agent performs each task, observing
+        the outcome that agent would have given for the same random numbers.
+
+        topology restricts which agents communicate with each other,
+        by default every agent is a neighbour of every other agent.
+        """
         # Initialise the PRNG and record the seed
         self.seed = seed
         self.rng = random.Random(self.seed)
 
+        if not isinstance(escls, (list, tuple)):
+            escls = [escls]
+
         # CountMinSketches to count successes and failures
 
-        self.correct_sketch = CountMinSketch(DEPTH, WIDTH, HASH_FUNCTIONS)
-        self.incorrect_sketch = CountMinSketch(DEPTH, WIDTH, HASH_FUNCTIONS)
+        self.correct_sketch = CountMinSketch(DEPTH, WIDTH, sketch_hash_functions())
+        self.incorrect_sketch = CountMinSketch(DEPTH, WIDTH, sketch_hash_functions())
         
 
 
 
+        if len(escls) == 1:
+            # A single strategy draws from the simulation's PRNG, as it always has
+            self.lanes = [Lane(0, escls[0](self), Metrics(self.seed))]
+        else:
+            self.lanes = independent_lanes(self, escls, self.seed)
+
         self.agents = agents
         for agent in self.agents:
             agent.set_sim(self)
 
-        self.es = escls(self)
+        # The state of every agent's capability behaviours, so they can be sampled together
+        self.behaviours = BehaviourStore([
+            behaviour
+            for agent in self.agents
+            for (capability, behaviour) in sorted(agent.capability_behaviour.items(), key=lambda x: x[0].name)
+        ])
+
+        self.topology = topology if topology is not None else CompleteTopology(self.agents)
+
+        # The first lane makes the decisions
+        self.es = self.lanes[0].es
 
         self.duration = duration
         self.utility_targets = utility_targets
 
         self.current_time = 0
         self.queue = []
+        self.events_processed = 0
 
-        self.metrics = Metrics()
+        self.metrics = self.lanes[0].metrics
 
         self.log_level = log_level
 
+        # Optionally record the operations on buffers to replay later
+        self.trace = trace
+        if self.trace is not None:
+            self.trace.start(self)
+
+        # Optionally stop once the utility has converged
+        self.stop_on_convergence = False
+        self.stop_time = None
+
+        # Optionally record where the time is spent
+        self.profiler = None
+
+        self.checkpoint_path = None
+        self.checkpoint_period = None
+        self.checkpoint_extra = None
+        self.checkpoint_writer = None
+        self.last_checkpoint = None
+
     def add_event(self, event):
         heapq.heappush(self.queue, event)
 
+    def enable_convergence_stop(self, window: float, tolerance: float):
+        """Stop the simulation early once the normalised utility in every lane has converged"""
+        for lane in self.lanes:
+            lane.metrics.track_convergence(window, tolerance)
+
+        self.stop_on_convergence = True
+
+    def enable_profiling(self):
+        """Record the time spent on each class of event and in the hot paths"""
+        if self.profiler is None:
+            self.profiler = Profiler()
+
+    def enable_checkpoints(self, path: str, period: float, extra=None):
+        """
+        Save the simulation to path every period seconds of wall clock time.
+        extra is saved along with the simulation, for the caller to use when restoring.
+        """
+        self.checkpoint_path = path
+        self.checkpoint_period = period
+        self.checkpoint_extra = extra
+        self.last_checkpoint = time.monotonic()
+
+    def checkpoint(self):
+        if self._checkpoint_writing():
+            # Still writing the last one, try again later
+            return
+
+        # The copy of the trace file in the child would otherwise write out the buffered data again
+        if self.trace is not None:
+            self.trace.flush()
+
+        # The forked child has a copy of the simulation that is pickled
+        # while this process carries on with the simulation
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                tmp_path = f"{self.checkpoint_path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self.checkpoint_path)
+                status = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                # Do not run any exit handlers or flush buffers belonging to the parent
+                os._exit(status)
+
+        self.checkpoint_writer = pid
+        self.last_checkpoint = time.monotonic()
+
+    def _checkpoint_writing(self, wait: bool=False) -> bool:
+        if self.checkpoint_writer is None:
+            return False
+
+        (pid, status) = os.waitpid(self.checkpoint_writer, 0 if wait else os.WNOHANG)
+        if pid == 0:
+            return True
+
+        if os.waitstatus_to_exitcode(status) != 0:
+            print(f"Failed to write checkpoint {self.checkpoint_path}")
+
+        self.checkpoint_writer = None
+        return False
+
+    def finish_checkpoints(self):
+        """Wait for any checkpoint being written and remove the checkpoint, as it is no longer needed"""
+        if self.checkpoint_path is None:
+            return
+
+        self._checkpoint_writing(wait=True)
+
+        try:
+            os.remove(self.checkpoint_path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def restore(path: str) -> Simulator:
+        with open(path, "rb") as f:
+            sim = pickle.load(f)
+
+        sim.last_checkpoint = time.monotonic()
+
+        return sim
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The process writing a checkpoint belongs to this process
+        state["checkpoint_writer"] = None
+        return state
+
     def run(self, max_start_delay: float):
+        self.start(max_start_delay)
+        self.loop()
+
+    def start(self, max_start_delay: float):
         # Add start event
         for agent in self.agents:
             self.add_event(AgentInit(self.rng.uniform(0, max_start_delay), agent))
 
+    def loop(self):
+        if self.profiler is None:
+            self._loop()
+            return
+
+        self.profiler.install(self)
+        try:
+            self._loop()
+        finally:
+            self.profiler.uninstall()
+
+    def _loop(self):
+        profiler = self.profiler
+
         while self.queue:
+            # Checkpoint between events, so restoring continues from the next event
+            if self.checkpoint_period is not None and time.monotonic() - self.last_checkpoint >= self.checkpoint_period:
+                self.checkpoint()
+
             item = heapq.heappop(self.queue)
 
             assert item.event_time >= self.current_time
@@ -65,8 +272,16 @@ class Simulator:
                 break
 
             self.current_time = item.event_time
+            self.events_processed += 1
 
-            item.action(self)
+            if profiler is None:
+                item.action(self)
+            else:
+                profiler.action(item, self)
+
+            if self.stop_on_convergence and all(lane.metrics.convergence.converged for lane in self.lanes):
+                self.stop_time = self.current_time
+                break
 
     def log(self, message: str):
         if self.log_level > 0:
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from simulation.trace import TraceReader, DISSEMINATION, TASK, INTERACTION
+
+BUFFERS = ("crypto", "trust", "reputation", "stereotype")
+
+class FenwickTree:
+    """Prefix sums over a fixed number of positions, with O(log n) updates and queries"""
+    def __init__(self, size: int):
+        self.tree = [0] * (size + 1)
+
+    def add(self, index: int, delta: int):
+        index += 1
+        tree = self.tree
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+
+    def prefix_sum(self, index: int) -> int:
+        """The sum of positions [0, index)"""
+        result = 0
+        tree = self.tree
+        while index > 0:
+            result += tree[index]
+            index -= index & -index
+        return result
+
+def stack_distances(references: List) -> np.ndarray:
+    """
+    The LRU stack distance of each reference, as defined in
+    Mattson, R. L.; Gecsei, J.; Slutz, D. R. & Traiger, I. L.
+    Evaluation techniques for storage hierarchies
+    IBM Systems Journal, 1970, 9, 78-117
+
+    A reference at distance d is held by every LRU buffer with at least d items.
+    The first reference to an item has distance 0, meaning it is held by none.
+
+    The distance is the number of distinct items referenced since the previous reference
+    to the same item, which is counted by marking the latest reference to each item in a tree.
+    """
+    tree = FenwickTree(len(references))
+    last = {}
+
+    distances = np.zeros(len(references), dtype=np.int64)
+
+    for (n, key) in enumerate(references):
+        previous = last.get(key)
+
+        if previous is not None:
+            distances[n] = tree.prefix_sum(n) - tree.prefix_sum(previous)
+            tree.add(previous, -1)
+
+        tree.add(n, 1)
+        last[key] = n
+
+    return distances
+
+def trace_references(trace: TraceReader) -> Iterator[Tuple[int, str, tuple]]:
+    """
+    Yields the (agent, buffer, item) references in a trace.
+
+    Every time an agent wants an item it is treated as a reference, whether or
+    not it was in the agent's buffer, so that the stream does not depend on the
+    size of the buffers.
+    """
+    capabilities = [agent_capabilities for (name, agent_capabilities, trust_dissem_period, buffer_sizes) in trace.header["agents"]]
+    num_agents = len(capabilities)
+
+    adjacency = trace.header.get("topology")
+    if adjacency is None:
+        neighbours = [[n for n in range(num_agents) if n != sender] for sender in range(num_agents)]
+    else:
+        (offsets, indices) = adjacency
+        neighbours = [indices[offsets[n]:offsets[n+1]].tolist() for n in range(num_agents)]
+
+    for (op, t, *arguments) in trace:
+        if op == DISSEMINATION:
+            (sender,) = arguments
+
+            # Receivers need the sender's keys, record its trust as reputation
+            # and need stereotypes for the capabilities they have
+            for receiver in neighbours[sender]:
+                yield (receiver, "crypto", (sender,))
+                yield (receiver, "reputation", (sender,))
+                for capability in capabilities[receiver]:
+                    yield (receiver, "stereotype", (sender, capability))
+
+        elif op == TASK:
+            (agent, capability, selected_agent) = arguments
+
+            if selected_agent is not None:
+                yield (agent, "crypto", (selected_agent,))
+                yield (agent, "trust", (selected_agent, capability))
+                yield (agent, "stereotype", (selected_agent, capability))
+
+        elif op == INTERACTION:
+            (source, capability, target, outcome, correct) = arguments
+
+            yield (source, "crypto", (target,))
+            yield (target, "crypto", (source,))
+            yield (source, "trust", (target, capability))
+
+def max_buffer_sizes(header: dict) -> Dict[str, int]:
+    num_agents = len(header["agents"])
+    num_capabilities = len(header["capabilities"])
+
+    return {
+        "crypto": num_agents - 1,
+        "trust": (num_agents - 1) * num_capabilities,
+        "reputation": num_agents - 1,
+        "stereotype": (num_agents - 1) * num_capabilities,
+    }
+
+class CoverageCurves:
+    """
+    Histograms of stack distances for each buffer, which can be accumulated
+    over several traces of the same configuration.
+    """
+    def __init__(self, max_sizes: Dict[str, int]):
+        self.max_sizes = max_sizes
+
+        # Index 0 counts the first references to items
+        self.histograms = {
+            buffer: np.zeros(max_size + 1, dtype=np.int64)
+            for (buffer, max_size) in max_sizes.items()
+        }
+
+    def update(self, trace: TraceReader):
+        streams = defaultdict(list)
+
+        for (agent, buffer, item) in trace_references(trace):
+            streams[(agent, buffer)].append(item)
+
+        for ((agent, buffer), references) in streams.items():
+            distances = stack_distances(references)
+
+            self.histograms[buffer] += np.bincount(distances, minlength=len(self.histograms[buffer]))
+
+    def references(self, buffer: str) -> int:
+        return int(self.histograms[buffer].sum())
+
+    def coverage(self, buffer: str) -> np.ndarray:
+        """The fraction of references that an LRU buffer of each size from 0 to the maximum would hold"""
+        histogram = self.histograms[buffer]
+
+        hits = np.cumsum(histogram) - histogram[0]
+
+        total = histogram.sum()
+        if total == 0:
+            return np.zeros(len(histogram))
+
+        return hits / total
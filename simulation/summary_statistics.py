@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+from collections import defaultdict
+import math
+import random
+
+import numpy as np
+
+class RunningMoments:
+    """
+    Exact count, mean, variance, minimum and maximum of a stream of values.
+    Updates are combined using the pairwise algorithm from
+    Chan, T. F.; Golub, G. H. & LeVeque, R. J.
+    Updating Formulae and a Pairwise Algorithm for Computing Sample Variances
+    COMPSTAT 1982, 30-41
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _combine(self, count: int, mean: float, m2: float, vmin: float, vmax: float):
+        if count == 0:
+            return
+
+        total = self.count + count
+        delta = mean - self.mean
+
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+        self.min = min(self.min, vmin)
+        self.max = max(self.max, vmax)
+
+    def add(self, value: float):
+        self._combine(1, value, 0.0, value, value)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+
+        mean = values.mean()
+        self._combine(len(values), mean, float(((values - mean)**2).sum()), values.min(), values.max())
+
+    def merge(self, other: RunningMoments):
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+
+    def variance(self) -> float:
+        if self.count < 2:
+            return float("NaN")
+        return self.m2 / (self.count - 1)
+
+    def std(self) -> float:
+        return math.sqrt(self.variance())
+
+class StreamSummary:
+    """
+    Summary of a stream of values over simulated time: their moments, a histogram
+    of the values and the mean of the values in each consecutive bucket of time.
+    """
+    def __init__(self, bucket_width: float, bins: int=20, value_range: tuple=(0.0, 1.0)):
+        self.bucket_width = bucket_width
+        self.value_range = value_range
+
+        self.moments = RunningMoments()
+        self.histogram = np.zeros(bins, dtype=np.int64)
+
+        self.bucket_sums = []
+        self.bucket_counts = []
+
+    def add(self, t: float, value: float):
+        self.moments.add(value)
+
+        # Values outside of the range are counted in the first or last bin
+        (low, high) = self.value_range
+        bins = len(self.histogram)
+        self.histogram[min(max(int((value - low) / (high - low) * bins), 0), bins - 1)] += 1
+
+        bucket = int(t // self.bucket_width)
+        if bucket >= len(self.bucket_sums):
+            missing = bucket + 1 - len(self.bucket_sums)
+            self.bucket_sums.extend([0.0] * missing)
+            self.bucket_counts.extend([0] * missing)
+
+        self.bucket_sums[bucket] += value
+        self.bucket_counts[bucket] += 1
+
+    def merge(self, other: StreamSummary):
+        if self.bucket_width != other.bucket_width or self.value_range != other.value_range or len(self.histogram) != len(other.histogram):
+            raise ValueError("Can only merge summaries with the same buckets and histogram bins")
+
+        self.moments.merge(other.moments)
+        self.histogram += other.histogram
+
+        missing = len(other.bucket_sums) - len(self.bucket_sums)
+        if missing > 0:
+            self.bucket_sums.extend([0.0] * missing)
+            self.bucket_counts.extend([0] * missing)
+
+        for (bucket, (total, count)) in enumerate(zip(other.bucket_sums, other.bucket_counts)):
+            self.bucket_sums[bucket] += total
+            self.bucket_counts[bucket] += count
+
+    def bin_edges(self) -> np.ndarray:
+        return np.linspace(*self.value_range, len(self.histogram) + 1)
+
+    def bucket_starts(self) -> np.ndarray:
+        return np.arange(len(self.bucket_sums)) * self.bucket_width
+
+    def bucket_means(self) -> np.ndarray:
+        """The mean in each bucket of time, NaN for buckets without any values"""
+        sums = np.array(self.bucket_sums, dtype=np.float64)
+        counts = np.array(self.bucket_counts, dtype=np.float64)
+        return np.divide(sums, counts, out=np.full(len(sums), float("NaN")), where=counts > 0)
+
+class ConvergenceMonitor:
+    """
+    Detects when a set of keyed values has reached steady state.
+
+    Values are grouped into consecutive windows of simulated time. When a window
+    closes, every key is considered stable if its mean changed by no more than
+    the tolerance since the previous window, and the standard error of the
+    window's mean is also within the tolerance.
+    """
+    def __init__(self, window: float, tolerance: float, min_samples: int=2):
+        self.window = window
+        self.tolerance = tolerance
+        self.min_samples = min_samples
+
+        self.window_end = window
+        self.current = defaultdict(RunningMoments)
+        self.previous = {}
+
+        self.converged = False
+        self.converged_time = None
+
+    def add(self, t: float, key, value: float):
+        if t >= self.window_end:
+            self._close_window(t)
+
+        if not math.isnan(value):
+            self.current[key].add(value)
+
+    def _stable(self, key, moments: RunningMoments) -> bool:
+        previous = self.previous.get(key)
+        if previous is None:
+            return False
+
+        if moments.count < self.min_samples or previous.count < self.min_samples:
+            return False
+
+        if abs(moments.mean - previous.mean) > self.tolerance:
+            return False
+
+        return math.sqrt(moments.variance() / moments.count) <= self.tolerance
+
+    def _close_window(self, t: float):
+        self.converged = (
+            bool(self.current) and
+            self.current.keys() == self.previous.keys() and
+            all(self._stable(key, moments) for (key, moments) in self.current.items())
+        )
+
+        if self.converged:
+            self.converged_time = self.window_end
+
+        self.previous = self.current
+        self.current = defaultdict(RunningMoments)
+
+        # Skip over windows without any values
+        while self.window_end <= t:
+            self.window_end += self.window
+
+class KLLSketch:
+    """
+    Mergeable quantile sketch described in
+    Karnin, Z.; Lang, K. & Liberty, E.
+    Optimal Quantile Approximation in Streams
+    IEEE 57th Annual Symposium on Foundations of Computer Science, 2016, 71-78
+
+    Items at compactor level h have weight 2**h. Whenever a level exceeds
+    its capacity it is sorted and every other item is promoted to the next level.
+    """
+    c = 2.0 / 3.0
+
+    def __init__(self, k: int=200, seed: int=None):
+        self.k = k
+        self.n = 0
+        self.compactors = [np.empty(0, dtype=np.float64)]
+        self.rng = random.Random(seed)
+
+    def capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return max(2, int(math.ceil(self.k * self.c**depth)))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return
+
+        self.n += len(values)
+        self.compactors[0] = np.concatenate((self.compactors[0], values))
+        self._compress()
+
+    def merge(self, other: KLLSketch):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append(np.empty(0, dtype=np.float64))
+
+        for (level, items) in enumerate(other.compactors):
+            self.compactors[level] = np.concatenate((self.compactors[level], items))
+
+        self.n += other.n
+        self._compress()
+
+    def _compress(self):
+        # Capacities shrink as the sketch grows taller, so keep going until all levels fit
+        compacted = True
+        while compacted:
+            compacted = False
+
+            level = 0
+            while level < len(self.compactors):
+                items = self.compactors[level]
+
+                if len(items) >= self.capacity(level):
+                    if level + 1 == len(self.compactors):
+                        self.compactors.append(np.empty(0, dtype=np.float64))
+
+                    items = np.sort(items)
+
+                    # An odd item out stays at this level to keep the total weight exact
+                    if len(items) % 2 == 1:
+                        self.compactors[level] = items[-1:]
+                        items = items[:-1]
+                    else:
+                        self.compactors[level] = np.empty(0, dtype=np.float64)
+
+                    offset = self.rng.getrandbits(1)
+                    self.compactors[level + 1] = np.concatenate((self.compactors[level + 1], items[offset::2]))
+
+                    compacted = True
+
+                level += 1
+
+    def weighted_items(self):
+        items = np.concatenate(self.compactors)
+        weights = np.concatenate([
+            np.full(len(compactor), 2**level, dtype=np.int64)
+            for (level, compactor) in enumerate(self.compactors)
+        ])
+
+        order = np.argsort(items, kind="stable")
+
+        return (items[order], weights[order])
+
+    def quantiles(self, qs) -> np.ndarray:
+        if self.n == 0:
+            return np.full(np.shape(qs), float("NaN"))
+
+        (items, weights) = self.weighted_items()
+        cumulative = np.cumsum(weights)
+
+        idx = np.searchsorted(cumulative, np.asarray(qs) * self.n, side="left")
+
+        return items[np.clip(idx, 0, len(items) - 1)]
+
+    def quantile(self, q: float) -> float:
+        return float(self.quantiles([q])[0])
+
+    def __len__(self):
+        return sum(len(compactor) for compactor in self.compactors)
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import random
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+class Topology:
+    """Which agents each agent can communicate with"""
+    short_name = None
+
+    def __init__(self, agents: List[Agent]):
+        self.agents = agents
+        self.agent_index = {agent: n for (n, agent) in enumerate(agents)}
+
+    def neighbours(self, agent: Agent) -> Sequence[Agent]:
+        """The neighbours of agent, in the same order as the agents"""
+        raise NotImplementedError
+
+    def adjacency(self) -> Optional[tuple]:
+        """The (offsets, indices) CSR adjacency, or None when every agent is a neighbour of every other"""
+        raise NotImplementedError
+
+    @classmethod
+    def create(cls, agents: List[Agent], degree: int, rng: random.Random) -> Topology:
+        raise NotImplementedError
+
+class CompleteTopology(Topology):
+    """Every agent is a neighbour of every other agent"""
+    short_name = "complete"
+
+    def neighbours(self, agent: Agent) -> Sequence[Agent]:
+        return [a for a in self.agents if a is not agent]
+
+    def adjacency(self) -> Optional[tuple]:
+        return None
+
+    @classmethod
+    def create(cls, agents: List[Agent], degree: int, rng: random.Random) -> Topology:
+        return cls(agents)
+
+class CSRTopology(Topology):
+    """
+    An undirected neighbour graph in compressed sparse row form.
+    The neighbours of the agent at index n are indices[offsets[n]:offsets[n+1]].
+    """
+    short_name = None
+
+    def __init__(self, agents: List[Agent], offsets: np.ndarray, indices: np.ndarray):
+        super().__init__(agents)
+
+        if len(offsets) != len(agents) + 1:
+            raise ValueError(f"Expected {len(agents) + 1} offsets, got {len(offsets)}")
+
+        self.offsets = offsets
+        self.indices = indices
+
+    @staticmethod
+    def from_edges(num_agents: int, sources: np.ndarray, targets: np.ndarray) -> tuple:
+        """The CSR adjacency of the undirected graph with the given edges, ignoring self loops and duplicates"""
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+
+        keep = sources != targets
+        (sources, targets) = (sources[keep], targets[keep])
+
+        # Both directions of each edge, sorted by source then target
+        rows = np.concatenate((sources, targets))
+        columns = np.concatenate((targets, sources))
+        edges = np.unique(rows * num_agents + columns)
+
+        rows = edges // num_agents
+        columns = edges % num_agents
+
+        offsets = np.zeros(num_agents + 1, dtype=np.uint32)
+        np.cumsum(np.bincount(rows, minlength=num_agents), out=offsets[1:])
+
+        return (offsets, columns.astype(np.uint32))
+
+    def neighbours(self, agent: Agent) -> Sequence[Agent]:
+        n = self.agent_index[agent]
+        agents = self.agents
+        return [agents[i] for i in self.indices[self.offsets[n]:self.offsets[n+1]].tolist()]
+
+    def adjacency(self) -> Optional[tuple]:
+        return (self.offsets, self.indices)
+
+class RingTopology(CSRTopology):
+    """Each agent is a neighbour of the degree/2 agents either side of it"""
+    short_name = "ring"
+
+    @classmethod
+    def create(cls, agents: List[Agent], degree: int, rng: random.Random) -> Topology:
+        num_agents = len(agents)
+        sources = np.repeat(np.arange(num_agents), max(degree // 2, 1))
+        steps = np.tile(np.arange(1, max(degree // 2, 1) + 1), num_agents)
+
+        return cls(agents, *cls.from_edges(num_agents, sources, (sources + steps) % num_agents))
+
+class RandomTopology(CSRTopology):
+    """An Erdős–Rényi graph where agents have degree neighbours on average"""
+    short_name = "random"
+
+    @classmethod
+    def create(cls, agents: List[Agent], degree: int, rng: random.Random) -> Topology:
+        num_agents = len(agents)
+        num_edges = num_agents * degree // 2
+
+        sources = [rng.randrange(num_agents) for _ in range(num_edges)]
+        targets = [rng.randrange(num_agents) for _ in range(num_edges)]
+
+        return cls(agents, *cls.from_edges(num_agents, sources, targets))
+
+def restore_topology(agents: List[Agent], adjacency: Optional[tuple]) -> Topology:
+    """Recreate a topology from its adjacency"""
+    if adjacency is None:
+        return CompleteTopology(agents)
+
+    return CSRTopology(agents, *adjacency)
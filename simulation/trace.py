@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import pickle
+import struct
+from typing import Dict, Iterator, Tuple
+
+from simulation.capability_behaviour import InteractionObservation
+
+MAGIC = b"TBTRACE1"
+
+# The operations recorded in a trace, each one is followed by its time
+DISSEMINATION = 1
+TASK = 2
+INTERACTION = 3
+
+RECORD = struct.Struct("<Bd")
+DISSEMINATION_RECORD = struct.Struct("<H")
+TASK_RECORD = struct.Struct("<HHH")
+INTERACTION_RECORD = struct.Struct("<HHHB")
+
+HEADER_LENGTH = struct.Struct("<I")
+
+# Agents are recorded as unsigned shorts, with the largest value meaning that no agent was selected
+NO_AGENT = 0xFFFF
+MAX_AGENTS = NO_AGENT
+
+OUTCOMES = list(InteractionObservation)
+
+class TraceWriter:
+    """
+    Records the operations in a simulation that affect the buffers of agents,
+    so that eviction strategies can later be evaluated without re-running the simulation.
+
+    Only the decisions that do not depend on the contents of buffers are recorded:
+    when agents disseminate trust, which agent was chosen to perform a task,
+    and the outcomes of each interaction. Requests for missing information
+    depend on the buffers, so are left for the replay to work out.
+    """
+    def __init__(self, path: str, args=None):
+        self.path = path
+        self.args = args
+
+        self.f = None
+        self.agents = {}
+        self.capabilities = {}
+        self.mask_bytes = 0
+
+    def start(self, sim: Simulator):
+        if len(sim.agents) > MAX_AGENTS:
+            raise ValueError(f"Traces can record at most {MAX_AGENTS} agents, not {len(sim.agents)}")
+
+        self.agents = {agent: n for (n, agent) in enumerate(sim.agents)}
+
+        capabilities = []
+        for agent in sim.agents:
+            for capability in agent.capabilities:
+                if capability not in capabilities:
+                    capabilities.append(capability)
+        self.capabilities = {capability: n for (n, capability) in enumerate(capabilities)}
+
+        self.mask_bytes = (len(sim.agents) + 7) // 8
+
+        header = {
+            "version": 1,
+            "seed": sim.seed,
+            "duration": sim.duration,
+            "utility_targets": sim.utility_targets,
+            "capabilities": [(capability.name, capability.task_period, capability.priority) for capability in capabilities],
+            "agents": [
+                (agent.name, [self.capabilities[capability] for capability in agent.capabilities], agent.trust_dissem_period, agent.buffer_sizes)
+                for agent in sim.agents
+            ],
+            "eviction_strategy": sim.lanes[0].name,
+            "topology": sim.topology.adjacency(),
+            "args": self.args,
+        }
+
+        data = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.f = open(self.path, "wb")
+        self.f.write(MAGIC)
+        self.f.write(HEADER_LENGTH.pack(len(data)))
+        self.f.write(data)
+
+    def dissemination(self, t: float, agent: Agent):
+        self.f.write(RECORD.pack(DISSEMINATION, t))
+        self.f.write(DISSEMINATION_RECORD.pack(self.agents[agent]))
+
+    def task(self, t: float, agent: Agent, capability: Capability, selected_agent: Optional[Agent]):
+        self.f.write(RECORD.pack(TASK, t))
+        self.f.write(TASK_RECORD.pack(self.agents[agent], self.capabilities[capability],
+                                      self.agents[selected_agent] if selected_agent is not None else NO_AGENT))
+
+    def interaction(self, t: float, source: Agent, capability: Capability, target: Agent,
+                    outcome: InteractionObservation, potential_outcomes: Dict[Agent, InteractionObservation]):
+        # Which of the other agents would have performed the task correctly
+        correct = 0
+        for (agent, potential_outcome) in potential_outcomes.items():
+            if potential_outcome == InteractionObservation.Correct:
+                correct |= 1 << self.agents[agent]
+
+        self.f.write(RECORD.pack(INTERACTION, t))
+        self.f.write(INTERACTION_RECORD.pack(self.agents[source], self.capabilities[capability], self.agents[target], OUTCOMES.index(outcome)))
+        self.f.write(correct.to_bytes(self.mask_bytes, "little"))
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def __getstate__(self):
+        # Remember how much of the trace had been written, it needs to have been flushed
+        state = self.__dict__.copy()
+        state["f"] = self.f.tell()
+        return state
+
+    def __setstate__(self, state):
+        # Discard anything written after the checkpoint and continue from there
+        offset = state["f"]
+        state["f"] = open(state["path"], "r+b")
+        state["f"].truncate(offset)
+        state["f"].seek(offset)
+        self.__dict__.update(state)
+
+class TraceReader:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.data = f.read()
+
+        if not self.data.startswith(MAGIC):
+            raise ValueError(f"{path} is not a trace")
+
+        offset = len(MAGIC)
+        (length,) = HEADER_LENGTH.unpack_from(self.data, offset)
+        offset += HEADER_LENGTH.size
+
+        self.header = pickle.loads(self.data[offset:offset+length])
+        self.start = offset + length
+
+        self.mask_bytes = (len(self.header["agents"]) + 7) // 8
+
+    def __iter__(self) -> Iterator[Tuple]:
+        """Yields (operation, time, *arguments) with agents and capabilities given by their index"""
+        data = self.data
+        offset = self.start
+        end = len(data)
+
+        while offset < end:
+            (op, t) = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+
+            if op == DISSEMINATION:
+                (agent,) = DISSEMINATION_RECORD.unpack_from(data, offset)
+                offset += DISSEMINATION_RECORD.size
+
+                yield (op, t, agent)
+
+            elif op == TASK:
+                (agent, capability, selected_agent) = TASK_RECORD.unpack_from(data, offset)
+                offset += TASK_RECORD.size
+
+                yield (op, t, agent, capability, selected_agent if selected_agent != NO_AGENT else None)
+
+            elif op == INTERACTION:
+                (source, capability, target, outcome) = INTERACTION_RECORD.unpack_from(data, offset)
+                offset += INTERACTION_RECORD.size
+
+                correct = int.from_bytes(data[offset:offset+self.mask_bytes], "little")
+                offset += self.mask_bytes
+
+                yield (op, t, source, capability, target, OUTCOMES[outcome], correct)
+
+            else:
+                raise ValueError(f"Unknown operation {op} at offset {offset}")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import numpy as np
+
+from simulation.stack_distance import BUFFERS, CoverageCurves, max_buffer_sizes
+from simulation.trace import TraceReader
+
+def write_dat(path: str, curves: CoverageCurves, header: dict, args):
+    max_size = max(curves.max_sizes.values())
+
+    def padded(buffer: str) -> str:
+        coverage = curves.coverage(buffer)
+        # Larger buffers than there are items cannot hold any more
+        coverage = np.concatenate((coverage, np.full(max_size + 1 - len(coverage), coverage[-1])))
+        return "[" + ", ".join(f"{value:.6f}" for value in coverage) + "]"
+
+    with open(path, "w") as f:
+        print(f"num_agents = {len(header['agents'])};", file=f)
+        print(f"num_capabilities = {len(header['capabilities'])};", file=f)
+        print(file=f)
+        print(f"crypto_size = {args.crypto_size};", file=f)
+        print(f"trust_model_size = {args.trust_model_size}; // BRS", file=f)
+        print(f"total_memory_size_available = {args.total_memory};", file=f)
+        print(file=f)
+        print(f"num_buffers = {len(BUFFERS)};", file=f)
+        print(file=f)
+        print(f"buffer_weights = [{', '.join(str(weight) for weight in args.weights)}];", file=f)
+        print(file=f)
+        print(f"max_buffer_size = {max_size};", file=f)
+        print(f"max_buffer_sizes = [{', '.join(str(curves.max_sizes[buffer]) for buffer in BUFFERS)}];", file=f)
+        print(file=f)
+        print("// Fraction of references held by LRU buffers of size 0 to max_buffer_size, measured by stack_distances.py", file=f)
+        print("coverage = [", file=f)
+        for (n, buffer) in enumerate(BUFFERS):
+            separator = "," if n + 1 < len(BUFFERS) else ""
+            print(f"    {padded(buffer)}{separator} // {buffer}", file=f)
+        print("];", file=f)
+
+def main(args):
+    curves = None
+    header = None
+
+    for path in args.traces:
+        trace = TraceReader(path)
+
+        if curves is None:
+            header = trace.header
+            curves = CoverageCurves(max_buffer_sizes(header))
+        elif max_buffer_sizes(trace.header) != curves.max_sizes:
+            raise ValueError(f"{path} has a different number of agents or capabilities to {args.traces[0]}")
+
+        curves.update(trace)
+
+    for buffer in BUFFERS:
+        coverage = curves.coverage(buffer)
+
+        print(f"{buffer} ({curves.references(buffer)} references)")
+        for (size, value) in enumerate(coverage):
+            print(f"    {size:>3} {value:.4f}")
+
+    if args.dat is not None:
+        write_dat(args.dat, curves, header, args)
+        print(f"Written {args.dat}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Calculate how much of each buffer\'s references LRU buffers of every size would hold, using the stack distances in traces')
+    parser.add_argument('traces', type=str, nargs='+',
+                        help='Traces recorded by run_simulation.py --trace, ideally with complete buffers')
+    parser.add_argument('--dat', type=str, default=None,
+                        help='Write the coverage curves as data for "Buffer Size/Buffer Size Curves.mod"')
+
+    parser.add_argument('--crypto-size', type=int, default=160,
+                        help='The size of a crypto item')
+    parser.add_argument('--trust-model-size', type=int, default=8,
+                        help='The size of a trust model')
+    parser.add_argument('--total-memory', type=int, default=1024,
+                        help='The total memory available for buffers')
+    parser.add_argument('--weights', type=int, nargs=4, default=[1, 1, 1, 1], metavar=('crypto', 'trust', 'reputation', 'stereotype'),
+                        help='The weight of each buffer in the objective')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sqlite3
+import time
+from typing import List, Optional, Tuple
+
+class WorkQueue:
+    """
+    A durable queue of (configuration, seed) jobs backed by SQLite.
+
+    Jobs are pending, claimed, done or failed. Several runner processes, on this
+    host or on other hosts sharing the database file, can claim jobs concurrently.
+    A claimed job is given back to the queue when the process that claimed it is
+    known to have died, or when its lease expires. SQLite's write-ahead log needs
+    shared memory, so the default rollback journal is used to allow the file to
+    live on a shared filesystem.
+    """
+    def __init__(self, path: str, lease: float=24*60*60, max_attempts: int=3):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+
+        self.conn = sqlite3.connect(path, timeout=120, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                configuration TEXT NOT NULL,
+                seed INTEGER NOT NULL,
+                argv TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                claimed_by TEXT,
+                claimed_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                PRIMARY KEY (configuration, seed)
+            )""")
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, jobs: List[Tuple[str, int, List[str]]]) -> int:
+        """Add jobs, ignoring any (configuration, seed) that is already queued"""
+        before = self.conn.total_changes
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO jobs (configuration, seed, argv) VALUES (?, ?, ?)",
+            [(configuration, seed, json.dumps(argv)) for (configuration, seed, argv) in jobs])
+        self.conn.execute("COMMIT")
+
+        return self.conn.total_changes - before
+
+    def _requeue_dead(self):
+        # Processes on this host that claimed a job and then died
+        host = socket.gethostname()
+
+        for (configuration, seed, claimed_by) in self.conn.execute(
+                "SELECT configuration, seed, claimed_by FROM jobs WHERE state = 'claimed' AND claimed_by LIKE ?", (f"{host}:%",)).fetchall():
+            pid = int(claimed_by.rsplit(":", 1)[1])
+
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                self._release(configuration, seed, f"Worker {claimed_by} died")
+            except PermissionError:
+                # The process exists, but belongs to someone else
+                pass
+
+        # Claims that have outlived their lease, from any host
+        for (configuration, seed, claimed_by) in self.conn.execute(
+                "SELECT configuration, seed, claimed_by FROM jobs WHERE state = 'claimed' AND claimed_at < ?", (time.time() - self.lease,)).fetchall():
+            self._release(configuration, seed, f"Lease of {claimed_by} expired")
+
+    def _release(self, configuration: str, seed: int, error: str):
+        self.conn.execute(
+            "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, claimed_by = NULL, claimed_at = NULL, error = ? "
+            "WHERE configuration = ? AND seed = ?", (self.max_attempts, error, configuration, seed))
+
+    def claim(self) -> Optional[Tuple[str, int, List[str]]]:
+        """Claim the next pending job, or return None when there are none left"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._requeue_dead()
+
+            row = self.conn.execute(
+                "SELECT configuration, seed, argv FROM jobs WHERE state = 'pending' ORDER BY attempts, rowid LIMIT 1").fetchone()
+
+            if row is not None:
+                self.conn.execute(
+                    "UPDATE jobs SET state = 'claimed', claimed_by = ?, claimed_at = ?, attempts = attempts + 1 "
+                    "WHERE configuration = ? AND seed = ?", (self.worker, time.time(), row[0], row[1]))
+
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        if row is None:
+            return None
+
+        (configuration, seed, argv) = row
+        return (configuration, seed, json.loads(argv))
+
+    def done(self, configuration: str, seed: int):
+        self.conn.execute(
+            "UPDATE jobs SET state = 'done', claimed_by = NULL, error = NULL WHERE configuration = ? AND seed = ?", (configuration, seed))
+
+    def failed(self, configuration: str, seed: int, error: str):
+        self.conn.execute("BEGIN IMMEDIATE")
+        self._release(configuration, seed, error)
+        self.conn.execute("COMMIT")
+
+    def retry_failed(self) -> int:
+        cursor = self.conn.execute("UPDATE jobs SET state = 'pending', attempts = 0 WHERE state = 'failed'")
+        return cursor.rowcount
+
+    def counts(self) -> dict:
+        return dict(self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())